@@ -3,14 +3,37 @@ DeepSeek-OCR Flask API 主應用程式
 提供圖片 OCR 辨識服務
 """
 
-from flask import Flask, request, jsonify, render_template
+import time
+
+# 在匯入 Flask 之前記錄，啟動耗時包含所有匯入
+process_started_at = time.time()
+
+from flask import Flask, Request, Response, g, request, jsonify, render_template, stream_with_context
 from werkzeug.utils import secure_filename
+import atexit
+import io
+import json
 import os
 from datetime import datetime
-from ocr_service import DeepSeekOCRService
 from config import Config
+from job_queue import OCRJobQueue, QueueFullError
+from replica_pool import ReplicaPool, resolve_devices
+from metrics import REGISTRY, family, render
+from service_loader import ServiceLoader
+from compile_cache import CompileArtifacts
+# torch、transformers 等推理套件由 ocr_core 在背景載入時才匯入（見 build_ocr_service），HTTP 伺服器不需要等待
+
+
+
+class InMemoryRequest(Request):
+    """上傳檔案一律保留在記憶體中，不寫入暫存檔（大小已由 MAX_CONTENT_LENGTH 限制）"""
+    
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return io.BytesIO()
+
 
 app = Flask(__name__)
+app.request_class = InMemoryRequest
 
 # 設定 JSON 輸出為 UTF-8，不轉義 ASCII
 app.config['JSON_AS_ASCII'] = False
@@ -18,12 +41,8 @@ app.config['JSONIFY_MIMETYPE'] = 'application/json; charset=utf-8'
 
 # 配置設定
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 限制上傳檔案大小為 16MB
-app.config['UPLOAD_FOLDER'] = 'uploads'
 app.config['ALLOWED_EXTENSIONS'] = {'png', 'jpg', 'jpeg', 'gif', 'bmp', 'webp'}
 
-# 確保上傳目錄存在
-os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-
 # 讀取 OCR 設定（從 config.py）
 ocr_timeout = int(os.environ.get('OCR_TIMEOUT', 300))
 ocr_base_size = Config.OCR_BASE_SIZE
@@ -31,26 +50,235 @@ ocr_image_size = Config.OCR_IMAGE_SIZE
 ocr_crop_mode = Config.OCR_CROP_MODE
 ocr_test_compress = Config.OCR_TEST_COMPRESS
 ocr_save_results = Config.OCR_SAVE_RESULTS
+ocr_batch_max_size = Config.OCR_BATCH_MAX_SIZE
+ocr_batch_max_wait_ms = Config.OCR_BATCH_MAX_WAIT_MS
+ocr_max_concurrent = Config.OCR_MAX_CONCURRENT
+ocr_cache_enabled = Config.OCR_CACHE_ENABLED
+ocr_backend = Config.OCR_BACKEND
 
+print(f"OCR 推理後端: {ocr_backend}")
 print(f"OCR 超時設定: {ocr_timeout} 秒")
 print(f"OCR 圖片處理參數:")
 print(f"  - base_size: {ocr_base_size}")
 print(f"  - image_size: {ocr_image_size}")
 print(f"  - crop_mode: {ocr_crop_mode}")
+print(f"  - resolution_mode: {Config.OCR_RESOLUTION_MODE}（最高 {Config.OCR_ADAPTIVE_MAX_PRESET}）")
 print(f"  - test_compress: {ocr_test_compress}")
 print(f"  - save_results: {ocr_save_results}")
+print(f"  - batch_max_size: {ocr_batch_max_size}")
+print(f"  - batch_max_wait_ms: {ocr_batch_max_wait_ms}")
+print(f"  - max_concurrent: {ocr_max_concurrent}")
+print(f"  - cache_enabled: {ocr_cache_enabled}")
+print(f"  - vision_cache_mb: {Config.OCR_VISION_CACHE_MB}")
+print(f"  - prompt_cache_size: {Config.OCR_PROMPT_CACHE_SIZE}（常用提示詞 {len(Config.OCR_HOT_PROMPTS)} 個）")
+print(f"  - preprocess_workers: {Config.OCR_PREPROCESS_WORKERS}")
+print(f"  - memory_admission: {Config.OCR_MEMORY_ADMISSION}（budget_mb={Config.OCR_MEMORY_BUDGET_MB or '自動'}）")
+print(f"  - memory_release_policy: {Config.OCR_MEMORY_RELEASE_POLICY}")
+print(f"  - repetition_stop: {Config.OCR_REPETITION_STOP}（ngram_size={Config.OCR_NGRAM_SIZE}, window_size={Config.OCR_WINDOW_SIZE}）")
+print(f"  - max_tokens: {Config.OCR_MAX_TOKENS}（token_budget={Config.OCR_TOKEN_BUDGET}）")
+print(f"  - precheck: {Config.OCR_PRECHECK}（min_edge_density={Config.OCR_PRECHECK_MIN_EDGE_DENSITY}, "
+      f"min_contrast={Config.OCR_PRECHECK_MIN_CONTRAST}, min_sharpness={Config.OCR_PRECHECK_MIN_SHARPNESS}）")
+print(f"  - devices: {Config.OCR_DEVICES or '(單一行程)'}")
+print(f"  - warmup: {Config.OCR_WARMUP}")
+print(f"  - compile_cache_dir: {Config.OCR_COMPILE_CACHE_DIR or '(停用)'}")
 
-# 初始化 OCR 服務
-print("正在初始化 DeepSeek-OCR 服務...")
-ocr_service = DeepSeekOCRService(
+# OCR 服務參數
+service_kwargs = dict(
     ocr_timeout=ocr_timeout,
     base_size=ocr_base_size,
     image_size=ocr_image_size,
     crop_mode=ocr_crop_mode,
     test_compress=ocr_test_compress,
-    save_results=ocr_save_results
+    save_results=ocr_save_results,
+    batch_max_size=ocr_batch_max_size,
+    batch_max_wait_ms=ocr_batch_max_wait_ms,
+    max_concurrent_inferences=ocr_max_concurrent,
+    cache_enabled=ocr_cache_enabled,
+    cache_memory_items=Config.OCR_CACHE_MEMORY_ITEMS,
+    cache_dir=Config.OCR_CACHE_DIR or None,
+    cache_disk_max_mb=Config.OCR_CACHE_DISK_MAX_MB,
+    backend=ocr_backend,
+    timing_window=Config.OCR_TIMING_WINDOW,
+    preprocess_workers=Config.OCR_PREPROCESS_WORKERS,
+    prefetch_depth=Config.OCR_PREFETCH_DEPTH,
+    resolution_mode=Config.OCR_RESOLUTION_MODE,
+    adaptive_max_preset=Config.OCR_ADAPTIVE_MAX_PRESET,
+    vision_cache_mb=Config.OCR_VISION_CACHE_MB,
+    prompt_cache_size=Config.OCR_PROMPT_CACHE_SIZE,
+    hot_prompts=Config.OCR_HOT_PROMPTS,
+    memory_admission=Config.OCR_MEMORY_ADMISSION,
+    memory_budget_mb=Config.OCR_MEMORY_BUDGET_MB,
+    memory_budget_fraction=Config.OCR_MEMORY_BUDGET_FRACTION,
+    memory_release_policy=Config.OCR_MEMORY_RELEASE_POLICY,
+    memory_idle_seconds=Config.OCR_MEMORY_IDLE_SECONDS,
+    memory_pressure_threshold=Config.OCR_MEMORY_PRESSURE_THRESHOLD,
+    repetition_stop=Config.OCR_REPETITION_STOP,
+    repetition_ngram_size=Config.OCR_NGRAM_SIZE,
+    repetition_window_size=Config.OCR_WINDOW_SIZE,
+    max_new_tokens=Config.OCR_MAX_TOKENS,
+    token_budget=Config.OCR_TOKEN_BUDGET,
+    precheck=Config.OCR_PRECHECK,
+    precheck_min_edge_density=Config.OCR_PRECHECK_MIN_EDGE_DENSITY,
+    precheck_min_contrast=Config.OCR_PRECHECK_MIN_CONTRAST,
+    precheck_min_sharpness=Config.OCR_PRECHECK_MIN_SHARPNESS
 )
-print("DeepSeek-OCR 服務初始化完成！")
+if ocr_backend == 'stub':
+    service_kwargs['backend_options'] = dict(
+        prefill_ms=Config.OCR_STUB_PREFILL_MS,
+        ms_per_token=Config.OCR_STUB_MS_PER_TOKEN,
+        output_tokens=Config.OCR_STUB_OUTPUT_TOKENS,
+        memory_mb=Config.OCR_STUB_MEMORY_MB,
+        vision_ms=Config.OCR_STUB_VISION_MS,
+        loop_ratio=Config.OCR_STUB_LOOP_RATIO
+    )
+
+# 載入完成並暖機後才指定，在此之前需要模型的端點回應 503
+ocr_service = None
+
+
+def build_ocr_service(loader):
+    """
+    匯入推理套件、載入模型並暖機（由 ServiceLoader 在背景執行緒中呼叫）
+    
+    Args:
+        loader: ServiceLoader，用來標記各啟動階段
+        
+    Returns:
+        DeepSeekOCRService 或 ReplicaPool
+    """
+    global ocr_service
+    print("正在初始化 DeepSeek-OCR 服務...")
+    with loader.phase('import'):
+        # 編譯快取位置必須在匯入 torch 之前指定（副本與前處理子行程會繼承環境變數）
+        artifacts = None
+        if Config.OCR_COMPILE_CACHE_DIR:
+            artifacts = CompileArtifacts(
+                Config.OCR_COMPILE_CACHE_DIR,
+                # 與 DeepSeekOCRService 的預設值相同
+                service_kwargs.get('model_name', 'unsloth/DeepSeek-OCR'),
+                service_kwargs.get('model_dir', './deepseek_ocr'),
+                settings={
+                    'backend': ocr_backend,
+                    'devices': Config.OCR_DEVICES,
+                    'base_size': ocr_base_size,
+                    'image_size': ocr_image_size,
+                    'crop_mode': ocr_crop_mode,
+                    'resolution_mode': Config.OCR_RESOLUTION_MODE,
+                    'adaptive_max_preset': Config.OCR_ADAPTIVE_MAX_PRESET,
+                    'batch_max_size': ocr_batch_max_size,
+                    'vision_cache': Config.OCR_VISION_CACHE_MB > 0
+                },
+                max_versions=Config.OCR_COMPILE_CACHE_VERSIONS
+            )
+            artifacts.activate()
+            loader.annotate('compile_cache', artifacts.get_status())
+        warmup_shapes = artifacts.get_warmup_shapes() if artifacts is not None else None
+        
+        replica_devices = resolve_devices(Config.OCR_DEVICES, Config.OCR_CPU_REPLICAS)
+        if not replica_devices:
+            from ocr_core import DeepSeekOCRService
+    
+    if replica_devices:
+        # 多副本模式：每個設備一個子行程，請求分派給最空閒的副本；各副本暖機後才回報就緒
+        with loader.phase('model_load'):
+            service = ReplicaPool(
+                'ocr_core',
+                service_kwargs,
+                replica_devices,
+                concurrency_per_replica=max(ocr_batch_max_size, ocr_max_concurrent),
+                ocr_timeout=ocr_timeout,
+                warmup=Config.OCR_WARMUP,
+                warmup_shapes=warmup_shapes
+            )
+    else:
+        with loader.phase('model_load'):
+            service = DeepSeekOCRService(**service_kwargs)
+        if Config.OCR_WARMUP:
+            try:
+                with loader.phase('warmup', state='warming_up'):
+                    service.warm_up(warmup_shapes)
+            except Exception:
+                service.shutdown()
+                raise
+    
+    atexit.register(service.shutdown)
+    if artifacts is not None:
+        artifacts.record_startup(loader.phases, service.get_warmup_shapes())
+        loader.annotate('compile_cache', artifacts.get_status())
+        # 定期與結束時保存實際使用過的輸入尺寸，下次啟動時逐一暖機
+        # （atexit 依註冊的相反順序執行，會在 shutdown 之前）
+        artifacts.start_autosave(service.get_warmup_shapes)
+        atexit.register(lambda: artifacts.save_warmup_shapes(service.get_warmup_shapes()))
+    ocr_service = service
+    print("DeepSeek-OCR 服務初始化完成！")
+    return service
+
+
+service_loader = ServiceLoader(build_ocr_service, started_at=process_started_at)
+service_loader.start()
+
+# 初始化非同步工作佇列（POST /jobs 使用）
+job_queue = OCRJobQueue(
+    lambda job: ocr_service.perform_ocr(
+        job['image'], job['prompt'], image_name=job['image_name'], include_timings=job['include_timings'],
+        max_tokens=job.get('max_tokens')
+    ),
+    max_queue_size=Config.OCR_JOB_QUEUE_SIZE,
+    num_workers=Config.OCR_JOB_WORKERS,
+    result_ttl=Config.OCR_JOB_RESULT_TTL
+)
+atexit.register(job_queue.shutdown)
+print(f"非同步工作佇列: queue_size={Config.OCR_JOB_QUEUE_SIZE}, workers={Config.OCR_JOB_WORKERS}")
+print(f"HTTP 應用程式初始化完成（{time.time() - process_started_at:.2f} 秒），模型在背景載入中")
+
+# HTTP 層指標（endpoint 標籤使用路由規則，例如 /jobs/<job_id>，避免標籤數量無限增加）
+HTTP_REQUESTS = REGISTRY.counter(
+    'ocr_http_requests_total', 'HTTP 請求數', ('endpoint', 'method', 'status')
+)
+HTTP_DURATION = REGISTRY.histogram(
+    'ocr_http_request_duration_seconds', 'HTTP 請求耗時（秒，串流回應計算到送出最後一段）', ('endpoint',)
+)
+HTTP_IN_FLIGHT = REGISTRY.gauge(
+    'ocr_http_requests_in_flight', '處理中的 HTTP 請求數', ('endpoint',)
+)
+
+
+def collect_job_metrics():
+    """將非同步工作佇列統計轉為指標"""
+    stats = job_queue.get_stats()
+    return [
+        family('ocr_jobs_queued', 'gauge', '非同步工作佇列中等待的工作數', [
+            ('ocr_jobs_queued', {}, stats['queue_depth'])
+        ]),
+        family('ocr_jobs_running', 'gauge', '處理中的非同步工作數', [
+            ('ocr_jobs_running', {}, stats['running'])
+        ]),
+        family('ocr_jobs_total', 'counter', '非同步工作數（依結果分類）', [
+            ('ocr_jobs_total', {'outcome': outcome}, stats[outcome])
+            for outcome in ('submitted', 'rejected', 'completed', 'failed')
+        ])
+    ]
+
+
+REGISTRY.register_collector(collect_job_metrics)
+
+
+def collect_startup_metrics():
+    """將模型載入狀態與各啟動階段耗時轉為指標"""
+    startup = service_loader.get_status()
+    start = 'warm' if (startup.get('compile_cache') or {}).get('warm_start') else 'cold'
+    return [
+        family('ocr_ready', 'gauge', '模型是否已載入並完成暖機（1 表示可處理請求）', [
+            ('ocr_ready', {}, 1 if startup['state'] == 'ready' else 0)
+        ]),
+        family('ocr_startup_phase_seconds', 'gauge', '各啟動階段耗時（秒，start 為沿用編譯快取的暖啟動或冷啟動）', [
+            ('ocr_startup_phase_seconds', {'phase': phase, 'start': start}, seconds)
+            for phase, seconds in startup['phases'].items()
+        ])
+    ]
+
+
+REGISTRY.register_collector(collect_startup_metrics)
 
 
 def allowed_file(filename):
@@ -67,6 +295,82 @@ def allowed_file(filename):
            filename.rsplit('.', 1)[1].lower() in app.config['ALLOWED_EXTENSIONS']
 
 
+def timings_requested():
+    """
+    檢查請求是否要求附上各階段耗時（查詢參數或表單欄位 timings=true）
+    
+    Returns:
+        bool: 是否在結果中加入 timings
+    """
+    return request.values.get('timings', '').lower() in ('1', 'true', 'yes')
+
+
+def requested_max_tokens():
+    """
+    取得請求指定的輸出 token 上限（查詢參數或表單欄位 max_tokens）
+    
+    Returns:
+        int: 輸出 token 上限（服務端會限制在 OCR_MAX_TOKENS 以內），未指定時為 None
+    
+    Raises:
+        ValueError: max_tokens 不是正整數
+    """
+    value = request.values.get('max_tokens', '').strip()
+    if not value:
+        return None
+    if not value.isdigit() or int(value) <= 0:
+        raise ValueError(f"max_tokens 必須是正整數，收到: {value}")
+    return int(value)
+
+
+@app.before_request
+def start_request_metrics():
+    """記錄請求開始時間與處理中請求數"""
+    g.metrics_endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    g.metrics_start = time.perf_counter()
+    HTTP_IN_FLIGHT.inc(endpoint=g.metrics_endpoint)
+
+
+@app.after_request
+def finish_request_metrics(response):
+    """在回應送完（包含串流回應）後記錄耗時與狀態碼"""
+    endpoint = g.pop('metrics_endpoint', None)
+    if endpoint is None:
+        return response
+    start = g.pop('metrics_start')
+    method = request.method
+    status = str(response.status_code)
+    
+    def _record():
+        HTTP_IN_FLIGHT.dec(endpoint=endpoint)
+        HTTP_DURATION.observe(time.perf_counter() - start, endpoint=endpoint)
+        HTTP_REQUESTS.inc(endpoint=endpoint, method=method, status=status)
+    
+    response.call_on_close(_record)
+    return response
+
+
+# 需要模型的端點：載入與暖機完成前回應 503
+MODEL_ENDPOINTS = {'perform_ocr', 'stream_ocr', 'perform_batch_ocr', 'submit_job'}
+
+
+@app.before_request
+def require_ready_service():
+    """模型尚未就緒時，需要模型的端點直接回應 503 並附上 Retry-After"""
+    if request.endpoint not in MODEL_ENDPOINTS or service_loader.ready:
+        return None
+    
+    startup = service_loader.get_status()
+    if startup['state'] == 'failed':
+        error_msg = f"OCR 服務載入失敗: {startup['error']}"
+    else:
+        error_msg = "OCR 模型載入中，請稍後再試"
+    print(f"錯誤: {error_msg}")
+    response = jsonify({'error': error_msg, 'startup': startup})
+    response.headers['Retry-After'] = '5'
+    return response, 503
+
+
 @app.route('/')
 def index():
     """
@@ -78,21 +382,89 @@ def index():
     return render_template('index.html')
 
 
+@app.route('/livez', methods=['GET'])
+def liveness_check():
+    """
+    存活檢查端點：HTTP 伺服器可以回應即為存活（模型載入中也是）；
+    模型載入失敗時回應 503，讓協調器重新啟動行程
+    
+    Returns:
+        JSON 回應包含載入狀態
+    """
+    state = service_loader.state
+    if state == 'failed':
+        return jsonify({'status': 'failed', 'state': state}), 503
+    return jsonify({'status': 'alive', 'state': state}), 200
+
+
+@app.route('/readyz', methods=['GET'])
+def readiness_check():
+    """
+    就緒檢查端點：模型載入與暖機完成（多副本模式下至少一個副本可用）時回應 200，否則 503
+    
+    Returns:
+        JSON 回應包含載入狀態與各啟動階段耗時
+    """
+    startup = service_loader.get_status()
+    ready = service_loader.ready
+    if ready and isinstance(ocr_service, ReplicaPool):
+        ready = ocr_service.get_replica_stats()['healthy'] > 0
+    return jsonify({'status': 'ready' if ready else 'not_ready', 'startup': startup}), 200 if ready else 503
+
+
 @app.route('/health', methods=['GET'])
 def health_check():
     """
-    健康檢查端點
+    健康檢查端點（模型載入或暖機中時回應 503 與目前的載入狀態）
     
     Returns:
         JSON 回應包含服務狀態
     """
+    startup = service_loader.get_status()
+    if not service_loader.ready:
+        return jsonify({
+            'status': startup['state'],
+            'service': 'DeepSeek-OCR API',
+            'backend': ocr_backend,
+            'timestamp': datetime.now().isoformat(),
+            'startup': startup,
+            'jobs': job_queue.get_stats()
+        }), 503
+    
     return jsonify({
         'status': 'healthy',
         'service': 'DeepSeek-OCR API',
-        'timestamp': datetime.now().isoformat()
+        'backend': ocr_backend,
+        'timestamp': datetime.now().isoformat(),
+        'startup': startup,
+        'batching': ocr_service.get_batch_stats(),
+        'cache': ocr_service.get_cache_stats(),
+        'vision_cache': ocr_service.get_vision_cache_stats(),
+        'memory': ocr_service.get_memory_stats(),
+        'allocator': ocr_service.get_allocator_stats(),
+        'repetition': ocr_service.get_repetition_stats(),
+        'jobs': job_queue.get_stats(),
+        'timings': ocr_service.get_stage_stats(),
+        'replicas': ocr_service.get_replica_stats() if isinstance(ocr_service, ReplicaPool) else None
     })
 
 
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """
+    Prometheus 指標端點
+    
+    多副本模式下會合併各副本的指標（以 replica 標籤區分）
+    
+    Returns:
+        text/plain 回應（Prometheus text exposition format 0.0.4）
+    """
+    families = REGISTRY.collect()
+    if service_loader.ready and isinstance(ocr_service, ReplicaPool):
+        families.extend(ocr_service.export_metrics())
+    return Response(render(families), mimetype='text/plain; version=0.0.4')
+
+
 @app.route('/ocr', methods=['POST'])
 def perform_ocr():
     """
@@ -103,6 +475,8 @@ def perform_ocr():
     Request:
         - file: 圖片檔案（multipart/form-data）
         - prompt (optional): 自訂提示詞，預設為 "<image>\nFree OCR."
+        - timings (optional): 設為 true 時在結果中附上各階段耗時（毫秒）
+        - max_tokens (optional): 輸出 token 上限（最多 OCR_MAX_TOKENS），預設依圖片估計
         
     Returns:
         JSON 回應包含 OCR 文字結果
@@ -129,18 +503,18 @@ def perform_ocr():
     
     # 取得自訂提示詞（如果有）
     custom_prompt = request.form.get('prompt', None)
+    try:
+        max_tokens = requested_max_tokens()
+    except ValueError as e:
+        print(f"錯誤: {e}")
+        return jsonify({'error': str(e)}), 400
     
-    # 儲存上傳的檔案
+    # 直接從記憶體讀取上傳的檔案，不寫入磁碟
     filename = secure_filename(file.filename)
-    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-    unique_filename = f"{timestamp}_{filename}"
-    filepath = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
-    
-    print(f"正在儲存上傳的檔案: {filepath}")
-    file.save(filepath)
+    image_bytes = file.read()
     
     # 執行 OCR
-    print(f"開始執行 OCR 辨識: {filepath}")
+    print(f"開始執行 OCR 辨識: {filename} ({len(image_bytes)} bytes)")
     
     # 執行 OCR 並捕獲可能的錯誤（包括超時錯誤）
     result = None
@@ -148,13 +522,16 @@ def perform_ocr():
     from concurrent.futures import TimeoutError as FuturesTimeoutError
     
     try:
-        result = ocr_service.perform_ocr(filepath, custom_prompt)
+        result = ocr_service.perform_ocr(
+            image_bytes, custom_prompt, image_name=filename, include_timings=timings_requested(),
+            max_tokens=max_tokens
+        )
     except FuturesTimeoutError as timeout_err:
         error_info = f"OCR 處理超時 (超過 {ocr_service.ocr_timeout} 秒)，請嘗試使用更小的圖片或增加超時設定"
         print(f"======== OCR 超時錯誤 ========")
         print(f"錯誤類型: TimeoutError")
         print(f"錯誤訊息: {error_info}")
-        print(f"圖片路徑: {filepath}")
+        print(f"圖片名稱: {filename}")
         print(f"超時設定: {ocr_service.ocr_timeout} 秒")
         print(f"============================")
     except Exception as general_err:
@@ -162,20 +539,15 @@ def perform_ocr():
         print(f"======== OCR 執行錯誤 ========")
         print(f"錯誤類型: {type(general_err).__name__}")
         print(f"錯誤訊息: {str(general_err)}")
-        print(f"圖片路徑: {filepath}")
+        print(f"圖片名稱: {filename}")
         print(f"============================")
         import traceback
         print(f"錯誤詳情:\n{traceback.format_exc()}")
     
-    # 刪除暫存檔案
-    if os.path.exists(filepath):
-        os.remove(filepath)
-        print(f"已刪除暫存檔案: {filepath}")
-    
     # 檢查是否有錯誤
     if error_info:
         print(f"返回錯誤響應: {error_info}")
-        return jsonify({'error': error_info, 'image_path': filepath}), 500
+        return jsonify({'error': error_info, 'image_path': filename}), 500
     elif result and 'error' in result:
         error_msg = result['error']
         print(f"OCR 執行錯誤: {error_msg}")
@@ -185,6 +557,66 @@ def perform_ocr():
     return jsonify(result), 200
 
 
+@app.route('/ocr/stream', methods=['POST'])
+def stream_ocr():
+    """
+    串流執行 OCR 辨識（Server-Sent Events）
+    
+    生成過程中逐段送出辨識文字，首段文字約在預填（prefill）完成後即送出
+    
+    Request:
+        - file: 圖片檔案（multipart/form-data）
+        - prompt (optional): 自訂提示詞
+        - max_tokens (optional): 輸出 token 上限（最多 OCR_MAX_TOKENS），預設依圖片估計
+        
+    Returns:
+        text/event-stream 回應，事件類型為 token、done、error
+    """
+    # 檢查是否有上傳檔案
+    if 'file' not in request.files:
+        error_msg = "請求中沒有檔案部分"
+        print(f"錯誤: {error_msg}")
+        return jsonify({'error': error_msg}), 400
+    
+    file = request.files['file']
+    
+    # 檢查檔案名稱
+    if file.filename == '':
+        error_msg = "未選擇檔案"
+        print(f"錯誤: {error_msg}")
+        return jsonify({'error': error_msg}), 400
+    
+    # 檢查檔案類型
+    if not allowed_file(file.filename):
+        error_msg = f"不支援的檔案類型。允許的類型: {', '.join(app.config['ALLOWED_EXTENSIONS'])}"
+        print(f"錯誤: {error_msg}, 收到檔案: {file.filename}")
+        return jsonify({'error': error_msg}), 400
+    
+    # 在開始串流前讀取所有請求資料
+    custom_prompt = request.form.get('prompt', None)
+    try:
+        max_tokens = requested_max_tokens()
+    except ValueError as e:
+        print(f"錯誤: {e}")
+        return jsonify({'error': str(e)}), 400
+    filename = secure_filename(file.filename)
+    image_bytes = file.read()
+    
+    def generate_events():
+        for event in ocr_service.stream_ocr(image_bytes, custom_prompt, image_name=filename, max_tokens=max_tokens):
+            event_type = event.pop('event')
+            yield f"event: {event_type}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+    
+    return Response(
+        generate_events(),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'  # 避免反向代理緩衝串流內容
+        }
+    )
+
+
 @app.route('/ocr/batch', methods=['POST'])
 def perform_batch_ocr():
     """
@@ -195,6 +627,10 @@ def perform_batch_ocr():
     Request:
         - files: 多個圖片檔案（multipart/form-data）
         - prompt (optional): 自訂提示詞
+        - stream (optional): 設為 true（或 Accept: application/x-ndjson）時改為 NDJSON 串流，
+          每張圖片完成即輸出一行結果
+        - timings (optional): 設為 true 時在每張圖片的結果中附上各階段耗時（毫秒）
+        - max_tokens (optional): 每張圖片的輸出 token 上限（最多 OCR_MAX_TOKENS），預設依各圖片估計
         
     Returns:
         JSON 回應包含多個 OCR 文字結果
@@ -214,12 +650,17 @@ def perform_batch_ocr():
     
     # 取得自訂提示詞（如果有）
     custom_prompt = request.form.get('prompt', None)
+    include_timings = timings_requested()
+    try:
+        max_tokens = requested_max_tokens()
+    except ValueError as e:
+        print(f"錯誤: {e}")
+        return jsonify({'error': str(e)}), 400
     
-    # 儲存所有上傳的檔案
-    filepaths = []
-    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    # 篩選有效的圖片檔案
+    valid_files = []
     
-    for idx, file in enumerate(files):
+    for file in files:
         if file.filename == '':
             continue
             
@@ -228,33 +669,156 @@ def perform_batch_ocr():
             print(f"錯誤: {error_msg}")
             continue
         
-        filename = secure_filename(file.filename)
-        unique_filename = f"{timestamp}_{idx}_{filename}"
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
-        
-        print(f"正在儲存上傳的檔案 {idx+1}: {filepath}")
-        file.save(filepath)
-        filepaths.append(filepath)
+        valid_files.append(file)
     
-    if len(filepaths) == 0:
+    if len(valid_files) == 0:
         error_msg = "沒有有效的圖片檔案"
         print(f"錯誤: {error_msg}")
         return jsonify({'error': error_msg}), 400
     
-    # 執行批次 OCR
-    print(f"開始執行批次 OCR 辨識，共 {len(filepaths)} 個檔案")
-    results = ocr_service.perform_batch_ocr(filepaths, custom_prompt)
+    # NDJSON 串流模式：每張圖片完成即輸出一行，不累積整批結果
+    stream_param = request.args.get('stream', request.form.get('stream', ''))
+    if stream_param.lower() in ('1', 'true', 'yes') or 'application/x-ndjson' in request.headers.get('Accept', ''):
+        print(f"開始串流批次 OCR 辨識，共 {len(valid_files)} 個檔案")
+        
+        # 上傳檔案會在視圖返回時關閉，必須先取出內容；逐個讀取後立即關閉，
+        # 上傳內容本來就保留在記憶體中（InMemoryRequest），不會增加峰值用量
+        uploads = []
+        for file in valid_files:
+            uploads.append((file.read(), secure_filename(file.filename)))
+            file.close()
+        
+        def iter_uploads():
+            # 交給推理後即移除參照，已處理的圖片可以立即釋放
+            while uploads:
+                yield uploads.pop(0)
+        
+        def generate_lines():
+            success_count = 0
+            for result in ocr_service.iter_batch_ocr(
+                    iter_uploads(), custom_prompt, include_timings=include_timings, max_tokens=max_tokens):
+                if 'error' not in result:
+                    success_count += 1
+                yield json.dumps(dict(result, type='result'), ensure_ascii=False) + '\n'
+            
+            print(f"串流批次 OCR 辨識完成，成功 {success_count}/{len(valid_files)}")
+            yield json.dumps({
+                'type': 'summary',
+                'total': len(valid_files),
+                'success': success_count,
+                'failed': len(valid_files) - success_count
+            }, ensure_ascii=False) + '\n'
+        
+        return Response(
+            stream_with_context(generate_lines()),
+            mimetype='application/x-ndjson',
+            headers={'X-Accel-Buffering': 'no'}
+        )
     
-    # 刪除暫存檔案
-    for filepath in filepaths:
-        if os.path.exists(filepath):
-            os.remove(filepath)
-            print(f"已刪除暫存檔案: {filepath}")
+    # 直接從記憶體讀取所有上傳的檔案，不寫入磁碟
+    images = []
+    image_names = []
+    
+    for idx, file in enumerate(valid_files):
+        filename = secure_filename(file.filename)
+        images.append(file.read())
+        image_names.append(filename)
+        print(f"已讀取上傳的檔案 {idx+1}: {filename}")
+    
+    # 執行批次 OCR
+    print(f"開始執行批次 OCR 辨識，共 {len(images)} 個檔案")
+    results = ocr_service.perform_batch_ocr(
+        images, custom_prompt, image_names=image_names, include_timings=include_timings, max_tokens=max_tokens
+    )
     
     print(f"批次 OCR 辨識完成，共處理 {len(results)} 個檔案")
     return jsonify({'results': results, 'total': len(results)}), 200
 
 
+@app.route('/jobs', methods=['POST'])
+def submit_job():
+    """
+    提交非同步 OCR 工作
+    
+    立即返回工作 ID，不等待推理完成；佇列已滿時回應 429 並附上 Retry-After
+    
+    Request:
+        - file: 圖片檔案（multipart/form-data）
+        - prompt (optional): 自訂提示詞
+        - timings (optional): 設為 true 時在工作結果中附上各階段耗時（毫秒）
+        - max_tokens (optional): 輸出 token 上限（最多 OCR_MAX_TOKENS），預設依圖片估計
+        
+    Returns:
+        JSON 回應包含工作 ID 與查詢網址（HTTP 202）
+    """
+    # 檢查是否有上傳檔案
+    if 'file' not in request.files:
+        error_msg = "請求中沒有檔案部分"
+        print(f"錯誤: {error_msg}")
+        return jsonify({'error': error_msg}), 400
+    
+    file = request.files['file']
+    
+    # 檢查檔案名稱
+    if file.filename == '':
+        error_msg = "未選擇檔案"
+        print(f"錯誤: {error_msg}")
+        return jsonify({'error': error_msg}), 400
+    
+    # 檢查檔案類型
+    if not allowed_file(file.filename):
+        error_msg = f"不支援的檔案類型。允許的類型: {', '.join(app.config['ALLOWED_EXTENSIONS'])}"
+        print(f"錯誤: {error_msg}, 收到檔案: {file.filename}")
+        return jsonify({'error': error_msg}), 400
+    
+    filename = secure_filename(file.filename)
+    try:
+        max_tokens = requested_max_tokens()
+    except ValueError as e:
+        print(f"錯誤: {e}")
+        return jsonify({'error': str(e)}), 400
+    
+    try:
+        job_id = job_queue.submit({
+            'image': file.read(),
+            'prompt': request.form.get('prompt', None),
+            'image_name': filename,
+            'include_timings': timings_requested(),
+            'max_tokens': max_tokens
+        })
+    except QueueFullError as e:
+        print(f"錯誤: {e}")
+        response = jsonify({'error': str(e), 'retry_after': e.retry_after})
+        response.headers['Retry-After'] = str(e.retry_after)
+        return response, 429
+    
+    print(f"已排入 OCR 工作: {job_id} ({filename})")
+    status_url = f"/jobs/{job_id}"
+    response = jsonify({'job_id': job_id, 'status': 'queued', 'status_url': status_url})
+    response.headers['Location'] = status_url
+    return response, 202
+
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """
+    查詢非同步 OCR 工作狀態
+    
+    Args:
+        job_id: POST /jobs 返回的工作 ID
+        
+    Returns:
+        JSON 回應包含工作狀態（queued / running / done / failed）與結果
+    """
+    job = job_queue.get(job_id)
+    if job is None:
+        error_msg = f"找不到工作: {job_id}"
+        print(f"錯誤: {error_msg}")
+        return jsonify({'error': error_msg}), 404
+    
+    return jsonify(job), 200
+
+
 @app.errorhandler(413)
 def request_entity_too_large(error):
     """處理檔案過大錯誤"""
@@ -0,0 +1,162 @@
+"""
+微批次排程器
+在短時間視窗內收集並發的 OCR 請求，合併為一次批次推理後再將結果分送回各請求
+"""
+
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+
+class MicroBatchScheduler:
+    """
+    微批次排程器
+
+    背景執行緒等待第一個請求到達後，最多再等待 max_wait_ms 毫秒收集更多請求，
+    湊滿 max_batch_size 或等待逾時即執行一次批次推理
+    """
+
+    def __init__(self, run_batch, max_batch_size=4, max_wait_ms=20, name='ocr-batch-scheduler'):
+        """
+        初始化微批次排程器
+
+        Args:
+            run_batch: 批次執行函數，接收請求列表並回傳相同順序的結果列表
+            max_batch_size: 單一批次最多包含的請求數
+            max_wait_ms: 收到第一個請求後最多等待的毫秒數
+            name: 背景執行緒名稱
+        """
+        self.run_batch = run_batch
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait_ms = max(0, int(max_wait_ms))
+
+        self._queue = queue.Queue()
+        self._stats_lock = threading.Lock()
+        self._batch_size_histogram = {}
+        self._total_batches = 0
+        self._total_requests = 0
+        self._total_wait_seconds = 0.0
+        self._running = True
+
+        self._worker = threading.Thread(target=self._worker_loop, name=name, daemon=True)
+        self._worker.start()
+
+    def submit(self, item):
+        """
+        提交一個請求
+
+        Args:
+            item: 傳給 run_batch 的請求內容
+
+        Returns:
+            Future: 完成後可取得該請求的結果
+        """
+        if not self._running:
+            raise RuntimeError("微批次排程器已關閉")
+
+        future = Future()
+        self._queue.put((item, future, time.time()))
+        return future
+
+    def _collect_batch(self):
+        """
+        阻塞等待第一個請求，再於時間視窗內收集其餘請求
+
+        Returns:
+            tuple: (請求列表, 是否收到關閉訊號)
+        """
+        first = self._queue.get()
+        if first is None:
+            return [], True
+
+        batch = [first]
+        deadline = time.time() + self.max_wait_ms / 1000.0
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            try:
+                entry = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if entry is None:
+                # 關閉訊號：處理完目前批次後結束
+                return batch, True
+            batch.append(entry)
+        return batch, False
+
+    def _worker_loop(self):
+        """背景執行緒主迴圈"""
+        while True:
+            batch, stop = self._collect_batch()
+
+            # 跳過呼叫端已取消的請求
+            batch = [entry for entry in batch if entry[1].set_running_or_notify_cancel()]
+            if batch:
+                self._run(batch)
+
+            if stop:
+                break
+
+    def _run(self, batch):
+        """執行一個批次並將結果分送回各請求"""
+        started_at = time.time()
+        items = [item for item, _, _ in batch]
+
+        with self._stats_lock:
+            size = len(batch)
+            self._batch_size_histogram[size] = self._batch_size_histogram.get(size, 0) + 1
+            self._total_batches += 1
+            self._total_requests += size
+            self._total_wait_seconds += sum(started_at - submitted_at for _, _, submitted_at in batch)
+
+        print(f"執行微批次推理，批次大小: {len(batch)}")
+
+        try:
+            results = self.run_batch(items)
+        except Exception as e:
+            for _, future, _ in batch:
+                future.set_exception(e)
+            return
+
+        for (_, future, _), result in zip(batch, results):
+            future.set_result(result)
+
+    def get_stats(self):
+        """
+        取得批次統計資訊
+
+        Returns:
+            dict: 批次大小分佈與平均值
+        """
+        with self._stats_lock:
+            total_batches = self._total_batches
+            total_requests = self._total_requests
+            return {
+                'enabled': True,
+                'max_batch_size': self.max_batch_size,
+                'max_wait_ms': self.max_wait_ms,
+                'total_batches': total_batches,
+                'total_requests': total_requests,
+                'avg_batch_size': round(total_requests / total_batches, 2) if total_batches else 0,
+                'avg_queue_wait_ms': round(self._total_wait_seconds / total_requests * 1000, 2) if total_requests else 0,
+                'batch_size_histogram': {
+                    str(size): count for size, count in sorted(self._batch_size_histogram.items())
+                },
+                'pending': self._queue.qsize()
+            }
+
+    def shutdown(self, wait=True):
+        """
+        關閉排程器，已提交的請求仍會被處理
+
+        Args:
+            wait: 是否等待背景執行緒結束
+        """
+        if not self._running:
+            return
+        self._running = False
+        self._queue.put(None)
+        if wait:
+            self._worker.join()
@@ -0,0 +1,679 @@
+"""
+DeepSeek-OCR API 壓力測試與延遲基準
+
+以合成圖片語料對 /ocr、/ocr/batch、/ocr/stream 與 /jobs 施加負載，支援兩種負載模型：
+- closed（封閉迴圈）：固定數量的客戶端，每個客戶端收到回應後才送出下一個請求
+- open（開放迴圈）：請求依 Poisson 過程以固定平均速率到達，不受伺服器回應速度影響
+
+輸出吞吐量、p50/p95/p99 延遲、錯誤/超時比例與排隊延遲，並可寫入 JSON 以便跨版本比較；
+加上 --timings 時另外彙總伺服器回報的各階段耗時（preprocess、prefill 等），用來比較單一階段的優化效果。
+
+使用範例:
+    # 不需要 GPU：自動啟動使用 stub 推理後端的服務
+    python benchmark.py --serve-stub --mode closed --concurrency 8 --requests 200
+
+    # 對已啟動的服務以每秒 2 個請求的速率測試非同步工作 API 60 秒
+    python benchmark.py --url http://localhost:5000 --endpoint jobs --mode open --rate 2 --duration 60
+
+    # 與先前的結果比較
+    python benchmark.py --serve-stub --output new.json --compare baseline.json
+
+    # 比較提示詞 tokenize 結果快取對前處理階段的影響
+    python benchmark.py --url http://localhost:5000 --timings --output on.json
+    python benchmark.py --url http://localhost:5000 --timings --compare on.json  # 以 OCR_PROMPT_CACHE_SIZE=0 重啟服務後
+"""
+
+import argparse
+import io
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from PIL import Image, ImageDraw
+
+from stage_timings import STAGES
+
+
+ENDPOINTS = ('ocr', 'batch', 'stream', 'jobs')
+
+# 合成圖片使用的文字
+SAMPLE_WORDS = (
+    'INVOICE', 'RECEIPT', 'TOTAL', 'DATE', 'ITEM', 'QTY', 'PRICE', 'TAX', 'AMOUNT', 'NO.',
+    'DeepSeek', 'OCR', 'Order', 'Customer', 'Address', 'Phone', 'Paid', 'Cash', 'Card', 'Change'
+)
+
+
+def build_corpus(size, seed=0, min_side=480, max_side=1600):
+    """
+    產生合成圖片語料（白底黑字的多行文字，尺寸與行數隨機）
+
+    Args:
+        size: 圖片數量
+        seed: 亂數種子（相同種子產生相同語料）
+        min_side: 最短邊長（像素）
+        max_side: 最長邊長（像素）
+
+    Returns:
+        list: (檔名, PNG 位元組) 的列表
+    """
+    rng = random.Random(seed)
+    corpus = []
+    for idx in range(size):
+        width = rng.randint(min_side, max_side)
+        height = rng.randint(min_side, max_side)
+        image = Image.new('RGB', (width, height), 'white')
+        draw = ImageDraw.Draw(image)
+        y = 20
+        while y < height - 30:
+            words = [rng.choice(SAMPLE_WORDS) for _ in range(rng.randint(2, 6))]
+            words.append(f"{rng.randint(0, 99999):,}")
+            draw.text((20, y), ' '.join(words), fill='black')
+            y += rng.randint(18, 40)
+        buffer = io.BytesIO()
+        image.save(buffer, format='PNG')
+        corpus.append((f"bench_{idx:04d}.png", buffer.getvalue()))
+    return corpus
+
+
+def percentile(values, pct):
+    """
+    計算百分位數（線性內插）
+
+    Args:
+        values: 數值列表
+        pct: 百分位（0-100）
+
+    Returns:
+        float: 百分位數，沒有資料時為 None
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * pct / 100.0
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def summarize(values):
+    """
+    彙總延遲分佈（毫秒）
+
+    Args:
+        values: 延遲列表（毫秒）
+
+    Returns:
+        dict: count / mean / p50 / p95 / p99 / max
+    """
+    if not values:
+        return {'count': 0}
+    return {
+        'count': len(values),
+        'mean': round(sum(values) / len(values), 1),
+        'p50': round(percentile(values, 50), 1),
+        'p95': round(percentile(values, 95), 1),
+        'p99': round(percentile(values, 99), 1),
+        'max': round(max(values), 1)
+    }
+
+
+class OCRClient:
+    """
+    呼叫各個 OCR 端點並記錄結果
+
+    每個執行緒使用自己的 requests.Session（連線重用，Session 非執行緒安全）
+    """
+
+    def __init__(self, base_url, timeout=300, batch_size=4, prompt=None, poll_interval=0.2, timings=False):
+        """
+        Args:
+            base_url: 服務網址，例如 http://localhost:5000
+            timeout: 單一請求的客戶端超時秒數（jobs 為等待工作完成的總秒數）
+            batch_size: /ocr/batch 每個請求包含的圖片數
+            prompt: 自訂提示詞（可選）
+            poll_interval: 查詢 /jobs/<id> 的間隔秒數
+            timings: 是否要求伺服器回報各階段耗時
+        """
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.batch_size = max(1, int(batch_size))
+        self.prompt = prompt
+        self.poll_interval = poll_interval
+        self.timings = timings
+        self._local = threading.local()
+
+    def _session(self):
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = requests.Session()
+            self._local.session = session
+        return session
+
+    def _form(self):
+        form = {'prompt': self.prompt} if self.prompt else {}
+        if self.timings:
+            form['timings'] = 'true'
+        return form
+
+    @staticmethod
+    def _stage_ms(timings):
+        """取出回應 timings 中的各項耗時（毫秒）"""
+        return {key: value for key, value in (timings or {}).items() if key.endswith('_ms')}
+
+    def get_health(self):
+        """取得 /health 內容（失敗時返回 None）"""
+        try:
+            return self._session().get(f"{self.base_url}/health", timeout=10).json()
+        except Exception:
+            return None
+
+    def call(self, endpoint, images):
+        """
+        呼叫指定端點
+
+        Args:
+            endpoint: 'ocr'、'batch'、'stream' 或 'jobs'
+            images: (檔名, 位元組) 列表（非 batch 端點只使用第一張）
+
+        Returns:
+            dict: status（HTTP 狀態碼）、error_kind（None 表示成功）、images（圖片數），
+                  以及可取得時的 server_queue_ms、ttft_ms、cached 與 stage_ms（每張圖片的伺服器階段耗時）
+        """
+        try:
+            return getattr(self, f"_call_{endpoint}")(images)
+        except requests.Timeout:
+            return {'status': None, 'error_kind': 'timeout', 'images': len(images)}
+        except requests.ConnectionError:
+            return {'status': None, 'error_kind': 'connection', 'images': len(images)}
+
+    @staticmethod
+    def _json(response):
+        """解析 JSON 回應（非 JSON 時返回空 dict，例如反向代理的錯誤頁面）"""
+        try:
+            return response.json()
+        except ValueError:
+            return {}
+
+    @staticmethod
+    def _error_kind(status_code, body):
+        """依 HTTP 狀態碼與錯誤訊息分類錯誤"""
+        if status_code == 429:
+            return 'rejected'
+        message = body.get('error', '') if isinstance(body, dict) else ''
+        if '超時' in message:
+            return 'timeout'
+        return f"http_{status_code}"
+
+    def _call_ocr(self, images):
+        name, data = images[0]
+        response = self._session().post(
+            f"{self.base_url}/ocr", files={'file': (name, data, 'image/png')},
+            data=self._form(), timeout=self.timeout
+        )
+        body = self._json(response)
+        if response.status_code != 200:
+            return {'status': response.status_code, 'error_kind': self._error_kind(response.status_code, body), 'images': 1}
+        timings = body.get('timings') or {}
+        return {
+            'status': 200, 'error_kind': None, 'images': 1,
+            'server_queue_ms': timings.get('queue_ms'), 'cached': bool(body.get('cached')),
+            'stage_ms': [self._stage_ms(timings)] if timings else []
+        }
+
+    def _call_batch(self, images):
+        files = [('files', (name, data, 'image/png')) for name, data in images]
+        response = self._session().post(
+            f"{self.base_url}/ocr/batch", files=files, data=self._form(), timeout=self.timeout
+        )
+        body = self._json(response)
+        if response.status_code != 200:
+            return {'status': response.status_code, 'error_kind': self._error_kind(response.status_code, body), 'images': len(images)}
+        results = body.get('results', [])
+        failed = [result for result in results if 'error' in result]
+        if failed:
+            return {'status': 200, 'error_kind': self._error_kind(500, failed[0]), 'images': len(images)}
+        return {
+            'status': 200, 'error_kind': None, 'images': len(images),
+            'stage_ms': [self._stage_ms(result['timings']) for result in results if result.get('timings')]
+        }
+
+    def _call_stream(self, images):
+        name, data = images[0]
+        start = time.time()
+        response = self._session().post(
+            f"{self.base_url}/ocr/stream", files={'file': (name, data, 'image/png')},
+            data=self._form(), timeout=self.timeout, stream=True
+        )
+        if response.status_code != 200:
+            return {'status': response.status_code, 'error_kind': self._error_kind(response.status_code, self._json(response)), 'images': 1}
+
+        ttft_ms = None
+        event_type = None
+        result = {'status': 200, 'error_kind': 'incomplete', 'images': 1}
+        for line in response.iter_lines(decode_unicode=True):
+            if line.startswith('event: '):
+                event_type = line[len('event: '):]
+            elif line.startswith('data: '):
+                payload = json.loads(line[len('data: '):])
+                if event_type == 'token' and ttft_ms is None:
+                    ttft_ms = (time.time() - start) * 1000
+                elif event_type == 'done':
+                    timings = payload.get('timings') or {}
+                    result = {
+                        'status': 200, 'error_kind': None, 'images': 1,
+                        'server_queue_ms': timings.get('queue_ms'), 'cached': bool(payload.get('cached')),
+                        'stage_ms': [self._stage_ms(timings)] if timings else []
+                    }
+                elif event_type == 'error':
+                    result = {'status': 200, 'error_kind': self._error_kind(500, payload), 'images': 1}
+        result['ttft_ms'] = ttft_ms
+        return result
+
+    def _call_jobs(self, images):
+        name, data = images[0]
+        deadline = time.time() + self.timeout
+        session = self._session()
+        response = session.post(
+            f"{self.base_url}/jobs", files={'file': (name, data, 'image/png')},
+            data=self._form(), timeout=self.timeout
+        )
+        body = self._json(response)
+        if response.status_code != 202:
+            return {'status': response.status_code, 'error_kind': self._error_kind(response.status_code, body), 'images': 1}
+
+        status_url = f"{self.base_url}{body['status_url']}"
+        while time.time() < deadline:
+            time.sleep(self.poll_interval)
+            job = self._json(session.get(status_url, timeout=self.timeout))
+            if job.get('status') in ('done', 'failed'):
+                server_queue_ms = None
+                if job.get('started_at') and job.get('created_at'):
+                    server_queue_ms = (job['started_at'] - job['created_at']) * 1000
+                error_kind = None
+                if job['status'] == 'failed':
+                    error_kind = self._error_kind(500, job.get('result'))
+                job_result = job.get('result') or {}
+                return {
+                    'status': 200, 'error_kind': error_kind, 'images': 1, 'server_queue_ms': server_queue_ms,
+                    'cached': bool(job_result.get('cached')),
+                    'stage_ms': [self._stage_ms(job_result['timings'])] if job_result.get('timings') else []
+                }
+        return {'status': 202, 'error_kind': 'timeout', 'images': 1}
+
+
+class LoadGenerator:
+    """依封閉或開放迴圈模型送出請求，並收集每個請求的紀錄"""
+
+    def __init__(self, client, endpoint, corpus, batch_size=4, seed=0):
+        """
+        Args:
+            client: OCRClient
+            endpoint: 測試的端點
+            corpus: build_corpus 產生的語料
+            batch_size: /ocr/batch 每個請求包含的圖片數
+            seed: 選取圖片的亂數種子
+        """
+        self.client = client
+        self.endpoint = endpoint
+        self.corpus = corpus
+        self.batch_size = batch_size if endpoint == 'batch' else 1
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.records = []
+
+    def _pick_images(self):
+        with self._lock:
+            return [self._rng.choice(self.corpus) for _ in range(self.batch_size)]
+
+    def _issue(self, scheduled_at, record=True):
+        """送出一個請求並記錄延遲（scheduled_at 為預定送出時間）"""
+        images = self._pick_images()
+        started_at = time.time()
+        result = self.client.call(self.endpoint, images)
+        finished_at = time.time()
+        result.update({
+            'scheduled_at': scheduled_at,
+            'started_at': started_at,
+            'finished_at': finished_at,
+            # 開放迴圈時從預定到達時間起算，包含客戶端來不及送出的等待時間
+            'latency_ms': (finished_at - scheduled_at) * 1000,
+            'client_queue_ms': (started_at - scheduled_at) * 1000
+        })
+        if record:
+            with self._lock:
+                self.records.append(result)
+        return result
+
+    def warmup(self, count):
+        """送出不列入統計的暖機請求"""
+        for _ in range(count):
+            self._issue(time.time(), record=False)
+
+    def run_closed(self, concurrency, total_requests=None, duration=None):
+        """
+        封閉迴圈：concurrency 個客戶端各自連續送出請求
+
+        Args:
+            concurrency: 同時進行的客戶端數
+            total_requests: 總請求數（與 duration 擇一）
+            duration: 測試秒數
+        """
+        deadline = time.time() + duration if duration else None
+        counter = {'issued': 0}
+
+        def _client_loop():
+            while True:
+                with self._lock:
+                    if total_requests is not None and counter['issued'] >= total_requests:
+                        return
+                    counter['issued'] += 1
+                if deadline is not None and time.time() >= deadline:
+                    return
+                self._issue(time.time())
+
+        threads = [threading.Thread(target=_client_loop, daemon=True) for _ in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def run_open(self, rate, total_requests=None, duration=None, max_in_flight=256):
+        """
+        開放迴圈：請求間隔服從指數分佈（Poisson 到達），平均每秒 rate 個
+
+        送出中的請求達到 max_in_flight 時，新到達的請求會在客戶端等待，
+        等待時間計入延遲與 client_queue_ms（避免 coordinated omission）
+
+        Args:
+            rate: 平均到達速率（每秒請求數）
+            total_requests: 總請求數（與 duration 擇一）
+            duration: 測試秒數
+            max_in_flight: 客戶端同時送出中的請求上限
+        """
+        arrival_rng = random.Random(self._rng.random())
+        executor = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix='bench-open')
+        start = time.time()
+        next_arrival = start
+        issued = 0
+        futures = []
+        while True:
+            if total_requests is not None and issued >= total_requests:
+                break
+            if duration is not None and next_arrival - start >= duration:
+                break
+            delay = next_arrival - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            futures.append(executor.submit(self._issue, next_arrival))
+            issued += 1
+            next_arrival += arrival_rng.expovariate(rate)
+        for future in futures:
+            future.result()
+        executor.shutdown()
+
+
+def _stage_order(key):
+    """依伺服器處理順序排列階段耗時（total 與其他彙總項目排在最後）"""
+    stage = key[:-len('_ms')]
+    return (STAGES.index(stage), '') if stage in STAGES else (len(STAGES), key)
+
+
+def build_report(records, wall_seconds):
+    """
+    彙總請求紀錄
+
+    Args:
+        records: LoadGenerator.records
+        wall_seconds: 測試實際耗時
+
+    Returns:
+        dict: 吞吐量、延遲分佈、錯誤與排隊延遲統計
+    """
+    total = len(records)
+    succeeded = [r for r in records if r['error_kind'] is None]
+    errors_by_kind = {}
+    for record in records:
+        if record['error_kind'] is not None:
+            errors_by_kind[record['error_kind']] = errors_by_kind.get(record['error_kind'], 0) + 1
+
+    # 伺服器回報的各階段耗時（每張圖片一筆，快取命中的結果不含推理階段，因此排除）
+    stage_samples = {}
+    for record in succeeded:
+        if record.get('cached'):
+            continue
+        for stage_ms in record.get('stage_ms') or []:
+            for key, value in stage_ms.items():
+                stage_samples.setdefault(key, []).append(value)
+
+    timeouts = errors_by_kind.get('timeout', 0)
+    return {
+        'requests': total,
+        'succeeded': len(succeeded),
+        'errors': total - len(succeeded),
+        'error_rate': round((total - len(succeeded)) / total, 4) if total else 0,
+        'timeouts': timeouts,
+        'timeout_rate': round(timeouts / total, 4) if total else 0,
+        'rejected': errors_by_kind.get('rejected', 0),
+        'errors_by_kind': errors_by_kind,
+        'cache_hits': sum(1 for r in succeeded if r.get('cached')),
+        'duration_s': round(wall_seconds, 2),
+        'throughput_rps': round(len(succeeded) / wall_seconds, 3) if wall_seconds else 0,
+        'images_per_s': round(sum(r['images'] for r in succeeded) / wall_seconds, 3) if wall_seconds else 0,
+        'latency_ms': summarize([r['latency_ms'] for r in succeeded]),
+        'ttft_ms': summarize([r['ttft_ms'] for r in succeeded if r.get('ttft_ms') is not None]),
+        'server_queue_ms': summarize([r['server_queue_ms'] for r in succeeded if r.get('server_queue_ms') is not None]),
+        'client_queue_ms': summarize([r['client_queue_ms'] for r in records]),
+        'server_stages_ms': {key: summarize(stage_samples[key]) for key in sorted(stage_samples, key=_stage_order)}
+    }
+
+
+def print_report(report):
+    """以表格形式輸出測試結果"""
+    summary = report['summary']
+    config = report['config']
+    print("=" * 60)
+    print(f"端點: /{config['endpoint']}  模式: {config['mode']}  "
+          f"{'並發: ' + str(config['concurrency']) if config['mode'] == 'closed' else '到達速率: ' + str(config['rate']) + '/s'}")
+    print("=" * 60)
+    print(f"請求數: {summary['requests']}（成功 {summary['succeeded']}，失敗 {summary['errors']}）")
+    print(f"耗時: {summary['duration_s']} 秒")
+    print(f"吞吐量: {summary['throughput_rps']} req/s，{summary['images_per_s']} 張/s")
+    print(f"錯誤率: {summary['error_rate']:.2%}（超時 {summary['timeout_rate']:.2%}，拒絕 {summary['rejected']}）")
+    if summary['errors_by_kind']:
+        print(f"錯誤分類: {summary['errors_by_kind']}")
+    print(f"快取命中: {summary['cache_hits']}")
+    for key, label in (('latency_ms', '延遲'), ('ttft_ms', '首段文字'),
+                       ('server_queue_ms', '伺服器排隊'), ('client_queue_ms', '客戶端排隊')):
+        stats = summary[key]
+        if stats.get('count'):
+            print(f"{label} (ms): p50={stats['p50']}  p95={stats['p95']}  p99={stats['p99']}  "
+                  f"mean={stats['mean']}  max={stats['max']}")
+    stages = summary.get('server_stages_ms') or {}
+    if stages:
+        print("伺服器階段耗時 (ms):")
+        for key, stats in stages.items():
+            print(f"  {key[:-len('_ms')]:<18} p50={stats['p50']}  p95={stats['p95']}  mean={stats['mean']}")
+    print("=" * 60)
+
+
+def print_comparison(report, baseline):
+    """輸出與基準結果的差異（延遲與吞吐量）"""
+    print(f"與基準比較（{baseline.get('label') or baseline.get('git_commit') or 'baseline'}）:")
+    for key in ('throughput_rps', 'error_rate'):
+        old, new = baseline['summary'].get(key), report['summary'].get(key)
+        print(f"  {key}: {old} -> {new}")
+    for pct in ('p50', 'p95', 'p99'):
+        old = baseline['summary']['latency_ms'].get(pct)
+        new = report['summary']['latency_ms'].get(pct)
+        if old and new:
+            print(f"  latency {pct}: {old} -> {new} ms ({(new - old) / old:+.1%})")
+    old_stages = baseline['summary'].get('server_stages_ms') or {}
+    new_stages = report['summary'].get('server_stages_ms') or {}
+    for key in new_stages:
+        old, new = old_stages.get(key, {}).get('mean'), new_stages[key].get('mean')
+        if old and new is not None:
+            print(f"  {key[:-len('_ms')]} mean: {old} -> {new} ms ({(new - old) / old:+.1%})")
+
+
+def _git_commit():
+    """取得目前的 git commit（不在 git 倉庫中時返回 None）"""
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)), stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except Exception:
+        return None
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_stub_server(server_env=None, ready_timeout=120):
+    """
+    在子行程中啟動使用 stub 推理後端的服務（不需要模型權重與 GPU）
+
+    Args:
+        server_env: 額外的環境變數（例如 {'OCR_BATCH_MAX_SIZE': '4'}）
+        ready_timeout: 等待 /readyz 回報就緒（模型載入與暖機完成）的最長秒數
+
+    Returns:
+        tuple: (subprocess.Popen, 服務網址)
+    """
+    port = _free_port()
+    env = dict(os.environ)
+    env.update({'OCR_BACKEND': 'stub', 'OCR_CACHE_DIR': ''})
+    env.update(server_env or {})
+    process = subprocess.Popen(
+        [sys.executable, '-c',
+         f"from app import app; app.run(host='127.0.0.1', port={port}, threaded=True, debug=False)"],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL
+    )
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.time() + ready_timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"stub 服務啟動失敗（結束碼 {process.returncode}）")
+        try:
+            if requests.get(f"{url}/readyz", timeout=1).status_code == 200:
+                return process, url
+        except requests.RequestException:
+            pass
+        time.sleep(0.5)
+    process.terminate()
+    raise RuntimeError(f"stub 服務在 {ready_timeout} 秒內未就緒")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='DeepSeek-OCR API 壓力測試與延遲基準')
+    parser.add_argument('--url', default='http://localhost:5000', help='服務網址')
+    parser.add_argument('--endpoint', choices=ENDPOINTS, default='ocr', help='測試的端點')
+    parser.add_argument('--mode', choices=('closed', 'open'), default='closed', help='封閉或開放迴圈負載')
+    parser.add_argument('--concurrency', type=int, default=4, help='封閉迴圈的客戶端數')
+    parser.add_argument('--rate', type=float, default=1.0, help='開放迴圈的平均到達速率（每秒請求數）')
+    parser.add_argument('--max-in-flight', type=int, default=256, help='開放迴圈客戶端同時送出中的請求上限')
+    parser.add_argument('--requests', type=int, default=None, help='總請求數（未指定 --duration 時預設 100）')
+    parser.add_argument('--duration', type=float, default=None, help='測試秒數')
+    parser.add_argument('--warmup', type=int, default=2, help='不列入統計的暖機請求數')
+    parser.add_argument('--batch-size', type=int, default=4, help='/ocr/batch 每個請求的圖片數')
+    parser.add_argument('--corpus-size', type=int, default=32,
+                        help='合成圖片數（小於請求數時會重複使用圖片，可測試快取）')
+    parser.add_argument('--min-side', type=int, default=480, help='合成圖片最短邊長')
+    parser.add_argument('--max-side', type=int, default=1600, help='合成圖片最長邊長')
+    parser.add_argument('--seed', type=int, default=0, help='亂數種子')
+    parser.add_argument('--prompt', default=None, help='自訂提示詞')
+    parser.add_argument('--timings', action='store_true', help='要求伺服器回報並彙總各階段耗時')
+    parser.add_argument('--timeout', type=float, default=300, help='客戶端超時秒數')
+    parser.add_argument('--poll-interval', type=float, default=0.2,
+                        help='查詢 /jobs/<id> 的間隔秒數（jobs 延遲的解析度）')
+    parser.add_argument('--serve-stub', action='store_true', help='自動啟動使用 stub 推理後端的服務')
+    parser.add_argument('--server-env', action='append', default=[], metavar='KEY=VALUE',
+                        help='--serve-stub 時傳給服務的環境變數（可重複）')
+    parser.add_argument('--label', default=None, help='結果標籤（例如分支名稱）')
+    parser.add_argument('--output', default=None, help='將結果寫入 JSON 檔案')
+    parser.add_argument('--compare', default=None, help='與先前輸出的 JSON 結果比較')
+    parser.add_argument('--include-records', action='store_true', help='JSON 結果包含每個請求的紀錄')
+    args = parser.parse_args(argv)
+    if args.requests is None and args.duration is None:
+        args.requests = 100
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    server = None
+    url = args.url
+    if args.serve_stub:
+        server_env = dict(item.split('=', 1) for item in args.server_env)
+        print(f"正在啟動 stub 服務... {server_env or ''}")
+        server, url = start_stub_server(server_env)
+        print(f"stub 服務已就緒: {url}")
+
+    try:
+        print(f"正在產生 {args.corpus_size} 張合成圖片...")
+        corpus = build_corpus(args.corpus_size, seed=args.seed, min_side=args.min_side, max_side=args.max_side)
+
+        client = OCRClient(url, timeout=args.timeout, batch_size=args.batch_size, prompt=args.prompt,
+                           poll_interval=args.poll_interval, timings=args.timings)
+        generator = LoadGenerator(client, args.endpoint, corpus, batch_size=args.batch_size, seed=args.seed)
+
+        if args.warmup:
+            print(f"暖機 {args.warmup} 個請求...")
+            generator.warmup(args.warmup)
+
+        health_before = client.get_health()
+        print(f"開始測試: /{args.endpoint}，模式 {args.mode}")
+        start = time.time()
+        if args.mode == 'closed':
+            generator.run_closed(args.concurrency, total_requests=args.requests, duration=args.duration)
+        else:
+            generator.run_open(args.rate, total_requests=args.requests, duration=args.duration,
+                               max_in_flight=args.max_in_flight)
+        wall_seconds = time.time() - start
+        health_after = client.get_health()
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=30)
+
+    report = {
+        'label': args.label,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'git_commit': _git_commit(),
+        'config': {key: value for key, value in vars(args).items() if key not in ('output', 'compare')},
+        'server': {'before': health_before, 'after': health_after},
+        'summary': build_report(generator.records, wall_seconds)
+    }
+    if args.include_records:
+        report['records'] = generator.records
+
+    print_report(report)
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            print_comparison(report, json.load(f))
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"結果已寫入: {args.output}")
+
+    return report
+
+
+if __name__ == '__main__':
+    main()
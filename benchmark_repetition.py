@@ -0,0 +1,164 @@
+"""
+重複迴圈偵測的微基準
+
+以合成的長輸出（正常文字、單詞重複、詞組重複、整行重複、中文重複、正常內容後才開始的重複）比較舊版 _remove_repetition
+（逐詞比對，清理過度時以 text.count 逐一位置搜尋，O(n²)）與 repetition.truncate_repetition 的耗時；
+另外確認表單底線、目錄點線、分隔線與表格格式等正常文件內容不會被截斷（任一項被截斷時以狀態碼 1 結束）
+
+使用範例:
+    python benchmark_repetition.py
+    python benchmark_repetition.py --tokens 2000 8000 32000 --rounds 5
+"""
+
+import argparse
+import random
+import time
+
+from repetition import truncate_repetition
+
+
+WORDS = (
+    'INVOICE', 'RECEIPT', 'TOTAL', 'DATE', 'ITEM', 'QTY', 'PRICE', 'TAX', 'AMOUNT', 'Customer',
+    'Address', 'Phone', 'Paid', 'Cash', 'Card', 'Change', '發票', '金額', '數量', '單價'
+)
+
+
+def legacy_remove_repetition(text):
+    """舊版 DeepSeekOCRService._remove_repetition（只用於比較）"""
+    if not text or len(text) < 100:
+        return text
+    words = text.split()
+    if len(words) < 10:
+        return text
+    cleaned_words = []
+    repeat_count = 0
+    max_repeats = 3
+    for word in words:
+        is_repeat = False
+        if len(cleaned_words) >= 1:
+            if word == cleaned_words[-1]:
+                repeat_count += 1
+                if repeat_count > max_repeats:
+                    is_repeat = True
+            else:
+                repeat_count = 0
+        if not is_repeat:
+            cleaned_words.append(word)
+    cleaned_text = ' '.join(cleaned_words)
+    if len(cleaned_text) < len(text) * 0.2:
+        half_len = len(text) // 2
+        for i in range(100, half_len):
+            chunk = text[i:i+50]
+            if text.count(chunk) > 3:
+                return text[:i].strip()
+        return text[:half_len].strip()
+    return cleaned_text
+
+
+def _normal_lines(rng, count):
+    lines = []
+    for i in range(count):
+        words = rng.sample(WORDS, rng.randint(3, 8))
+        lines.append(f"{i + 1}. " + ' '.join(words) + f" {rng.randint(1, 99999)}")
+    return lines
+
+
+def build_outputs(tokens, seed=0):
+    """
+    產生約 tokens 個詞的合成輸出
+
+    Args:
+        tokens: 輸出長度（詞數）
+        seed: 亂數種子
+
+    Returns:
+        dict: 名稱 → 文字
+    """
+    rng = random.Random(seed)
+    prefix = '\n'.join(_normal_lines(rng, 20)) + '\n'
+    return {
+        'normal': '\n'.join(_normal_lines(rng, tokens // 7)),
+        'word_loop': prefix + ' '.join(['TOTAL'] * tokens),
+        'phrase_loop': prefix + 'Paid by Card 1234 ' * (tokens // 4),
+        'line_loop': prefix + 'ITEM QTY PRICE 100.00\n' * (tokens // 4),
+        'cjk_loop': prefix + '金額合計新台幣' * (tokens // 2),
+        # 迴圈前有較長的正常內容時，舊版逐一位置呼叫 text.count 直到迴圈開始處
+        'late_loop': '\n'.join(_normal_lines(rng, tokens // 50)) + '\n' + ' '.join(['TOTAL'] * tokens)
+    }
+
+
+def build_preserved():
+    """
+    產生不可被截斷的正常文件內容（重複的只有標點或 HTML 標籤）
+
+    Returns:
+        dict: 名稱 → 文字
+    """
+    return {
+        'form_blank': 'Name: ' + '_' * 129,
+        'toc_leaders': '\n'.join(
+            f"{title} {'.' * (60 - len(title))} {page}"
+            for title, page in (('Introduction', 1), ('Installation', 4), ('Usage', 9), ('API', 15),
+                                ('Errors', 23), ('FAQ', 31))
+        ),
+        'markdown_rule': '# Receipt\n\n' + '-' * 100 + '\nTOTAL 100',
+        'empty_cells': '<table><tr><td>Item</td>' + '<td></td>' * 30 + '</tr></table>',
+        'table_separator': '| Item | Qty |\n' + '|---' * 60 + '|\n| Tea | 2 |',
+        'table_rows': '<table>' + ''.join(f"<tr><td>{i}</td>{'<td></td>' * 4}</tr>" for i in range(1, 30)) + '</table>'
+    }
+
+
+def check_preserved():
+    """
+    確認 build_preserved 的內容經過 truncate_repetition 後保持不變
+
+    Returns:
+        list: 被截斷的 (名稱, 原長度, 截斷後長度)
+    """
+    failures = []
+    for name, text in build_preserved().items():
+        cleaned, _ = truncate_repetition(text)
+        if cleaned != text:
+            failures.append((name, len(text), len(cleaned)))
+    return failures
+
+
+def measure(func, text, rounds):
+    """返回 rounds 次中最短的耗時（秒）與結果長度"""
+    best = None
+    for _ in range(rounds):
+        start = time.perf_counter()
+        result = func(text)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, len(result)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='重複迴圈偵測的微基準')
+    parser.add_argument('--tokens', type=int, nargs='+', default=[1000, 4000, 8000], help='合成輸出的長度（詞數）')
+    parser.add_argument('--rounds', type=int, default=3, help='每個組合的重複次數（取最短耗時）')
+    parser.add_argument('--seed', type=int, default=0, help='亂數種子')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    failures = check_preserved()
+    for name, length, cleaned_length in failures:
+        print(f"✗ {name} 被截斷: {length} → {cleaned_length} 字元")
+    print(f"正常文件內容保留檢查: {len(build_preserved()) - len(failures)}/{len(build_preserved())} 通過\n")
+    print(f"{'輸出':<12} {'詞數':>6} {'字元數':>8} {'舊版 ms':>10} {'新版 ms':>10} {'加速':>8} {'舊版長度':>8} {'新版長度':>8}")
+    for tokens in args.tokens:
+        for name, text in build_outputs(tokens, seed=args.seed).items():
+            legacy_seconds, legacy_length = measure(legacy_remove_repetition, text, args.rounds)
+            seconds, length = measure(lambda value: truncate_repetition(value)[0], text, args.rounds)
+            speedup = legacy_seconds / seconds if seconds else float('inf')
+            print(f"{name:<12} {tokens:>6} {len(text):>8} {legacy_seconds * 1000:>10.2f} {seconds * 1000:>10.2f} "
+                  f"{speedup:>7.1f}x {legacy_length:>8} {length:>8}")
+    if failures:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
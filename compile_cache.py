@@ -0,0 +1,221 @@
+"""
+編譯與暖機產物的持久化
+將 torch.compile（Inductor）的編譯圖與 autotune 結果、Triton kernel、Unsloth 產生的編譯模組
+以及暖機使用的輸入尺寸，存放在以模型版本、套件版本與 OCR 設定為鍵值的目錄，
+重新啟動（滾動部署、自動擴展）時直接沿用，不再重新編譯
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from importlib import metadata
+
+
+# 影響編譯結果的套件，任一版本改變都使用新的目錄
+LIBRARIES = ('torch', 'transformers', 'triton', 'unsloth', 'unsloth_zoo')
+
+# 保留最近的啟動紀錄數
+STARTUP_HISTORY = 20
+
+MANIFEST_NAME = 'manifest.json'
+
+# 定期保存暖機輸入尺寸的間隔秒數（行程被強制結束時 atexit 不會執行）
+AUTOSAVE_INTERVAL = 60
+
+
+def library_versions():
+    """
+    取得影響編譯結果的套件版本（不匯入套件本身）
+
+    Returns:
+        dict: 套件名稱 → 版本，未安裝時為 None
+    """
+    versions = {}
+    for name in LIBRARIES:
+        try:
+            versions[name] = metadata.version(name)
+        except metadata.PackageNotFoundError:
+            versions[name] = None
+    return versions
+
+
+def model_revision(model_name, model_dir):
+    """
+    以本地模型目錄的 config.json 內容與權重檔案大小代表模型版本
+
+    Args:
+        model_name: 模型名稱
+        model_dir: 模型本地目錄
+
+    Returns:
+        str: 版本雜湊；模型尚未下載時為 "<模型名稱>@unresolved"
+    """
+    config_path = os.path.join(model_dir, 'config.json')
+    if not os.path.isfile(config_path):
+        return f"{model_name}@unresolved"
+
+    digest = hashlib.sha256()
+    with open(config_path, 'rb') as f:
+        digest.update(f.read())
+    for filename in sorted(os.listdir(model_dir)):
+        if filename.endswith(('.safetensors', '.bin', '.py')):
+            digest.update(f"{filename}:{os.path.getsize(os.path.join(model_dir, filename))}".encode('utf-8'))
+    return digest.hexdigest()[:16]
+
+
+class CompileArtifacts:
+    """
+    版本化的編譯與暖機產物目錄
+
+    activate() 必須在匯入 torch 之前呼叫：Inductor、Triton 與 Unsloth 在匯入時讀取快取位置；
+    已由環境變數指定的位置不會被覆寫
+    """
+
+    def __init__(self, root, model_name, model_dir, settings, max_versions=3):
+        """
+        Args:
+            root: 產物根目錄（每個版本一個子目錄）
+            model_name: 模型名稱
+            model_dir: 模型本地目錄
+            settings: 影響編譯形狀的 OCR 設定（推理後端、設備、圖片尺寸等）
+            max_versions: 保留的版本目錄數，較舊的目錄會被刪除
+        """
+        self.root = root
+        self.max_versions = max(1, int(max_versions))
+        self.components = {
+            'model': model_name,
+            'revision': model_revision(model_name, model_dir),
+            'libraries': library_versions(),
+            'settings': settings
+        }
+        encoded = json.dumps(self.components, sort_keys=True).encode('utf-8')
+        self.key = hashlib.sha256(encoded).hexdigest()[:16]
+        self.dir = os.path.join(root, self.key)
+        self.manifest_path = os.path.join(self.dir, MANIFEST_NAME)
+        self.manifest = self._load_manifest()
+        # 曾經在此目錄完成啟動才算暖啟動（目錄存在但上次啟動失敗時仍視為冷啟動）
+        self.warm_start = bool(self.manifest.get('startups'))
+
+    def _load_manifest(self):
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_manifest(self):
+        temp_path = f"{self.manifest_path}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.manifest, f, ensure_ascii=False, indent=2)
+        os.replace(temp_path, self.manifest_path)
+
+    def activate(self):
+        """建立目錄、清除舊版本，並將各編譯快取指向此目錄"""
+        os.makedirs(self.dir, exist_ok=True)
+        os.utime(self.dir)
+        self._prune()
+
+        os.environ.setdefault('TORCHINDUCTOR_CACHE_DIR', os.path.join(self.dir, 'inductor'))
+        os.environ.setdefault('TORCHINDUCTOR_FX_GRAPH_CACHE', '1')
+        os.environ.setdefault('TORCHINDUCTOR_AUTOGRAD_CACHE', '1')
+        os.environ.setdefault('TRITON_CACHE_DIR', os.path.join(self.dir, 'triton'))
+        os.environ.setdefault('UNSLOTH_COMPILE_LOCATION', os.path.join(self.dir, 'unsloth_compiled_cache'))
+        print(f"編譯快取目錄: {self.dir}（{'暖啟動' if self.warm_start else '冷啟動'}）")
+
+    def _prune(self):
+        """只保留最近使用的 max_versions 個版本目錄"""
+        versions = []
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if os.path.isfile(os.path.join(path, MANIFEST_NAME)) or path == self.dir:
+                versions.append((os.path.getmtime(path), path))
+        versions.sort(reverse=True)
+        for _, path in versions[self.max_versions:]:
+            print(f"刪除舊的編譯快取: {path}")
+            shutil.rmtree(path, ignore_errors=True)
+
+    def get_warmup_shapes(self):
+        """
+        Returns:
+            list: 先前實際使用過的輸入尺寸（{'base_size', 'image_size', 'crop_mode'}）
+        """
+        return list(self.manifest.get('warmup_shapes', []))
+
+    def record_startup(self, phases, warmup_shapes=None):
+        """
+        記錄一次成功的啟動（之後的啟動視為暖啟動）
+
+        Args:
+            phases: 各啟動階段秒數
+            warmup_shapes: 要保存的暖機輸入尺寸，None 表示不變
+        """
+        startups = self.manifest.setdefault('startups', [])
+        startups.append({
+            'at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'warm': self.warm_start,
+            'phases': {name: round(seconds, 3) for name, seconds in phases.items()}
+        })
+        del startups[:-STARTUP_HISTORY]
+        self.manifest['components'] = self.components
+        if warmup_shapes is not None:
+            self._merge_shapes(warmup_shapes)
+        self._save_manifest()
+
+    def _merge_shapes(self, shapes):
+        """併入新的輸入尺寸，返回是否有改變"""
+        current = self.get_warmup_shapes()
+        merged = {json.dumps(shape, sort_keys=True): shape for shape in current + list(shapes)}
+        if len(merged) == len(current):
+            return False
+        self.manifest['warmup_shapes'] = list(merged.values())
+        return True
+
+    def save_warmup_shapes(self, shapes):
+        """
+        保存實際使用過的輸入尺寸，下次啟動時逐一暖機
+
+        Args:
+            shapes: {'base_size', 'image_size', 'crop_mode'} 列表
+        """
+        if self._merge_shapes(shapes):
+            self._save_manifest()
+
+    def start_autosave(self, get_shapes, interval=AUTOSAVE_INTERVAL):
+        """
+        在背景定期保存實際使用過的輸入尺寸（沒有新尺寸時不寫入）
+
+        Args:
+            get_shapes: 返回目前輸入尺寸列表的函式（例如 service.get_warmup_shapes）
+            interval: 保存間隔秒數
+        """
+        def _loop():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.save_warmup_shapes(get_shapes())
+                except Exception as e:
+                    print(f"警告: 保存暖機輸入尺寸失敗: {e}")
+
+        threading.Thread(target=_loop, name='compile-cache-autosave', daemon=True).start()
+
+    def get_status(self):
+        """
+        取得編譯快取狀態與最近一次冷/暖啟動的各階段耗時
+
+        Returns:
+            dict: 目錄、鍵值、本次是否為暖啟動與先前的啟動耗時
+        """
+        last = {}
+        for startup in self.manifest.get('startups', []):
+            last['warm' if startup['warm'] else 'cold'] = startup
+        return {
+            'dir': self.dir,
+            'key': self.key,
+            'warm_start': self.warm_start,
+            'warmup_shapes': len(self.get_warmup_shapes()),
+            'last_cold_startup': last.get('cold'),
+            'last_warm_startup': last.get('warm')
+        }
@@ -21,9 +21,32 @@ class Config:
     
     # OCR 參數配置（根據 DeepSeek 官方建議）
     OCR_TEMPERATURE = 0.0
-    OCR_MAX_TOKENS = 8192
-    OCR_NGRAM_SIZE = 30
-    OCR_WINDOW_SIZE = 90
+    OCR_MAX_TOKENS = int(os.environ.get('OCR_MAX_TOKENS', '8192'))
+    OCR_NGRAM_SIZE = int(os.environ.get('OCR_NGRAM_SIZE', '30'))
+    OCR_WINDOW_SIZE = int(os.environ.get('OCR_WINDOW_SIZE', '90'))
+    
+    # repetition_stop: 生成中偵測重複迴圈（模型幻覺），確認後立即停止該圖片的生成
+    # - 在最近 OCR_WINDOW_SIZE 個 token 內逐字週期重複、且重複單位包含文字 token 才視為迴圈
+    #   （比較長度至少 OCR_NGRAM_SIZE 個 token，週期最長 OCR_WINDOW_SIZE - OCR_NGRAM_SIZE；表格標籤的重複不算）
+    # - 停止的結果標記 repetition_stopped（不寫入結果快取）
+    # - 停用時迴圈會生成到 OCR_MAX_TOKENS 或超時，之後才在後處理時截斷
+    OCR_REPETITION_STOP = os.environ.get('OCR_REPETITION_STOP', 'true').lower() == 'true'
+    
+    # token_budget: 依每張圖片的解析度、裁切區塊數與文字密度估計輸出 token 上限
+    # - 約為視覺 token 數 × 10（DeepSeek-OCR 的壓縮比）× 文字覆蓋比例 × 1.5，至少 512，不超過 OCR_MAX_TOKENS
+    # - 生成到上限的結果標記 budget_exhausted（不寫入結果快取），請求可用 max_tokens 參數提高上限
+    # - 停用時每張圖片都可以生成到 OCR_MAX_TOKENS
+    OCR_TOKEN_BUDGET = os.environ.get('OCR_TOKEN_BUDGET', 'true').lower() == 'true'
+    
+    # precheck: 推理前在縮圖上（CPU，數十毫秒內）檢查圖片是否空白或嚴重模糊，
+    # 無法辨識時直接返回「照片可能模糊或光線不足」錯誤，不使用 GPU
+    # - 強邊緣像素比例低於 OCR_PRECHECK_MIN_EDGE_DENSITY：灰階標準差低於 OCR_PRECHECK_MIN_CONTRAST 為空白，否則為模糊
+    # - Laplacian 變異數低於 OCR_PRECHECK_MIN_SHARPNESS：模糊
+    # - 門檻設為 0 表示不檢查該項；誤判清晰圖片時可調低門檻
+    OCR_PRECHECK = os.environ.get('OCR_PRECHECK', 'true').lower() == 'true'
+    OCR_PRECHECK_MIN_EDGE_DENSITY = float(os.environ.get('OCR_PRECHECK_MIN_EDGE_DENSITY', '0.0005'))
+    OCR_PRECHECK_MIN_CONTRAST = float(os.environ.get('OCR_PRECHECK_MIN_CONTRAST', '8.0'))
+    OCR_PRECHECK_MIN_SHARPNESS = float(os.environ.get('OCR_PRECHECK_MIN_SHARPNESS', '5.0'))
     OCR_DEFAULT_PROMPT = "<image>\nFree OCR."
     
     # ==================== OCR 圖片處理參數 ====================
@@ -66,6 +89,177 @@ class Config:
     # - 建議：False（預設）
     OCR_SAVE_RESULTS = os.environ.get('OCR_SAVE_RESULTS', 'false').lower() == 'true'
     
+    # resolution_mode: 解析度選擇方式
+    # - "fixed": 所有圖片使用上方的 OCR_BASE_SIZE、OCR_IMAGE_SIZE 與 OCR_CROP_MODE（預設）
+    # - "adaptive": 依每張圖片的尺寸與文字密度自動選擇下方效能建議中的模式，選擇結果記錄在回應的 resolution
+    #   - 長邊 640 以下: small（640x640，不裁切）
+    #   - 長邊 1280 以下或內容稀疏: 快速模式（1024 / 640）
+    #   - 長邊 2048 以下或一般密度: 平衡模式（2048 / 1024）
+    #   - 更大且文字密集: 高品質模式（2048 / 1280）
+    OCR_RESOLUTION_MODE = os.environ.get('OCR_RESOLUTION_MODE', 'fixed').lower()
+    
+    # adaptive_max_preset: 自動解析度模式允許的最高模式（small / fast / balanced / high_quality）
+    # - 注意：RTX 3090 (24GB) 使用 2048 可能導致 OOM，可設為 fast 限制 GPU 記憶體用量
+    OCR_ADAPTIVE_MAX_PRESET = os.environ.get('OCR_ADAPTIVE_MAX_PRESET', 'high_quality')
+    
+    # ==================== 推理後端 ====================
+    # 服務層（快取、排程、超時、前後處理）共用，只有模型載入與推理由後端負責
+    
+    # backend: 推理後端
+    # - "unsloth": Unsloth 版本，推理速度快（10-30 秒），只支援 GPU（預設）
+    # - "transformers": 標準 Transformers 版本，推理較慢（60-120 秒），支援 CPU
+    # - "stub": 不載入模型的確定性假後端，用於在沒有模型權重與 GPU 的機器上測試與壓測服務層
+    # - 注意：app_standard.py 的預設值為 "transformers"
+    OCR_BACKEND = os.environ.get('OCR_BACKEND', 'unsloth')
+    
+    # warmup: 模型載入後是否先以合成圖片執行一次暖機推理，完成後才回報就緒（/readyz）
+    # - 模型一律在背景執行緒中載入，HTTP 伺服器會先啟動並回應 /livez
+    # - 第一次推理會載入 CUDA kernel、觸發編譯並配置記憶體，暖機可避免由第一個使用者請求承擔
+    OCR_WARMUP = os.environ.get('OCR_WARMUP', 'true').lower() == 'true'
+    
+    # compile_cache_dir: 編譯與暖機產物目錄（設為空字串可停用）
+    # - 保存 torch.compile（Inductor）編譯圖與 autotune 結果、Triton kernel、Unsloth 編譯模組與暖機輸入尺寸
+    # - 以模型版本 + torch/transformers/triton/unsloth 版本 + OCR 設定為子目錄，任一項改變即重新編譯
+    # - 已設定 TORCHINDUCTOR_CACHE_DIR、TRITON_CACHE_DIR、UNSLOTH_COMPILE_LOCATION 時以環境變數為準
+    # compile_cache_versions: 保留的版本子目錄數，較舊的會被刪除
+    OCR_COMPILE_CACHE_DIR = os.environ.get('OCR_COMPILE_CACHE_DIR', 'cache/compile')
+    OCR_COMPILE_CACHE_VERSIONS = int(os.environ.get('OCR_COMPILE_CACHE_VERSIONS', '3'))
+    
+    # stub 後端參數（僅 OCR_BACKEND=stub 時使用）
+    # - prefill_ms: 每批次的預填延遲（毫秒）
+    # - ms_per_token: 每個生成步驟的延遲（毫秒），批次中的圖片共用生成步驟
+    # - output_tokens: 每張圖片的平均輸出 token 數（實際值依圖片內容在 0.5-1.5 倍之間）
+    # - memory_mb: 每張處理中的圖片實際配置的記憶體（MB）
+    # - vision_ms: 每張圖片的視覺編碼延遲（毫秒），0 表示不模擬（用於測試視覺編碼結果快取）
+    # - loop_ratio: 模擬重複迴圈（生成到上限）的圖片比例，0 表示不模擬（用於測試 OCR_REPETITION_STOP）
+    OCR_STUB_PREFILL_MS = float(os.environ.get('OCR_STUB_PREFILL_MS', '50'))
+    OCR_STUB_MS_PER_TOKEN = float(os.environ.get('OCR_STUB_MS_PER_TOKEN', '5'))
+    OCR_STUB_OUTPUT_TOKENS = int(os.environ.get('OCR_STUB_OUTPUT_TOKENS', '64'))
+    OCR_STUB_MEMORY_MB = int(os.environ.get('OCR_STUB_MEMORY_MB', '64'))
+    OCR_STUB_VISION_MS = float(os.environ.get('OCR_STUB_VISION_MS', '0'))
+    OCR_STUB_LOOP_RATIO = float(os.environ.get('OCR_STUB_LOOP_RATIO', '0'))
+    
+    # ==================== 記憶體准入控制 ====================
+    # 依解析度、裁切區塊數與最大生成 token 數估計每個請求的峰值記憶體，在預算內才開始推理，
+    # 預算不足時排隊等待（不會拒絕請求），並以實際量測到的峰值修正估計（GPU 與 stub 後端）
+    
+    # memory_admission: 是否啟用記憶體准入控制
+    # - 停用時不限制同時推理的記憶體用量（僅由 OCR_BATCH_MAX_SIZE 與 OCR_MAX_CONCURRENT 限制）
+    OCR_MEMORY_ADMISSION = os.environ.get('OCR_MEMORY_ADMISSION', 'true').lower() == 'true'
+    
+    # memory_budget_mb: 推理可使用的記憶體預算（MB，不含模型權重）
+    # - 0: 依模型載入後的記憶體狀態自動計算（預設）
+    #   - GPU: 設備總記憶體 × OCR_MEMORY_BUDGET_FRACTION − 模型權重等已使用的記憶體
+    #   - CPU: 可用主記憶體 × OCR_MEMORY_BUDGET_FRACTION（多個 CPU 副本時平分）
+    # - 多副本模式下為每個副本的預算
+    # memory_budget_fraction: 自動計算預算時可使用的記憶體比例，保留的部分供 CUDA context 與配置器碎片使用
+    OCR_MEMORY_BUDGET_MB = int(os.environ.get('OCR_MEMORY_BUDGET_MB', '0'))
+    OCR_MEMORY_BUDGET_FRACTION = float(os.environ.get('OCR_MEMORY_BUDGET_FRACTION', '0.9'))
+    
+    # memory_release_policy: GPU 快取記憶體的釋放策略（由背景執行緒處理，不在請求路徑上清理）
+    # - "always": 每個批次推理後立即 empty_cache + synchronize（舊行為，只用於比較）
+    # - "pressure": 設備記憶體使用率超過 OCR_MEMORY_PRESSURE_THRESHOLD 或配置器碎片過多時才釋放
+    # - "idle": pressure，另外在推理閒置 OCR_MEMORY_IDLE_SECONDS 秒後釋放一次，將記憶體還給其他行程（預設）
+    # - "never": 不主動釋放（OOM 時仍會釋放）
+    # - 省下的釋放次數與估計省下的時間見 /health 的 allocator
+    OCR_MEMORY_RELEASE_POLICY = os.environ.get('OCR_MEMORY_RELEASE_POLICY', 'idle').lower()
+    OCR_MEMORY_IDLE_SECONDS = float(os.environ.get('OCR_MEMORY_IDLE_SECONDS', '30'))
+    OCR_MEMORY_PRESSURE_THRESHOLD = float(os.environ.get('OCR_MEMORY_PRESSURE_THRESHOLD', '0.9'))
+    
+    # timing_window: 各階段耗時滾動統計（/health 的 timings）保留的最近請求數
+    # - 單一請求的階段耗時可在 /ocr、/ocr/batch、/jobs 加上 timings=true 取得
+    OCR_TIMING_WINDOW = int(os.environ.get('OCR_TIMING_WINDOW', '1000'))
+    
+    # ==================== 微批次排程參數 ====================
+    # 將短時間內並發的 /ocr 請求合併為一次批次推理，提高 GPU 使用率
+    
+    # batch_max_size: 單一批次最多合併的請求數
+    # - 1: 停用微批次（預設，每個請求獨立推理）
+    # - 2-8: 啟用微批次，值越大吞吐量越高，但單批次 GPU 記憶體使用也越多
+    # - 注意：需搭配多執行緒的 HTTP 伺服器（例如 gunicorn --threads）才會有並發請求
+    OCR_BATCH_MAX_SIZE = int(os.environ.get('OCR_BATCH_MAX_SIZE', '1'))
+    
+    # batch_max_wait_ms: 收到第一個請求後，最多等待多少毫秒來收集同一批次的請求
+    # - 值越大越容易湊滿批次，但會增加單一請求的延遲
+    OCR_BATCH_MAX_WAIT_MS = int(os.environ.get('OCR_BATCH_MAX_WAIT_MS', '20'))
+    
+    # max_concurrent: 未啟用微批次時，同時進行中的推理數上限
+    # - 每個請求直接從 generate 取得自己的文字，可安全地同時推理
+    # - 值越大並發越高，但 GPU 記憶體使用也越多
+    OCR_MAX_CONCURRENT = int(os.environ.get('OCR_MAX_CONCURRENT', '2'))
+    
+    # ==================== CPU 前處理參數 ====================
+    # 在子行程中完成圖片解碼、縮放、裁切與 tokenize，讓 CPU 前處理與推理重疊進行
+    
+    # preprocess_workers: 前處理子行程數
+    # - 0: 停用，在推理執行緒中前處理（預設）
+    # - 2-4: 批次或高並發時建議啟用，每個子行程會載入一份 tokenizer
+    # - 注意：多副本模式（OCR_DEVICES）下各副本仍在推理執行緒中前處理
+    OCR_PREPROCESS_WORKERS = int(os.environ.get('OCR_PREPROCESS_WORKERS', '0'))
+    
+    # prefetch_depth: 預取佇列上限（前處理中與已完成但尚未開始推理的圖片總數）
+    # - 值越大越不容易讓推理等待前處理，但會保留更多已前處理的圖片在記憶體中
+    # - 至少為 OCR_BATCH_MAX_SIZE 與 OCR_MAX_CONCURRENT 中較大者
+    OCR_PREFETCH_DEPTH = int(os.environ.get('OCR_PREFETCH_DEPTH', '8'))
+    
+    # ==================== 多副本推理參數 ====================
+    # 每個設備啟動一個載入模型的子行程，請求分派給處理中請求最少的健康副本
+    
+    # devices: 以逗號分隔的設備列表，每個設備一個副本
+    # - 空字串: 停用副本池，在 Flask 行程內直接載入單一模型（預設）
+    # - "auto": 每張 GPU 一個副本；沒有 GPU 時使用 OCR_CPU_REPLICAS 個 CPU 副本
+    # - "cuda:0,cuda:1": 指定 GPU
+    # - "cpu,cpu,cpu,cpu": 4 個 CPU 副本（CPU 核心平均分配，適合在沒有 GPU 的機器上測試擴展性）
+    # - 注意：Unsloth 後端只支援 GPU 副本，CPU 副本請使用 transformers 或 stub 後端
+    OCR_DEVICES = os.environ.get('OCR_DEVICES', '')
+    
+    # cpu_replicas: OCR_DEVICES=auto 且沒有 GPU 時的 CPU 副本數
+    OCR_CPU_REPLICAS = int(os.environ.get('OCR_CPU_REPLICAS', '1'))
+    
+    # ==================== OCR 結果快取參數 ====================
+    # 以圖片內容雜湊 + 提示詞 + 圖片處理參數作為鍵值，重複上傳的圖片不再重新推理
+    
+    # cache_enabled: 是否啟用 OCR 結果快取
+    OCR_CACHE_ENABLED = os.environ.get('OCR_CACHE_ENABLED', 'true').lower() == 'true'
+    
+    # cache_memory_items: 記憶體 LRU 最多保留的結果數
+    OCR_CACHE_MEMORY_ITEMS = int(os.environ.get('OCR_CACHE_MEMORY_ITEMS', '256'))
+    
+    # cache_dir: 磁碟快取目錄（設為空字串可停用磁碟層）
+    OCR_CACHE_DIR = os.environ.get('OCR_CACHE_DIR', 'cache/ocr_results')
+    
+    # cache_disk_max_mb: 磁碟快取大小上限（MB），超過時淘汰最久未使用的結果
+    OCR_CACHE_DISK_MAX_MB = int(os.environ.get('OCR_CACHE_DISK_MAX_MB', '512'))
+    
+    # vision_cache_mb: 視覺編碼結果快取大小上限（MB，存放在主記憶體，0 表示停用）
+    # - 以圖片內容雜湊 + 解析度設定為鍵值，保存 SAM、CLIP 與投影層輸出的視覺 token embedding
+    # - 同一張圖片換提示詞（例如先 Free OCR 再轉 Markdown）時跳過視覺編碼器，只重新執行語言模型
+    # - 每張圖片約 1-10 MB（依解析度與裁切區塊數），超過上限時淘汰最久未使用的項目
+    OCR_VISION_CACHE_MB = int(os.environ.get('OCR_VISION_CACHE_MB', '256'))
+    
+    # prompt_cache_size: 提示詞 tokenize 結果快取保留的非常用提示詞數（LRU，0 表示停用整個快取）
+    # hot_prompts: 啟動時預先 tokenize 並常駐的常用提示詞，以 || 分隔（預設提示詞一律包含）
+    # - 與 API 的 prompt 參數相同，不含 <image> 標記時自動加上 "<image>\n" 前綴
+    # - 提示詞在圖片 token 之後，其 KV 與圖片內容相關，無法跨請求共用；可共用的只有 tokenize 結果
+    OCR_PROMPT_CACHE_SIZE = int(os.environ.get('OCR_PROMPT_CACHE_SIZE', '64'))
+    OCR_HOT_PROMPTS = [
+        prompt.strip()
+        for prompt in os.environ.get('OCR_HOT_PROMPTS', '<|grounding|>Convert the document to markdown.').split('||')
+        if prompt.strip()
+    ]
+    
+    # ==================== 非同步工作佇列參數 ====================
+    # POST /jobs 立即返回工作 ID，結果以 GET /jobs/<id> 查詢，避免長時間佔用 HTTP 連線
+    
+    # job_queue_size: 佇列中等待工作的上限，超過時回應 429 並附上 Retry-After
+    OCR_JOB_QUEUE_SIZE = int(os.environ.get('OCR_JOB_QUEUE_SIZE', '16'))
+    
+    # job_workers: 處理佇列工作的背景執行緒數（建議與 OCR_MAX_CONCURRENT 相同）
+    OCR_JOB_WORKERS = int(os.environ.get('OCR_JOB_WORKERS', '2'))
+    
+    # job_result_ttl: 已完成工作的結果保留秒數
+    OCR_JOB_RESULT_TTL = int(os.environ.get('OCR_JOB_RESULT_TTL', '3600'))
+    
     # ==================== 效能建議 ====================
     # 根據不同的使用場景，推薦以下設定組合：
     #
@@ -0,0 +1,204 @@
+"""
+圖片內容分析與解析度自動選擇
+依圖片尺寸與文字密度（縮圖上的邊緣像素比例）為每張圖片選擇 base_size、image_size 與 crop_mode，
+小圖或內容稀疏的圖片使用低成本設定，只有大尺寸且文字密集的頁面才使用高品質設定；
+同樣依文字密度估計每張圖片的輸出 token 預算，並在推理前找出空白或嚴重模糊而無法辨識的圖片
+"""
+
+import math
+
+from PIL import ImageFilter, ImageStat
+
+
+# 解析度預設組合，依推理成本由低到高排列（與 config.py 的效能建議一致）
+# - small: 整張圖片縮放為 640x640，不裁切（收據、截圖片段等小圖）
+# - fast: 快速模式
+# - balanced: 平衡模式
+# - high_quality: 高品質模式（需要更多 GPU 記憶體）
+PRESET_ORDER = ('small', 'fast', 'balanced', 'high_quality')
+PRESETS = {
+    'small': {'base_size': 640, 'image_size': 640, 'crop_mode': False},
+    'fast': {'base_size': 1024, 'image_size': 640, 'crop_mode': True},
+    'balanced': {'base_size': 2048, 'image_size': 1024, 'crop_mode': True},
+    'high_quality': {'base_size': 2048, 'image_size': 1280, 'crop_mode': True},
+}
+
+# 圖片長邊的分界（像素）：不超過此值時最多使用對應的預設組合
+SIDE_LIMITS = (
+    (640, 'small'),
+    (1280, 'fast'),
+    (2048, 'balanced'),
+)
+
+# 文字密度分界：低於 SPARSE_DENSITY 視為內容稀疏，達到 DENSE_DENSITY 視為文字密集
+SPARSE_DENSITY = 0.04
+DENSE_DENSITY = 0.20
+
+# 估計文字密度時的縮圖長邊與邊緣強度門檻
+ANALYSIS_SIZE = 512
+EDGE_THRESHOLD = 48
+
+# 輸出 token 預算：模型在約 10 倍壓縮（文字 token / 視覺 token）內可以幾乎無損地讀出文字，
+# 文字密度達到 DENSE_DENSITY 的圖片以此為預期輸出長度，較稀疏的圖片依密度比例減少；
+# 預算再乘上 TOKEN_BUDGET_MARGIN 的餘裕，且不少於 MIN_TOKEN_BUDGET
+TOKENS_PER_IMAGE_TOKEN = 10
+TOKEN_BUDGET_MARGIN = 1.5
+MIN_TOKEN_BUDGET = 512
+
+# 可讀性預檢的預設門檻（縮圖上計算，設為 0 表示不檢查該項）
+# - 強邊緣像素比例低於 PRECHECK_MIN_EDGE_DENSITY 時沒有可辨識的筆畫：
+#   灰階標準差低於 PRECHECK_MIN_CONTRAST 視為空白（全白、全黑、鏡頭被遮住），否則視為模糊
+# - Laplacian 響應的變異數低於 PRECHECK_MIN_SHARPNESS 時視為模糊（文字邊緣被糊開）
+# 門檻偏保守：大頁面上只有一行小字的圖片仍會通過（強邊緣約 0.001、變異數約 15）
+PRECHECK_MIN_EDGE_DENSITY = 0.0005
+PRECHECK_MIN_CONTRAST = 8.0
+PRECHECK_MIN_SHARPNESS = 5.0
+
+# 3x3 Laplacian（offset 128 讓負響應也能存在 8 位元灰階圖中，超過 ±128 的響應會被截斷，不影響判斷模糊）
+LAPLACIAN = ImageFilter.Kernel((3, 3), (0, 1, 0, 1, -4, 1, 0, 1, 0), scale=1, offset=128)
+
+
+def _analysis_sample(image):
+    """
+    將圖片縮小為長邊約 ANALYSIS_SIZE 的灰階縮圖
+
+    Args:
+        image: PIL 圖片
+
+    Returns:
+        PIL.Image: 灰階縮圖，太小而無法分析時為 None
+    """
+    # 整數倍縮小（區塊平均）比一般縮放快數倍，4K 圖片約 10 毫秒
+    factor = math.ceil(max(image.size) / ANALYSIS_SIZE)
+    sample = (image.reduce(factor) if factor > 1 else image).convert('L')
+    if min(sample.size) < 3:
+        return None
+    return sample
+
+
+def _edge_density(sample):
+    """縮圖上強邊緣像素的比例（去掉最外圈像素，邊緣濾鏡在圖片邊界會產生假邊緣）"""
+    edges = sample.filter(ImageFilter.FIND_EDGES).crop((1, 1, sample.size[0] - 1, sample.size[1] - 1))
+    histogram = edges.histogram()
+    total = sum(histogram)
+    return sum(histogram[EDGE_THRESHOLD:]) / total if total else 0.0
+
+
+def estimate_text_density(image):
+    """
+    估計圖片的文字密度
+
+    將圖片縮小為灰階縮圖後做邊緣偵測，以強邊緣像素的比例代表文字密度；
+    文字筆畫會產生大量邊緣，空白、照片背景與大面積色塊則很少
+
+    Args:
+        image: PIL 圖片
+
+    Returns:
+        float: 0-1 之間的密度，投影片等稀疏內容約 0.03，滿版文字頁面可達 0.3 以上
+    """
+    sample = _analysis_sample(image)
+    if sample is None:
+        return 0.0
+    return _edge_density(sample)
+
+
+def assess_image_quality(image):
+    """
+    在縮圖上計算可讀性指標（只使用 CPU，4K 照片約數十毫秒，多數時間用於縮小）
+
+    Args:
+        image: PIL 圖片
+
+    Returns:
+        dict: {'contrast': 灰階標準差（0-255）, 'edge_density': 強邊緣像素比例（與 estimate_text_density 相同）,
+               'sharpness': Laplacian 響應的變異數}，圖片太小而無法分析時為 None
+    """
+    sample = _analysis_sample(image)
+    if sample is None:
+        return None
+    laplacian = sample.filter(LAPLACIAN).crop((1, 1, sample.size[0] - 1, sample.size[1] - 1))
+    return {
+        'contrast': round(ImageStat.Stat(sample).stddev[0], 2),
+        'edge_density': round(_edge_density(sample), 4),
+        'sharpness': round(ImageStat.Stat(laplacian).var[0], 2)
+    }
+
+
+def check_readability(quality, min_edge_density=PRECHECK_MIN_EDGE_DENSITY, min_contrast=PRECHECK_MIN_CONTRAST,
+                      min_sharpness=PRECHECK_MIN_SHARPNESS):
+    """
+    依可讀性指標判斷圖片是否無法辨識
+
+    Args:
+        quality: assess_image_quality 的結果（None 表示無法分析，一律視為可讀）
+        min_edge_density: 強邊緣像素比例的下限
+        min_contrast: 沒有強邊緣時區分空白與模糊的灰階標準差
+        min_sharpness: Laplacian 變異數的下限
+
+    Returns:
+        str: 'blank'（空白或全暗）、'blurry'（模糊），可讀時為 None
+    """
+    if quality is None:
+        return None
+    if quality['edge_density'] < min_edge_density:
+        return 'blank' if quality['contrast'] < min_contrast else 'blurry'
+    if quality['sharpness'] < min_sharpness:
+        return 'blurry'
+    return None
+
+
+def select_resolution(image, max_preset='high_quality', density=None):
+    """
+    依圖片尺寸與文字密度選擇解析度設定
+
+    尺寸決定最多能使用的預設組合；內容稀疏時最多使用 fast，
+    一般密度最多使用 balanced，只有文字密集的大圖才使用 high_quality
+
+    Args:
+        image: PIL 圖片
+        max_preset: 允許使用的最高預設組合（限制 GPU 記憶體用量）
+        density: 已計算的文字密度（例如可讀性預檢的 edge_density），None 時重新估計
+
+    Returns:
+        dict: {'preset', 'base_size', 'image_size', 'crop_mode', 'text_density'}
+    """
+    long_side = max(image.size)
+    size_level = len(SIDE_LIMITS)
+    for limit, preset in SIDE_LIMITS:
+        if long_side <= limit:
+            size_level = PRESET_ORDER.index(preset)
+            break
+
+    if density is None:
+        density = estimate_text_density(image)
+    if density < SPARSE_DENSITY:
+        density_level = PRESET_ORDER.index('fast')
+    elif density < DENSE_DENSITY:
+        density_level = PRESET_ORDER.index('balanced')
+    else:
+        density_level = PRESET_ORDER.index('high_quality')
+
+    preset = PRESET_ORDER[min(size_level, density_level, PRESET_ORDER.index(max_preset))]
+    return dict(preset=preset, **PRESETS[preset], text_density=round(density, 4))
+
+
+def estimate_token_budget(image_tokens, text_density, max_tokens):
+    """
+    依視覺 token 數與文字密度估計一張圖片的輸出 token 預算
+
+    視覺 token 數反映解析度與裁切區塊數（模型實際看得到的文字量上限），
+    文字密度反映其中有多少面積是文字；只有一行字的圖片不需要與滿版文件相同的生成上限
+
+    Args:
+        image_tokens: 視覺 token 數（ocr_inference.count_image_tokens）
+        text_density: estimate_text_density 的結果
+        max_tokens: 預算上限（服務的最大生成 token 數）
+
+    Returns:
+        int: 輸出 token 預算
+    """
+    coverage = min(1.0, text_density / DENSE_DENSITY)
+    expected = image_tokens * TOKENS_PER_IMAGE_TOKEN * coverage
+    budget = max(MIN_TOKEN_BUDGET, math.ceil(expected * TOKEN_BUDGET_MARGIN))
+    return min(int(max_tokens), budget)
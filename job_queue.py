@@ -0,0 +1,221 @@
+"""
+非同步 OCR 工作佇列
+POST /jobs 只負責排入有界佇列並立即返回工作 ID，背景執行緒依序交給 OCR 服務處理，
+佇列已滿時由呼叫端回應 429，並依目前佇列深度與平均推理時間估算 Retry-After
+"""
+
+import math
+import queue
+import threading
+import time
+import uuid
+from concurrent.futures import TimeoutError as FuturesTimeoutError
+
+
+# 平均推理時間的指數移動平均權重；前 1 / AVG_WEIGHT 筆以算術平均計算，不受初始假設值影響
+AVG_WEIGHT = 0.2
+
+
+class QueueFullError(Exception):
+    """工作佇列已滿例外類別"""
+
+    def __init__(self, retry_after):
+        """
+        Args:
+            retry_after: 建議的重試等待秒數
+        """
+        super().__init__(f"工作佇列已滿，請於 {retry_after} 秒後重試")
+        self.retry_after = retry_after
+
+
+class OCRJobQueue:
+    """
+    有界的 OCR 工作佇列
+
+    - 佇列最多容納 max_queue_size 個等待中的工作，超過時 submit 拋出 QueueFullError
+    - num_workers 個背景執行緒呼叫 process_job 處理工作
+    - 已完成的工作保留 result_ttl 秒供查詢，之後自動清除
+    """
+
+    def __init__(self, process_job, max_queue_size=16, num_workers=1, result_ttl=3600,
+                 initial_avg_seconds=30.0, name='ocr-job-worker'):
+        """
+        初始化工作佇列
+
+        Args:
+            process_job: 處理函數，接收工作內容並回傳結果 dict（含 'error' 鍵表示失敗）
+            max_queue_size: 佇列中等待工作的上限
+            num_workers: 背景處理執行緒數
+            result_ttl: 已完成工作保留秒數
+            initial_avg_seconds: 尚無任何完成的工作時假設的平均推理秒數（第一筆量測後即不再使用）
+            name: 背景執行緒名稱前綴
+        """
+        self.process_job = process_job
+        self.max_queue_size = max(1, int(max_queue_size))
+        self.num_workers = max(1, int(num_workers))
+        self.result_ttl = result_ttl
+
+        self._queue = queue.Queue(maxsize=self.max_queue_size)
+        self._lock = threading.Lock()
+        self._jobs = {}
+        self._avg_seconds = float(initial_avg_seconds)
+        self._measured = 0
+        self._stats = {
+            'submitted': 0,
+            'rejected': 0,
+            'completed': 0,
+            'failed': 0
+        }
+
+        self._workers = []
+        for idx in range(self.num_workers):
+            worker = threading.Thread(target=self._worker_loop, name=f"{name}-{idx}", daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    def estimate_retry_after(self):
+        """
+        依目前佇列深度與平均推理時間估算重試等待秒數
+
+        Returns:
+            int: 建議的 Retry-After 秒數（至少 1 秒）
+        """
+        with self._lock:
+            avg_seconds = self._avg_seconds
+        depth = self._queue.qsize()
+        return max(1, int(math.ceil(depth * avg_seconds / self.num_workers)))
+
+    def submit(self, payload):
+        """
+        排入一個工作
+
+        Args:
+            payload: 傳給 process_job 的工作內容
+
+        Returns:
+            str: 工作 ID
+
+        Raises:
+            QueueFullError: 佇列已滿
+        """
+        self._purge_expired()
+
+        job_id = uuid.uuid4().hex
+        job = {
+            'job_id': job_id,
+            'status': 'queued',
+            'created_at': time.time(),
+            'started_at': None,
+            'finished_at': None,
+            'result': None
+        }
+
+        with self._lock:
+            self._jobs[job_id] = job
+
+        try:
+            self._queue.put_nowait((job_id, payload))
+        except queue.Full:
+            with self._lock:
+                self._jobs.pop(job_id, None)
+                self._stats['rejected'] += 1
+            raise QueueFullError(self.estimate_retry_after())
+
+        with self._lock:
+            self._stats['submitted'] += 1
+        return job_id
+
+    def get(self, job_id):
+        """
+        查詢工作狀態
+
+        Args:
+            job_id: 工作 ID
+
+        Returns:
+            dict: 工作狀態（status 為 queued / running / done / failed），不存在時返回 None
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            job = dict(job)
+
+        if job['status'] == 'queued':
+            job['queue_depth'] = self._queue.qsize()
+        return job
+
+    def _worker_loop(self):
+        """背景執行緒：依序取出工作並呼叫 process_job"""
+        while True:
+            entry = self._queue.get()
+            if entry is None:
+                break
+
+            job_id, payload = entry
+            with self._lock:
+                job = self._jobs.get(job_id)
+                if job is None:
+                    continue
+                job['status'] = 'running'
+                job['started_at'] = time.time()
+
+            try:
+                result = self.process_job(payload)
+            except FuturesTimeoutError:
+                result = {'error': "OCR 處理超時，請嘗試使用更小的圖片或增加超時設定"}
+            except Exception as e:
+                print(f"工作 {job_id} 執行錯誤: {type(e).__name__}: {e}")
+                result = {'error': f"OCR 處理發生錯誤: {str(e)}"}
+
+            finished_at = time.time()
+            failed = not isinstance(result, dict) or 'error' in result
+
+            with self._lock:
+                elapsed = finished_at - job['started_at']
+                # 前幾筆以算術平均從實際耗時起算，之後以指數移動平均讓 Retry-After 跟上目前的推理速度
+                self._measured += 1
+                weight = max(AVG_WEIGHT, 1.0 / self._measured)
+                self._avg_seconds = (1 - weight) * self._avg_seconds + weight * elapsed
+                job['status'] = 'failed' if failed else 'done'
+                job['finished_at'] = finished_at
+                job['result'] = result
+                self._stats['failed' if failed else 'completed'] += 1
+
+    def _purge_expired(self):
+        """清除超過保留時間的已完成工作"""
+        now = time.time()
+        with self._lock:
+            expired = [
+                job_id for job_id, job in self._jobs.items()
+                if job['finished_at'] is not None and now - job['finished_at'] > self.result_ttl
+            ]
+            for job_id in expired:
+                del self._jobs[job_id]
+
+    def get_stats(self):
+        """
+        取得工作佇列統計資訊
+
+        Returns:
+            dict: 佇列深度、處理中工作數與累計次數
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            running = sum(1 for job in self._jobs.values() if job['status'] == 'running')
+            stats.update({
+                'queue_depth': self._queue.qsize(),
+                'max_queue_size': self.max_queue_size,
+                'running': running,
+                'workers': self.num_workers,
+                'avg_inference_seconds': round(self._avg_seconds, 2)
+            })
+        return stats
+
+    def shutdown(self):
+        """通知背景執行緒結束（佇列中剩餘的工作不再處理）"""
+        for _ in self._workers:
+            try:
+                self._queue.put_nowait(None)
+            except queue.Full:
+                break
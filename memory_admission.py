@@ -0,0 +1,362 @@
+"""
+推理記憶體准入控制
+依解析度、裁切區塊數與最大生成 token 數估計每個請求的峰值記憶體，
+在設定的記憶體預算內決定批次可以立即推理或需要排隊，並以實際觀察到的峰值修正估計
+"""
+
+import threading
+import time
+from collections import deque
+
+from ocr_inference import DEFAULT_MAX_NEW_TOKENS, PATCH_SIZE, count_image_tokens
+
+
+# 先驗估計使用的常數（DeepSeek-OCR，float16 權重），實際用量由觀察到的峰值修正
+# - KV cache: 12 層 × 隱藏層 1280 × (K, V) × 2 bytes，每個 token 約 0.06 MB
+# - 視覺編碼: SAM 的全域注意力以 math SDPA 計算，注意力矩陣為 (邊長/16)^2 的平方 × 12 頭 × 2 bytes，
+#   其餘啟用值與 patch 數成正比；裁切區塊在同一次前向中編碼，區塊數越多用量越大
+# - 每個請求固定的額外開銷（logits 與暫存 tensor）
+KV_MB_PER_TOKEN = 12 * 1280 * 2 * 2 / 1024 ** 2
+ATTENTION_BYTES_PER_PATCH_PAIR = 12 * 2
+ACTIVATION_MB_PER_PATCH = 0.05
+REQUEST_OVERHEAD_MB = 64
+
+# 修正係數：實際峰值高於估計時立即採用，低於估計時以指數移動平均逐步下修；
+# 預測時再保留 HEADROOM 的餘裕（配置器碎片與量測誤差）
+LEARNING_RATE = 0.3
+HEADROOM = 0.1
+# 發生 OOM 時，相關輸入尺寸的修正係數放大的倍數
+OOM_BACKOFF = 1.5
+
+
+def host_memory_info():
+    """
+    取得主記憶體狀態（CPU 推理時作為記憶體預算的來源）
+
+    Returns:
+        dict: 與 check_gpu_memory 格式相同的記憶體資訊，free_mb 為可用記憶體（MemAvailable）
+    """
+    try:
+        with open('/proc/meminfo', 'r', encoding='utf-8') as f:
+            values = {line.split(':')[0]: int(line.split()[1]) / 1024 for line in f if line.strip()}
+        total = values['MemTotal']
+        free = values.get('MemAvailable', values['MemFree'])
+    except (OSError, KeyError, ValueError, IndexError):
+        return {'available': False, 'total_mb': 0, 'used_mb': 0, 'free_mb': 0, 'usage_percent': 0}
+
+    return {
+        'available': True,
+        'total_mb': round(total, 2),
+        'used_mb': round(total - free, 2),
+        'free_mb': round(free, 2),
+        'usage_percent': round((total - free) / total * 100, 2)
+    }
+
+
+def is_out_of_memory(error):
+    """
+    判斷例外是否為記憶體不足（torch.cuda.OutOfMemoryError、CPU 配置失敗或 MemoryError）
+
+    Args:
+        error: 例外物件
+
+    Returns:
+        bool: 是否為記憶體不足
+    """
+    if isinstance(error, MemoryError) or type(error).__name__ == 'OutOfMemoryError':
+        return True
+    return 'out of memory' in str(error).lower()
+
+
+def _view_mb(side):
+    """單一視圖（全域視圖或一個裁切區塊）在視覺編碼器中的啟用值（MB）"""
+    patches = (side // PATCH_SIZE) ** 2
+    return (patches ** 2 * ATTENTION_BYTES_PER_PATCH_PAIR) / 1024 ** 2 + patches * ACTIVATION_MB_PER_PATCH
+
+
+class FootprintModel:
+    """
+    每個請求的峰值記憶體模型
+
+    先驗估計 = 固定開銷 + 視覺編碼啟用值（全域視圖 + 裁切區塊）+ KV cache（視覺 token + 最大生成 token），
+    再乘上依輸入尺寸（base_size、image_size、crop_mode 與裁切網格）學習的修正係數；
+    尚未觀察過的輸入尺寸使用所有觀察的整體修正係數
+    """
+
+    def __init__(self, learning_rate=LEARNING_RATE, headroom=HEADROOM):
+        """
+        Args:
+            learning_rate: 實際峰值低於估計時，修正係數向觀察值移動的比例
+            headroom: 預測時額外保留的比例
+        """
+        self.learning_rate = learning_rate
+        self.headroom = headroom
+        self._lock = threading.Lock()
+        self._ratios = {}  # 輸入尺寸鍵值 → 修正係數
+        self._observations = {}  # 輸入尺寸鍵值 → 觀察次數
+        self._global_ratio = None
+        self._total_observations = 0
+
+    def estimate(self, width, height, base_size, image_size, crop_mode, max_new_tokens=DEFAULT_MAX_NEW_TOKENS):
+        """
+        計算一個請求的先驗估計
+
+        Args:
+            width: 圖片寬度
+            height: 圖片高度
+            base_size: 全域視圖尺寸
+            image_size: 局部裁切尺寸
+            crop_mode: 是否啟用裁切模式
+            max_new_tokens: 最大生成 token 數
+
+        Returns:
+            dict: {'key': 輸入尺寸鍵值, 'prior_mb': 先驗估計（MB）}，傳給 predict 與 observe
+        """
+        image_tokens, (columns, rows) = count_image_tokens(width, height, base_size, image_size, crop_mode)
+        tiles = columns * rows if columns * rows > 1 else 0
+        if crop_mode:
+            vision_mb = _view_mb(base_size) + tiles * _view_mb(image_size)
+        else:
+            vision_mb = _view_mb(image_size)
+
+        prior_mb = REQUEST_OVERHEAD_MB + vision_mb + (image_tokens + max_new_tokens) * KV_MB_PER_TOKEN
+        mode = f"crop{columns}x{rows}" if crop_mode else 'nocrop'
+        return {'key': f"{base_size}/{image_size}/{mode}", 'prior_mb': round(prior_mb, 1)}
+
+    def _ratio(self, key):
+        ratio = self._ratios.get(key, self._global_ratio)
+        return 1.0 if ratio is None else ratio
+
+    def predict(self, footprints):
+        """
+        預測一組請求同時推理時的峰值記憶體
+
+        Args:
+            footprints: estimate 的回傳值列表
+
+        Returns:
+            float: 預測的峰值記憶體（MB）
+        """
+        with self._lock:
+            total = sum(footprint['prior_mb'] * self._ratio(footprint['key']) for footprint in footprints)
+        return total * (1 + self.headroom)
+
+    def _update(self, current, observed):
+        if current is None or observed > current:
+            return observed
+        return current + self.learning_rate * (observed - current)
+
+    def observe(self, footprints, peak_mb):
+        """
+        以實際觀察到的峰值修正估計（只在該批次單獨推理時量測，峰值不含其他批次）
+
+        Args:
+            footprints: 該批次的 estimate 列表
+            peak_mb: 推理期間增加的峰值記憶體（MB）
+        """
+        prior_mb = sum(footprint['prior_mb'] for footprint in footprints)
+        if prior_mb <= 0 or peak_mb is None or peak_mb < 0:
+            return
+        observed = peak_mb / prior_mb
+        with self._lock:
+            for key in {footprint['key'] for footprint in footprints}:
+                self._ratios[key] = self._update(self._ratios.get(key), observed)
+                self._observations[key] = self._observations.get(key, 0) + 1
+            self._global_ratio = self._update(self._global_ratio, observed)
+            self._total_observations += 1
+
+    def record_oom(self, footprints):
+        """
+        推理發生記憶體不足時放大相關輸入尺寸的修正係數
+
+        Args:
+            footprints: 發生 OOM 的批次的 estimate 列表
+        """
+        with self._lock:
+            for key in {footprint['key'] for footprint in footprints}:
+                self._ratios[key] = max(self._ratio(key), 1.0) * OOM_BACKOFF
+            self._global_ratio = max(self._global_ratio or 1.0, 1.0) * OOM_BACKOFF
+
+    def get_stats(self):
+        """
+        Returns:
+            dict: 觀察次數、整體修正係數與各輸入尺寸的修正係數
+        """
+        with self._lock:
+            return {
+                'observations': self._total_observations,
+                'global_ratio': round(self._global_ratio, 4) if self._global_ratio is not None else None,
+                'shapes': {
+                    key: {'ratio': round(ratio, 4), 'observations': self._observations.get(key, 0)}
+                    for key, ratio in sorted(self._ratios.items())
+                }
+            }
+
+
+class AdmissionCancelled(Exception):
+    """排隊等待記憶體時，批次中的請求全部被取消"""
+    pass
+
+
+class Reservation:
+    """一個已准入批次佔用的記憶體預算"""
+
+    def __init__(self, footprints, mb, solo):
+        """
+        Args:
+            footprints: 批次中各請求的 estimate
+            mb: 預留的記憶體（MB）
+            solo: 准入時是否沒有其他批次在推理（只有單獨推理的批次能量測自己的峰值）
+        """
+        self.footprints = footprints
+        self.mb = mb
+        self.solo = solo
+        self.overlapped = False
+        self.baseline_mb = None
+
+
+class MemoryAdmission:
+    """
+    記憶體准入控制器
+
+    各批次依預測的峰值記憶體預留預算，預算不足時依到達順序排隊（先到的大批次不會被後到的小批次插隊）；
+    預測超過整個預算的批次在沒有其他批次推理時單獨執行，不會被拒絕
+    """
+
+    def __init__(self, budget_mb, model=None, poll_interval=0.1):
+        """
+        Args:
+            budget_mb: 推理可使用的記憶體預算（MB，不含模型權重）
+            model: FootprintModel，預設建立新的模型
+            poll_interval: 排隊時檢查取消旗標的間隔秒數
+        """
+        self.budget_mb = float(budget_mb)
+        self.model = model or FootprintModel()
+        self.poll_interval = poll_interval
+        self._condition = threading.Condition()
+        self._waiting = deque()
+        self._active = []
+        self._reserved_mb = 0.0
+        self._admitted = 0
+        self._queued = 0
+        self._oversized = 0
+        self._split_batches = 0
+        self._cancelled = 0
+        self._oom = 0
+        self._wait_seconds = 0.0
+
+    def plan(self, footprints):
+        """
+        將一個批次切成預測峰值不超過預算的子批次（依原順序，每個子批次至少一個請求）
+
+        Args:
+            footprints: 批次中各請求的 estimate
+
+        Returns:
+            list: 子批次的索引列表
+        """
+        groups = [[]]
+        for index, footprint in enumerate(footprints):
+            candidate = groups[-1] + [index]
+            if groups[-1] and self.model.predict([footprints[i] for i in candidate]) > self.budget_mb:
+                groups.append([index])
+            else:
+                groups[-1] = candidate
+        if len(groups) > 1:
+            with self._condition:
+                self._split_batches += 1
+        return groups
+
+    def acquire(self, footprints, cancel_events=None):
+        """
+        等待預算足夠後預留記憶體
+
+        Args:
+            footprints: 批次中各請求的 estimate
+            cancel_events: 各請求的取消旗標；全部取消時停止等待
+
+        Returns:
+            Reservation: 推理結束後傳給 release
+        """
+        mb = self.model.predict(footprints)
+        ticket = object()
+        cancel_events = [event for event in (cancel_events or []) if event is not None]
+        wait_start = time.perf_counter()
+        with self._condition:
+            self._waiting.append(ticket)
+            try:
+                while not self._can_admit(ticket, mb):
+                    if cancel_events and all(event.is_set() for event in cancel_events):
+                        self._cancelled += 1
+                        raise AdmissionCancelled("等待推理記憶體時請求已全部取消")
+                    self._condition.wait(self.poll_interval)
+            finally:
+                self._waiting.remove(ticket)
+                self._condition.notify_all()
+
+            waited = time.perf_counter() - wait_start
+            solo = not self._active
+            if mb > self.budget_mb:
+                self._oversized += 1
+                print(f"警告: 批次預估峰值記憶體 {mb:.0f} MB 超過預算 {self.budget_mb:.0f} MB，單獨執行")
+            if waited > self.poll_interval / 10:
+                self._queued += 1
+                self._wait_seconds += waited
+            for reservation in self._active:
+                reservation.overlapped = True
+            reservation = Reservation(footprints, mb, solo)
+            self._active.append(reservation)
+            self._reserved_mb += mb
+            self._admitted += 1
+        return reservation
+
+    def _can_admit(self, ticket, mb):
+        """依到達順序准入：輪到此批次且預算足夠，或目前沒有其他批次在推理"""
+        if self._waiting[0] is not ticket:
+            return False
+        return not self._active or self._reserved_mb + mb <= self.budget_mb
+
+    def release(self, reservation, peak_mb=None, out_of_memory=False):
+        """
+        釋放預留的記憶體並以觀察到的峰值修正估計
+
+        Args:
+            reservation: acquire 的回傳值
+            peak_mb: 推理期間增加的峰值記憶體（MB），None 表示無法量測
+            out_of_memory: 推理是否因記憶體不足失敗
+        """
+        if out_of_memory:
+            self.model.record_oom(reservation.footprints)
+        elif peak_mb is not None and reservation.solo and not reservation.overlapped:
+            self.model.observe(reservation.footprints, peak_mb)
+        with self._condition:
+            self._active.remove(reservation)
+            self._reserved_mb = max(0.0, self._reserved_mb - reservation.mb) if self._active else 0.0
+            if out_of_memory:
+                self._oom += 1
+            self._condition.notify_all()
+
+    def get_stats(self):
+        """
+        取得准入控制統計
+
+        Returns:
+            dict: 預算、目前預留與排隊狀況、准入/排隊/超過預算/切分批次/OOM 次數與估計模型
+        """
+        with self._condition:
+            stats = {
+                'enabled': True,
+                'budget_mb': round(self.budget_mb, 1),
+                'reserved_mb': round(self._reserved_mb, 1),
+                'in_flight_batches': len(self._active),
+                'waiting_batches': len(self._waiting),
+                'admitted': self._admitted,
+                'queued': self._queued,
+                'avg_queue_wait_ms': round(self._wait_seconds / self._queued * 1000, 2) if self._queued else 0,
+                'oversized': self._oversized,
+                'split_batches': self._split_batches,
+                'cancelled': self._cancelled,
+                'out_of_memory': self._oom
+            }
+        stats['footprint'] = self.model.get_stats()
+        return stats
@@ -0,0 +1,215 @@
+"""
+推理設備記憶體管理
+在背景執行緒中追蹤配置器的已配置、已保留與碎片化的記憶體，
+依設定的策略只在記憶體真的不足或推理閒置時釋放快取區塊，
+不在請求路徑上呼叫 empty_cache + synchronize
+"""
+
+import threading
+import time
+
+
+# 釋放策略
+# - always: 每個批次推理後立即在請求路徑上釋放（舊行為，用於比較）
+# - pressure: 設備記憶體使用率或碎片化超過門檻時在背景釋放
+# - idle: pressure，另外在推理閒置一段時間後釋放一次（將記憶體還給其他行程）
+# - never: 只追蹤，不主動釋放（OOM 與第一個批次後量測釋放耗時的一次除外）
+POLICIES = ('always', 'pressure', 'idle', 'never')
+
+# 背景檢查間隔秒數
+CHECK_INTERVAL = 1.0
+
+# 未使用的快取區塊少於此大小（MB）時不值得釋放
+MIN_RELEASE_MB = 256
+
+
+class MemoryManager:
+    """
+    依策略釋放推理設備的快取記憶體
+
+    推理執行緒只以 track() 標記批次開始與結束（更新計數，不讀取設備狀態）；
+    配置器狀態的讀取與釋放都在背景執行緒中進行。每個沒有立即釋放的批次都記為省下一次釋放，
+    以實際量測的釋放耗時估計相對於 always 策略省下的時間
+    """
+
+    def __init__(self, backend, policy='idle', pressure_threshold=0.9, fragmentation_threshold=0.5,
+                 idle_seconds=30.0, interval=CHECK_INTERVAL):
+        """
+        Args:
+            backend: 推理後端（提供 allocator_stats 與 clear_cache）
+            policy: 釋放策略（見 POLICIES）
+            pressure_threshold: 設備記憶體使用率（包含其他行程）超過此比例時釋放
+            fragmentation_threshold: 已保留但無法使用的碎片超過已保留記憶體的此比例時釋放
+            idle_seconds: idle 策略下推理閒置多少秒後釋放
+            interval: 背景檢查間隔秒數
+        """
+        if policy not in POLICIES:
+            raise ValueError(f"不支援的記憶體釋放策略: {policy}（可用: {', '.join(POLICIES)}）")
+        self.backend = backend
+        self.policy = policy
+        self.pressure_threshold = pressure_threshold
+        self.fragmentation_threshold = fragmentation_threshold
+        self.idle_seconds = idle_seconds
+        self.interval = interval
+
+        self._lock = threading.Lock()
+        self._release_lock = threading.Lock()
+        self._active = 0
+        self._last_activity = time.time()
+        self._idle_released = True  # 目前的閒置期間是否已釋放過
+        self._releases = {}  # 原因 → 次數
+        self._release_seconds = 0.0
+        self._released_mb = 0.0
+        self._avoided = 0
+        self._last_stats = None
+        self._running = True
+        self._thread = None
+
+    def start(self):
+        """啟動背景檢查執行緒"""
+        self._thread = threading.Thread(target=self._loop, name='memory-manager', daemon=True)
+        self._thread.start()
+
+    def shutdown(self):
+        """停止背景檢查執行緒"""
+        self._running = False
+
+    def track(self):
+        """
+        標記一個批次的推理期間（with 區塊）
+
+        Returns:
+            _TrackBatch: context manager
+        """
+        return _TrackBatch(self)
+
+    def _batch_started(self):
+        with self._lock:
+            self._active += 1
+            self._last_activity = time.time()
+            self._idle_released = False
+
+    def _batch_finished(self):
+        with self._lock:
+            self._active -= 1
+            self._last_activity = time.time()
+            if self.policy != 'always':
+                self._avoided += 1
+        if self.policy == 'always':
+            self.release('always')
+
+    def release(self, reason):
+        """
+        釋放未使用的快取區塊並記錄耗時（同時只會有一個釋放在進行）
+
+        Args:
+            reason: 釋放原因（always / pressure / fragmentation / idle / calibration / oom / manual）
+
+        Returns:
+            float: 釋放耗時（秒）
+        """
+        with self._release_lock:
+            before = self.backend.allocator_stats()
+            start = time.perf_counter()
+            self.backend.clear_cache()
+            seconds = time.perf_counter() - start
+            after = self.backend.allocator_stats()
+        with self._lock:
+            self._releases[reason] = self._releases.get(reason, 0) + 1
+            self._release_seconds += seconds
+            if before is not None and after is not None:
+                self._released_mb += max(0.0, before['reserved_mb'] - after['reserved_mb'])
+                self._last_stats = after
+        return seconds
+
+    def _loop(self):
+        while self._running:
+            time.sleep(self.interval)
+            try:
+                self._check()
+            except Exception as e:
+                print(f"警告: 記憶體管理檢查失敗: {e}")
+
+    def _check(self):
+        """讀取配置器狀態，依策略決定是否釋放"""
+        stats = self.backend.allocator_stats()
+        if stats is None:
+            return
+        with self._lock:
+            self._last_stats = stats
+            idle_for = time.time() - self._last_activity if self._active == 0 else 0.0
+            idle_released = self._idle_released
+            # 第一個批次（通常是暖機）結束後量測一次釋放耗時，作為估計省下時間的基準
+            calibrate = not self._releases and self._avoided > 0 and self._active == 0
+        if calibrate:
+            self.release('calibration')
+            return
+        if self.policy in ('always', 'never'):
+            return
+
+        cached_mb = stats['reserved_mb'] - stats['allocated_mb']
+        if cached_mb < MIN_RELEASE_MB:
+            return
+        device_usage = 1 - stats['device_free_mb'] / stats['device_total_mb'] if stats['device_total_mb'] else 0.0
+        fragmentation = stats['inactive_split_mb'] / stats['reserved_mb'] if stats['reserved_mb'] else 0.0
+
+        if device_usage > self.pressure_threshold:
+            self.release('pressure')
+        elif fragmentation > self.fragmentation_threshold:
+            self.release('fragmentation')
+        elif self.policy == 'idle' and not idle_released and idle_for >= self.idle_seconds:
+            with self._lock:
+                self._idle_released = True
+            self.release('idle')
+
+    def get_stats(self):
+        """
+        取得記憶體管理統計
+
+        Returns:
+            dict: 策略、目前配置器狀態、各原因的釋放次數與耗時、省下的釋放次數與估計省下的時間
+        """
+        with self._lock:
+            releases = sum(self._releases.values())
+            avg_release = self._release_seconds / releases if releases else 0.0
+            stats = {
+                'enabled': True,
+                'policy': self.policy,
+                'active_batches': self._active,
+                'releases': dict(self._releases),
+                'release_seconds': round(self._release_seconds, 4),
+                'avg_release_ms': round(avg_release * 1000, 3),
+                'released_mb': round(self._released_mb, 1),
+                'avoided_releases': self._avoided,
+                # 相對於每個批次後都釋放（always）省下的請求路徑耗時，不含重新配置記憶體的成本
+                'estimated_saved_seconds': round(self._avoided * avg_release, 4),
+                'allocator': None
+            }
+            allocator = self._last_stats
+        if allocator is not None:
+            reserved = allocator['reserved_mb']
+            stats['allocator'] = {
+                'allocated_mb': round(allocator['allocated_mb'], 1),
+                'reserved_mb': round(reserved, 1),
+                'cached_mb': round(reserved - allocator['allocated_mb'], 1),
+                'inactive_split_mb': round(allocator['inactive_split_mb'], 1),
+                'fragmentation': round(allocator['inactive_split_mb'] / reserved, 4) if reserved else 0.0,
+                'device_free_mb': round(allocator['device_free_mb'], 1),
+                'device_total_mb': round(allocator['device_total_mb'], 1)
+            }
+        return stats
+
+
+class _TrackBatch:
+    """MemoryManager.track() 返回的 context manager"""
+
+    def __init__(self, manager):
+        self.manager = manager
+
+    def __enter__(self):
+        self.manager._batch_started()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.manager._batch_finished()
+        return False
@@ -0,0 +1,293 @@
+"""
+Prometheus 文字格式的服務指標
+
+計數器、量表與直方圖的更新寫入呼叫執行緒自己的分片（以 thread id 為鍵），
+熱路徑上不需要任何鎖；只有在 /metrics 被抓取時才加總所有分片。
+不依賴 prometheus_client，輸出格式相容 Prometheus text exposition format 0.0.4。
+"""
+
+import bisect
+import math
+import threading
+
+
+# 預設的延遲直方圖分界（秒），涵蓋快取命中（毫秒級）到長圖片推理（數分鐘）
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+
+class _ShardedMetric:
+    """分片指標的共用邏輯：每個執行緒只寫入自己的 dict"""
+
+    metric_type = 'untyped'
+
+    def __init__(self, name, documentation, labelnames=()):
+        """
+        Args:
+            name: 指標名稱
+            documentation: 說明文字（HELP）
+            labelnames: 標籤名稱
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._shards = {}
+
+    def _shard(self):
+        # dict.get / setdefault 在 GIL 下是原子操作；thread id 只會在原執行緒結束後才被重用，
+        # 因此同一時間只有一個執行緒寫入同一個分片
+        ident = threading.get_ident()
+        shard = self._shards.get(ident)
+        if shard is None:
+            shard = self._shards.setdefault(ident, {})
+        return shard
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def _snapshots(self):
+        # dict() 複製在 GIL 下一次完成，不會看到寫入到一半的分片
+        return [dict(shard) for shard in list(self._shards.values())]
+
+    def _labels(self, key):
+        return dict(zip(self.labelnames, key))
+
+
+class Counter(_ShardedMetric):
+    """只會增加的計數器"""
+
+    metric_type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        """
+        增加計數
+
+        Args:
+            amount: 增加量
+            **labels: 標籤值
+        """
+        shard = self._shard()
+        key = self._key(labels)
+        shard[key] = shard.get(key, 0) + amount
+
+    def collect(self):
+        totals = {}
+        for shard in self._snapshots():
+            for key, value in shard.items():
+                totals[key] = totals.get(key, 0) + value
+        samples = [(self.name, self._labels(key), value) for key, value in sorted(totals.items())]
+        return family(self.name, self.metric_type, self.documentation, samples)
+
+
+class Gauge(Counter):
+    """
+    可增可減的量表（例如處理中的請求數）
+
+    inc 與 dec 可以在不同執行緒呼叫，抓取時各分片的總和即為目前值
+    """
+
+    metric_type = 'gauge'
+
+    def dec(self, amount=1, **labels):
+        """減少數值"""
+        self.inc(-amount, **labels)
+
+
+class Histogram(_ShardedMetric):
+    """累積分佈直方圖（例如延遲）"""
+
+    metric_type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        """
+        Args:
+            name: 指標名稱
+            documentation: 說明文字（HELP）
+            labelnames: 標籤名稱
+            buckets: 遞增的分界值（+Inf 會自動加入）
+        """
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(float(b) for b in buckets if not math.isinf(b)))
+
+    def observe(self, value, **labels):
+        """
+        記錄一個觀測值
+
+        Args:
+            value: 觀測值（延遲以秒為單位）
+            **labels: 標籤值
+        """
+        shard = self._shard()
+        key = self._key(labels)
+        state = shard.get(key)
+        if state is None:
+            # [各區間計數..., +Inf 區間計數, 總和]
+            state = [0] * (len(self.buckets) + 1) + [0.0]
+            shard[key] = state
+        state[bisect.bisect_left(self.buckets, value)] += 1
+        state[-1] += value
+
+    def collect(self):
+        merged = {}
+        for shard in self._snapshots():
+            for key, state in shard.items():
+                state = list(state)
+                total = merged.get(key)
+                if total is None:
+                    merged[key] = state
+                else:
+                    merged[key] = [a + b for a, b in zip(total, state)]
+
+        samples = []
+        for key, state in sorted(merged.items()):
+            labels = self._labels(key)
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), state[:-1]):
+                cumulative += count
+                samples.append((f"{self.name}_bucket", dict(labels, le=_format_value(bound)), cumulative))
+            samples.append((f"{self.name}_sum", labels, state[-1]))
+            samples.append((f"{self.name}_count", labels, cumulative))
+        return family(self.name, self.metric_type, self.documentation, samples)
+
+
+class MetricsRegistry:
+    """指標登錄表：管理指標與抓取時才計算的收集函數"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+        self._collectors = []
+
+    def _get_or_create(self, metric_class, name, *args, **kwargs):
+        # 只在建立指標時加鎖（模組載入或服務初始化），同名指標重複登錄時返回既有的物件
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = metric_class(name, *args, **kwargs)
+                self._metrics[name] = metric
+            return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._get_or_create(Counter, name, documentation, labelnames)
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._get_or_create(Gauge, name, documentation, labelnames)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._get_or_create(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def register_collector(self, collector):
+        """
+        登錄收集函數（抓取時呼叫，返回 family 列表），適合由既有統計轉換的指標
+
+        Args:
+            collector: 無參數的函數
+        """
+        with self._lock:
+            self._collectors.append(collector)
+
+    def unregister_collector(self, collector):
+        with self._lock:
+            if collector in self._collectors:
+                self._collectors.remove(collector)
+
+    def collect(self):
+        """
+        取得所有指標
+
+        Returns:
+            list: family 列表（可 pickle，可跨行程傳遞）
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+            collectors = list(self._collectors)
+
+        families = [metric.collect() for metric in metrics]
+        for collector in collectors:
+            try:
+                families.extend(collector())
+            except Exception as e:
+                print(f"指標收集失敗 ({getattr(collector, '__name__', collector)}): {type(e).__name__}: {e}")
+        return families
+
+
+# 行程內共用的指標登錄表
+REGISTRY = MetricsRegistry()
+
+
+def family(name, metric_type, documentation, samples):
+    """
+    建立一組指標
+
+    Args:
+        name: 指標名稱
+        metric_type: counter / gauge / histogram
+        documentation: 說明文字
+        samples: (樣本名稱, 標籤 dict, 數值) 的列表
+
+    Returns:
+        dict: family
+    """
+    return {'name': name, 'type': metric_type, 'help': documentation, 'samples': list(samples)}
+
+
+def add_labels(families, **labels):
+    """
+    為所有樣本加上固定標籤（例如合併多個副本的指標時加上 replica）
+
+    Args:
+        families: family 列表
+        **labels: 要加入的標籤
+
+    Returns:
+        list: 新的 family 列表
+    """
+    return [
+        dict(item, samples=[(name, dict(sample_labels, **labels), value)
+                            for name, sample_labels, value in item['samples']])
+        for item in families
+    ]
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        if math.isinf(value):
+            return '+Inf' if value > 0 else '-Inf'
+        if math.isnan(value):
+            return 'NaN'
+        return repr(value)
+    return str(value)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def render(families):
+    """
+    輸出 Prometheus 文字格式（同名 family 會合併，例如多個副本的同一指標）
+
+    Args:
+        families: family 列表
+
+    Returns:
+        str: text exposition format 內容
+    """
+    merged = {}
+    for item in families:
+        existing = merged.get(item['name'])
+        if existing is None:
+            merged[item['name']] = dict(item, samples=list(item['samples']))
+        else:
+            existing['samples'].extend(item['samples'])
+
+    lines = []
+    for name, item in merged.items():
+        lines.append(f"# HELP {name} {_escape(item['help'])}")
+        lines.append(f"# TYPE {name} {item['type']}")
+        for sample_name, labels, value in item['samples']:
+            if labels:
+                label_text = ','.join(f'{key}="{_escape(val)}"' for key, val in labels.items())
+                lines.append(f"{sample_name}{{{label_text}}} {_format_value(value)}")
+            else:
+                lines.append(f"{sample_name} {_format_value(value)}")
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,867 @@
+"""
+DeepSeek-OCR 推理後端
+服務層只透過 load / preprocess / generate / decode 四個方法使用模型，
+可依設定切換 Unsloth、標準 Transformers 或不需要模型權重的 stub 後端
+"""
+
+import hashlib
+import os
+import queue
+import random
+import threading
+import time
+
+import torch
+
+from ocr_inference import (
+    DEFAULT_MAX_NEW_TOKENS, PromptTokenCache, prepare_inputs, generate_ids, decode_outputs, OCRTextStreamer, VisionEncodeTimer,
+    CachedVisionEncoder
+)
+from repetition import is_content_text
+from vision_cache import build_vision_key
+
+
+def check_gpu_memory(device=None):
+    """
+    檢查 GPU 記憶體狀態
+
+    Args:
+        device: 要檢查的設備（例如 "cuda:1"），預設為目前的 GPU；CPU 設備視為不可用
+
+    Returns:
+        dict: GPU 記憶體資訊
+            {
+                'available': bool,
+                'total_mb': float,
+                'used_mb': float,
+                'free_mb': float,
+                'usage_percent': float
+            }
+    """
+    if not torch.cuda.is_available() or (device is not None and not str(device).startswith('cuda')):
+        return {
+            'available': False,
+            'total_mb': 0,
+            'used_mb': 0,
+            'free_mb': 0,
+            'usage_percent': 0
+        }
+
+    # 獲取 GPU 記憶體資訊
+    device = device if device is not None and ':' in str(device) else torch.cuda.current_device()
+    total = torch.cuda.get_device_properties(device).total_memory / (1024 ** 2)  # 轉換為 MB
+    reserved = torch.cuda.memory_reserved(device) / (1024 ** 2)
+    free = total - reserved
+
+    return {
+        'available': True,
+        'total_mb': round(total, 2),
+        'used_mb': round(reserved, 2),
+        'free_mb': round(free, 2),
+        'usage_percent': round((reserved / total) * 100, 2)
+    }
+
+
+class InferenceBackend:
+    """
+    推理後端介面
+
+    - load(): 載入模型
+    - preprocess(image, prompt, ...): 將已解碼的圖片與提示詞轉為單筆模型輸入
+    - generate(batch_inputs, ...): 以一次呼叫處理整個批次，回傳尚未解碼的輸出
+    - decode(outputs): 將 generate 的輸出轉為與批次順序一致的文字列表
+    """
+
+    name = 'base'
+
+    def __init__(self, model_name, model_dir, device=None):
+        """
+        Args:
+            model_name: 模型名稱
+            model_dir: 模型本地目錄
+            device: 推理設備，None 表示由後端自行決定
+        """
+        self.model_name = model_name
+        self.model_dir = model_dir
+        self.device = device
+        self.model = None
+        self.tokenizer = None
+        self.vision_cache = None
+        self.prompt_cache = None
+
+    def load(self):
+        """載入模型與 tokenizer"""
+        raise NotImplementedError
+
+    def enable_prompt_cache(self, hot_prompts=(), max_items=64):
+        """
+        啟用提示詞 tokenize 結果快取（需在 load 或 load_preprocessor 之後呼叫）
+
+        Args:
+            hot_prompts: 預先 tokenize 並常駐的常用提示詞
+            max_items: 其他提示詞最多保留的數量
+
+        Returns:
+            bool: 此後端是否支援
+        """
+        return False
+
+    def enable_vision_cache(self, cache):
+        """
+        啟用視覺編碼結果快取（需在 load 之後呼叫）
+
+        Args:
+            cache: VisionFeatureCache
+
+        Returns:
+            bool: 此後端是否支援
+        """
+        return False
+
+    def load_preprocessor(self):
+        """只載入 preprocess 需要的部分（供前處理子行程使用，不載入模型權重）"""
+        pass
+
+    def preprocess(self, image, prompt, base_size, image_size, crop_mode, image_key=None):
+        """
+        將圖片與提示詞轉為單筆模型輸入
+
+        Args:
+            image: 已解碼的 RGB 圖片
+            prompt: 提示詞
+            base_size: 全域視圖尺寸
+            image_size: 局部裁切尺寸
+            crop_mode: 是否啟用裁切模式
+            image_key: 圖片內容雜湊（啟用視覺編碼結果快取時提供）
+
+        Returns:
+            object: 傳給 generate 的單筆輸入
+        """
+        raise NotImplementedError
+
+    def generate(self, batch_inputs, cancel_events=None, streamer=None,
+                 max_new_tokens=DEFAULT_MAX_NEW_TOKENS, timings=None, repetition=None):
+        """
+        以一次呼叫處理整個批次
+
+        Args:
+            batch_inputs: preprocess 產生的輸入列表
+            cancel_events: 與 batch_inputs 順序一致的取消旗標列表（可選）
+            streamer: create_streamer 建立的 streamer（僅支援單張圖片）
+            max_new_tokens: 最大生成 token 數，或與 batch_inputs 順序一致的每張圖片的輸出 token 預算
+            timings: 記錄各階段耗時（秒）的 dict（可選），例如 vision_encode、prefill、token_generation
+            repetition: 與 batch_inputs 順序一致的 repetition.RepetitionDetector（可選），
+                        每個生成步驟餵入新 token，確認重複迴圈的圖片停止生成
+
+        Returns:
+            object: 傳給 decode 的輸出
+        """
+        raise NotImplementedError
+
+    def decode(self, outputs):
+        """
+        將 generate 的輸出轉為文字
+
+        Args:
+            outputs: generate 的回傳值
+
+        Returns:
+            list: 與批次順序一致的 OCR 文字
+        """
+        raise NotImplementedError
+
+    def count_tokens(self, outputs):
+        """
+        計算每筆輸出實際生成的 token 數（不含補齊的 pad/eos）
+
+        Args:
+            outputs: generate 的回傳值
+
+        Returns:
+            list: 與批次順序一致的 token 數
+        """
+        raise NotImplementedError
+
+    def is_content_token(self, token):
+        """
+        判斷 generate 餵給 RepetitionDetector 的 token 是否為文字 token（表格標籤、標點與換行不是）
+
+        Args:
+            token: 生成的 token（依後端為 token id 或文字）
+
+        Returns:
+            bool: 是否為文字 token
+        """
+        return is_content_text(str(token))
+
+    def create_streamer(self):
+        """
+        建立逐段接收生成文字的 streamer（供 iter_streamer 迭代）
+
+        Returns:
+            OCRTextStreamer: 與此後端相容的 streamer
+        """
+        return OCRTextStreamer(self.tokenizer)
+
+    def memory_info(self):
+        """
+        取得推理設備的記憶體狀態
+
+        Returns:
+            dict: 與 check_gpu_memory 格式相同的記憶體資訊
+        """
+        return check_gpu_memory(self.device)
+
+    def _cuda_device(self):
+        """推理設備為 CUDA 時返回該設備，否則為 None"""
+        if not torch.cuda.is_available():
+            return None
+        if self.device is None:
+            return torch.cuda.current_device()
+        return self.device if str(self.device).startswith('cuda') else None
+
+    def reset_peak_memory(self):
+        """
+        開始記錄推理期間的峰值記憶體（供記憶體准入控制學習實際用量）
+
+        Returns:
+            float: 目前已配置的記憶體（MB），不支援量測時為 None
+        """
+        device = self._cuda_device()
+        if device is None:
+            return None
+        torch.cuda.reset_peak_memory_stats(device)
+        return torch.cuda.memory_allocated(device) / (1024 ** 2)
+
+    def peak_memory(self):
+        """
+        Returns:
+            float: reset_peak_memory 之後的峰值已配置記憶體（MB），不支援量測時為 None
+        """
+        device = self._cuda_device()
+        if device is None:
+            return None
+        return torch.cuda.max_memory_allocated(device) / (1024 ** 2)
+
+    def allocator_stats(self):
+        """
+        取得推理設備記憶體配置器的狀態（供背景記憶體管理判斷是否需要釋放）
+
+        Returns:
+            dict: {'allocated_mb', 'reserved_mb', 'inactive_split_mb'（已保留但因切割而無法使用的部分）,
+                   'device_free_mb', 'device_total_mb'（包含其他行程的設備用量）}，不支援時為 None
+        """
+        device = self._cuda_device()
+        if device is None:
+            return None
+        stats = torch.cuda.memory_stats(device)
+        free, total = torch.cuda.mem_get_info(device)
+        return {
+            'allocated_mb': stats.get('allocated_bytes.all.current', 0) / (1024 ** 2),
+            'reserved_mb': stats.get('reserved_bytes.all.current', 0) / (1024 ** 2),
+            'inactive_split_mb': stats.get('inactive_split_bytes.all.current', 0) / (1024 ** 2),
+            'device_free_mb': free / (1024 ** 2),
+            'device_total_mb': total / (1024 ** 2)
+        }
+
+    def clear_cache(self):
+        """釋放推理設備上未使用的快取記憶體"""
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+            torch.cuda.synchronize()
+
+
+class TransformersBackend(InferenceBackend):
+    """標準 Transformers 後端（不使用 Unsloth，支援 CPU）"""
+
+    name = 'transformers'
+
+    def __init__(self, model_name, model_dir, device=None):
+        # 整個模型固定在單一設備上，避免多 GPU 導致的 tensor 設備不一致問題；
+        # 需要使用多張 GPU 時，請以 replica_pool 為每張 GPU 啟動一個副本
+        if device is None:
+            device = "cuda:0" if torch.cuda.is_available() else "cpu"
+        super().__init__(model_name, model_dir, device=device)
+        self.use_cuda = self.device.startswith('cuda')
+        # 模型權重使用 float16，圖片輸入沿用模型 infer 的 bfloat16（於 autocast 內計算）
+        self.image_dtype = torch.bfloat16 if self.use_cuda else torch.float32
+        self.vision_timer = None
+
+    def load(self):
+        from transformers import AutoModel, AutoTokenizer
+
+        # 禁用 SDPA (Scaled Dot Product Attention) 以避免 CUDA 錯誤
+        # 這個問題出現在 transformers 4.55+ 版本的 create_causal_mask 函數中
+        if hasattr(torch.backends.cuda, 'enable_flash_sdp'):
+            torch.backends.cuda.enable_flash_sdp(False)
+        if hasattr(torch.backends.cuda, 'enable_mem_efficient_sdp'):
+            torch.backends.cuda.enable_mem_efficient_sdp(False)
+        if hasattr(torch.backends.cuda, 'enable_math_sdp'):
+            torch.backends.cuda.enable_math_sdp(True)  # 使用標準數學實現
+
+        print(f"模型目錄: {self.model_dir}")
+
+        if self.use_cuda:
+            torch.cuda.set_device(self.device)
+            gpu_name = torch.cuda.get_device_name(self.device)
+            gpu_memory = torch.cuda.get_device_properties(self.device).total_memory / (1024**3)
+            print(f"✅ GPU 可用: {gpu_name} ({gpu_memory:.1f} GB)，使用設備: {self.device}")
+        else:
+            print("⚠️  警告: 使用 CPU 推理（速度會很慢）")
+
+        # 決定從哪裡載入模型（本地目錄或 Hugging Face Hub）
+        # 檢查本地目錄是否存在且包含必要文件
+        model_source = self.model_dir
+        if os.path.exists(self.model_dir) and os.path.isfile(os.path.join(self.model_dir, "config.json")):
+            print(f"✅ 使用本地模型目錄: {self.model_dir}")
+        else:
+            print(f"⚠️  本地目錄 {self.model_dir} 不存在或不完整")
+            print(f"   將從 Hugging Face Hub 下載模型: {self.model_name}")
+
+            # 自動下載模型到本地目錄
+            print(f"   正在下載模型到 {self.model_dir}...")
+            from huggingface_hub import snapshot_download
+            try:
+                snapshot_download(self.model_name, local_dir=self.model_dir)
+                print(f"✅ 模型下載完成: {self.model_dir}")
+            except Exception as e:
+                print(f"❌ 模型下載失敗: {e}")
+                print(f"   將嘗試直接從 Hugging Face Hub 載入")
+                model_source = self.model_name
+
+        # 載入 tokenizer
+        print("載入 tokenizer...")
+        self.tokenizer = AutoTokenizer.from_pretrained(
+            model_source,
+            trust_remote_code=True
+        )
+
+        # 載入模型（使用標準 AutoModel），使用最保守的設定避免 CUDA 問題
+        print("載入模型...")
+        load_kwargs = {
+            "trust_remote_code": True,
+            "low_cpu_mem_usage": True,
+            # 使用 float16 而非 bfloat16，相容性更好
+            "torch_dtype": torch.float16 if self.use_cuda else torch.float32
+        }
+
+        # 先載入模型到 CPU，再手動移動到 GPU（避免 device_map 的問題）
+        self.model = AutoModel.from_pretrained(model_source, **load_kwargs)
+        if self.use_cuda:
+            print(f"將模型移動到 {self.device}...")
+            self.model = self.model.to(self.device)
+
+        # 確保模型在評估模式
+        self.model.eval()
+        self.vision_timer = VisionEncodeTimer(self.model, self.use_cuda)
+
+        gpu_mem = self.memory_info()
+        if gpu_mem['available']:
+            print(f"GPU 記憶體: {gpu_mem['used_mb']:.0f}MB / {gpu_mem['total_mb']:.0f}MB ({gpu_mem['usage_percent']:.1f}%)")
+
+    def load_preprocessor(self):
+        from transformers import AutoTokenizer
+
+        # 由服務行程的 load() 負責下載模型，這裡只讀取已存在的本地目錄
+        source = self.model_dir
+        if not os.path.isfile(os.path.join(self.model_dir, "config.json")):
+            source = self.model_name
+        self.tokenizer = AutoTokenizer.from_pretrained(source, trust_remote_code=True)
+
+    def enable_prompt_cache(self, hot_prompts=(), max_items=64):
+        self.prompt_cache = PromptTokenCache(self.tokenizer, max_items=max_items)
+        self.prompt_cache.register(hot_prompts)
+        return True
+
+    def enable_vision_cache(self, cache):
+        encoder = CachedVisionEncoder(self.model, cache, self.use_cuda)
+        if not encoder.enabled:
+            return False
+        self.vision_cache = cache
+        return True
+
+    def preprocess(self, image, prompt, base_size, image_size, crop_mode, image_key=None):
+        inputs = prepare_inputs(
+            self.tokenizer,
+            image,
+            prompt,
+            base_size=base_size,
+            image_size=image_size,
+            crop_mode=crop_mode,
+            dtype=self.image_dtype,
+            prompt_tokens=self.prompt_cache.get(prompt) if self.prompt_cache is not None else None
+        )
+        if image_key is not None:
+            inputs['vision_key'] = build_vision_key(image_key, base_size, image_size, crop_mode)
+        return inputs
+
+    def generate(self, batch_inputs, cancel_events=None, streamer=None,
+                 max_new_tokens=DEFAULT_MAX_NEW_TOKENS, timings=None, repetition=None):
+        with self.vision_timer.track(timings):
+            return generate_ids(
+                self.model, self.tokenizer, batch_inputs, device=self.device,
+                max_new_tokens=max_new_tokens, cancel_events=cancel_events, streamer=streamer,
+                timings=timings, repetition=repetition
+            )
+
+    def decode(self, outputs):
+        output_ids, prompt_length = outputs
+        return decode_outputs(self.tokenizer, output_ids, prompt_length)
+
+    def count_tokens(self, outputs):
+        output_ids, prompt_length = outputs
+        eos_token_id = self.tokenizer.eos_token_id
+        pad_token_id = self.tokenizer.pad_token_id
+        counts = []
+        for row in output_ids:
+            generated = row[prompt_length:].tolist()
+            if eos_token_id is not None and eos_token_id in generated:
+                generated = generated[:generated.index(eos_token_id) + 1]
+            # 提前停止（取消、重複迴圈、輸出預算）的序列之後補上的 padding 不計入
+            if pad_token_id is not None and pad_token_id != eos_token_id and pad_token_id in generated:
+                generated = generated[:generated.index(pad_token_id)]
+            counts.append(len(generated))
+        return counts
+
+    def is_content_token(self, token):
+        return is_content_text(self.tokenizer.decode([int(token)], skip_special_tokens=True))
+
+
+class UnslothBackend(TransformersBackend):
+    """Unsloth 後端（推理較快，只支援 CUDA）"""
+
+    name = 'unsloth'
+
+    def __init__(self, model_name, model_dir, device=None):
+        super().__init__(model_name, model_dir, device=device or ("cuda" if torch.cuda.is_available() else "cpu"))
+        # Unsloth 以 bfloat16 載入權重，圖片輸入沿用模型 infer 的預設 dtype
+        self.image_dtype = torch.bfloat16
+
+    def load(self):
+        from transformers import AutoModel
+
+        model_name = self.model_name
+        model_dir = self.model_dir
+
+        # 下載模型（如果本地不存在）
+        if not os.path.exists(model_dir):
+            print(f"正在下載模型到 {model_dir}...")
+            print("提示: 如果下載失敗，請執行以下步驟：")
+            print("  1. 登入 Hugging Face: huggingface-cli login")
+            print("  2. 或設定環境變數: export HF_TOKEN=your_token")
+
+            from huggingface_hub import snapshot_download
+
+            # 嘗試下載模型
+            downloaded = False
+            error_msg = None
+
+            # 方法 1: 嘗試從 unsloth 下載
+            if not downloaded:
+                print(f"\n嘗試從 {model_name} 下載...")
+                try:
+                    snapshot_download(model_name, local_dir=model_dir)
+                    downloaded = True
+                    print("✅ 模型下載完成！")
+                except Exception as e:
+                    error_msg = str(e)
+                    print(f"❌ 從 {model_name} 下載失敗: {e}")
+
+            # 方法 2: 嘗試從 deepseek-ai 官方倉庫下載
+            if not downloaded:
+                alternative_name = "deepseek-ai/deepseek-ocr"
+                print(f"\n嘗試從官方倉庫 {alternative_name} 下載...")
+                try:
+                    snapshot_download(alternative_name, local_dir=model_dir)
+                    downloaded = True
+                    print("✅ 模型下載完成！")
+                except Exception as e:
+                    print(f"❌ 從 {alternative_name} 下載失敗: {e}")
+
+            if not downloaded:
+                error_message = f"""
+❌ 模型下載失敗！
+
+錯誤原因: {error_msg}
+
+解決方法：
+
+方法 1: 登入 Hugging Face
+  執行以下指令登入：
+  $ huggingface-cli login
+  然後輸入您的 Hugging Face token
+
+方法 2: 設定環境變數
+  $ export HF_TOKEN=your_huggingface_token
+
+方法 3: 手動下載模型
+  1. 訪問 https://huggingface.co/unsloth/DeepSeek-OCR
+  2. 點擊 "Files and versions"
+  3. 下載所有檔案到 {model_dir}/ 目錄
+
+方法 4: 使用 Git LFS 手動克隆
+  $ git lfs install
+  $ git clone https://huggingface.co/unsloth/DeepSeek-OCR {model_dir}
+
+獲取 Hugging Face Token:
+  1. 訪問 https://huggingface.co/settings/tokens
+  2. 創建一個新的 token (需要 read 權限)
+  3. 使用該 token 登入或設定環境變數
+"""
+                print(error_message)
+                raise Exception(error_message)
+
+        # 設定環境變數以避免警告和跳過統計收集
+        os.environ["UNSLOTH_WARN_UNINITIALIZED"] = '0'
+        os.environ["HF_HUB_OFFLINE"] = '1'  # 強制離線模式，跳過統計收集
+        os.environ["TRANSFORMERS_TRUST_REMOTE_CODE"] = '1'  # 自動信任遠程代碼，不詢問
+
+        # 延遲導入 unsloth，避免在模組載入時觸發 vllm 的 C++ ABI 錯誤
+        # 只有在實際需要載入模型時才導入
+        # 嘗試設置環境變數來避免 vllm 相關問題
+        os.environ.setdefault("VLLM_USE_PRECOMPILED", "0")
+
+        try:
+            from unsloth import FastVisionModel
+        except ImportError as e:
+            error_msg = f"""
+無法導入 unsloth 模組！
+
+錯誤訊息: {e}
+
+這通常是因為 vllm 和 PyTorch 版本不匹配導致的 C++ ABI 錯誤。
+
+解決方案：
+
+1. 重新安裝 unsloth（推薦）：
+   pip install --upgrade --force-reinstall --no-cache-dir unsloth unsloth_zoo
+
+2. 確認 PyTorch 版本兼容性：
+   python -c "import torch; print(f'PyTorch: {{torch.__version__}}')"
+   python -c "import torch; print(f'CUDA Available: {{torch.cuda.is_available()}}')"
+
+3. 如果問題持續，嘗試重新安裝 PyTorch：
+   pip install --upgrade torch torchvision torchaudio --index-url https://download.pytorch.org/whl/cu118
+
+4. 清理並重新安裝：
+   pip uninstall -y vllm unsloth unsloth_zoo
+   pip install --upgrade unsloth
+
+5. 或改用標準 Transformers 後端：
+   export OCR_BACKEND=transformers
+"""
+            print(error_msg)
+            raise ImportError(error_msg)
+        except Exception as e:
+            # 捕獲其他可能的錯誤（如 C++ ABI 錯誤）
+            error_msg = f"""
+導入 unsloth 時發生錯誤！
+
+錯誤訊息: {e}
+
+這可能是由於 vllm 和 PyTorch 版本不匹配導致的 C++ ABI 錯誤。
+
+解決方案：
+
+1. 重新安裝 unsloth（推薦）：
+   pip install --upgrade --force-reinstall --no-cache-dir unsloth unsloth_zoo
+
+2. 確認 PyTorch 版本兼容性：
+   python -c "import torch; print(f'PyTorch: {{torch.__version__}}')"
+   python -c "import torch; print(f'CUDA Available: {{torch.cuda.is_available()}}')"
+
+3. 如果問題持續，嘗試重新安裝 PyTorch：
+   pip install --upgrade torch torchvision torchaudio --index-url https://download.pytorch.org/whl/cu118
+
+4. 清理並重新安裝：
+   pip uninstall -y vllm unsloth unsloth_zoo
+   pip install --upgrade unsloth
+
+5. 或改用標準 Transformers 後端：
+   export OCR_BACKEND=transformers
+"""
+            print(error_msg)
+            raise RuntimeError(error_msg)
+
+        # 指定 GPU 時先切換目前設備，Unsloth 會把模型載入到目前的 GPU
+        if self.device.startswith('cuda:'):
+            torch.cuda.set_device(self.device)
+
+        # 初始化模型
+        self.model, self.tokenizer = FastVisionModel.from_pretrained(
+            model_dir,
+            load_in_4bit=False,  # 使用 16bit 以獲得更好的精確度
+            auto_model=AutoModel,
+            trust_remote_code=True,
+            unsloth_force_compile=True,
+            use_gradient_checkpointing="unsloth",
+            local_files_only=True,  # 只使用本地檔案，不嘗試連線
+            revision=None,  # 避免版本檢查
+        )
+        self.vision_timer = VisionEncodeTimer(self.model, self.use_cuda)
+
+
+class StubTextStreamer:
+    """stub 後端使用的 streamer，介面與 OCRTextStreamer 相同（逾時拋出 queue.Empty）"""
+
+    def __init__(self, timeout=1.0):
+        """
+        Args:
+            timeout: 每次等待新文字片段的秒數
+        """
+        self.timeout = timeout
+        self._queue = queue.Queue()
+
+    def put_text(self, text):
+        self._queue.put(text)
+
+    def end(self):
+        self._queue.put(None)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        text = self._queue.get(timeout=self.timeout)
+        if text is None:
+            raise StopIteration()
+        return text
+
+
+class StubBackend(InferenceBackend):
+    """
+    不需要模型權重與 GPU 的確定性後端，用於測試與壓測服務層（佇列、微批次、快取）
+
+    - 輸出文字由圖片內容與提示詞的雜湊決定，相同輸入永遠得到相同結果
+    - 延遲模擬預填與逐 token 解碼：每批次 prefill_ms，之後每個生成步驟 ms_per_token
+      （批次中的圖片共用生成步驟，與真實模型相同）
+    - 每張處理中的圖片實際配置 memory_mb 的記憶體，memory_info 回報模擬的設備用量；
+      allocator_stats 模擬配置器保留的記憶體（clear_cache 之前維持在最高用量）
+    - vision_ms > 0 時模擬每張圖片的視覺編碼延遲（啟用視覺編碼結果快取時，命中的圖片不再等待）
+    - loop_ratio > 0 時依雜湊選出這個比例的圖片模擬重複迴圈（不斷重複同一行直到 max_new_tokens）
+    """
+
+    name = 'stub'
+
+    # 產生假文字使用的字彙
+    VOCABULARY = (
+        '發票', '收據', '金額', '日期', '統一編號', '品名', '數量', '單價', '小計', '合計',
+        'Invoice', 'Total', 'Date', 'Item', 'Qty', 'Price', 'Tax', 'No.', '2024', '1,280'
+    )
+
+    def __init__(self, model_name, model_dir, device=None, prefill_ms=50, ms_per_token=5,
+                 output_tokens=64, memory_mb=64, model_memory_mb=6500, total_memory_mb=24576, vision_ms=0,
+                 loop_ratio=0.0):
+        """
+        Args:
+            model_name: 模型名稱（只用於顯示與快取鍵值）
+            model_dir: 不使用
+            device: 回報的設備名稱，預設為 "cpu"
+            prefill_ms: 每批次的預填延遲（毫秒）
+            ms_per_token: 每個生成步驟的延遲（毫秒）
+            output_tokens: 每張圖片的平均輸出 token 數（實際值依雜湊在 0.5-1.5 倍之間）
+            memory_mb: 每張處理中的圖片配置的記憶體（MB）
+            model_memory_mb: 模擬的模型權重佔用（MB，不實際配置）
+            total_memory_mb: 模擬的設備總記憶體（MB）
+            vision_ms: 每張圖片的視覺編碼延遲（毫秒），預設 0（不模擬）
+            loop_ratio: 模擬重複迴圈的圖片比例，預設 0（不模擬）
+        """
+        super().__init__(model_name, model_dir, device=device or 'cpu')
+        self.prefill_ms = max(0.0, float(prefill_ms))
+        self.ms_per_token = max(0.0, float(ms_per_token))
+        self.output_tokens = max(1, int(output_tokens))
+        self.memory_mb = max(0, int(memory_mb))
+        self.model_memory_mb = max(0, int(model_memory_mb))
+        self.total_memory_mb = max(1, int(total_memory_mb))
+        self.vision_ms = max(0.0, float(vision_ms))
+        self.loop_ratio = min(1.0, max(0.0, float(loop_ratio)))
+
+        self._memory_lock = threading.Lock()
+        self._allocated_mb = 0
+        self._peak_mb = 0
+        self._window_peak_mb = 0  # reset_peak_memory 之後的峰值
+        self._reserved_mb = 0  # 模擬配置器保留的記憶體（clear_cache 之前不會縮小）
+
+    def load(self):
+        print(f"使用 stub 推理後端: prefill_ms={self.prefill_ms}, ms_per_token={self.ms_per_token}, "
+              f"output_tokens={self.output_tokens}, memory_mb={self.memory_mb}")
+
+    def enable_vision_cache(self, cache):
+        self.vision_cache = cache
+        return True
+
+    def preprocess(self, image, prompt, base_size, image_size, crop_mode, image_key=None):
+        digest = hashlib.sha256()
+        digest.update(image.tobytes())
+        digest.update(prompt.encode('utf-8'))
+        digest.update(f"{base_size}:{image_size}:{crop_mode}".encode('utf-8'))
+        inputs = {'digest': digest.hexdigest(), 'image_size': image.size}
+        if image_key is not None:
+            inputs['vision_key'] = build_vision_key(image_key, base_size, image_size, crop_mode)
+            # 模擬的視覺特徵大小：全域視圖的視覺 token 數 × 隱藏層維度 1280 × bfloat16
+            inputs['vision_bytes'] = (base_size // 64) ** 2 * 1280 * 2
+        return inputs
+
+    def _encode_vision(self, item):
+        """模擬單張圖片的視覺編碼（快取命中時不等待）"""
+        key = item.get('vision_key')
+        if self.vision_cache is not None and key is not None and self.vision_cache.get(key) is not None:
+            return
+        time.sleep(self.vision_ms / 1000)
+        if self.vision_cache is not None and key is not None:
+            self.vision_cache.put(key, True, item['vision_bytes'], self.vision_ms / 1000)
+
+    def _tokens_for(self, digest, max_new_tokens):
+        """依雜湊決定輸出的 token 列表（確定性）"""
+        rng = random.Random(digest)
+        count = max(1, int(self.output_tokens * (0.5 + rng.random())))
+        tokens = [f"STUB-{digest[:12]}\n"]
+        for idx in range(1, count):
+            word = rng.choice(self.VOCABULARY)
+            tokens.append(word + ('\n' if idx % 8 == 0 else ' '))
+        if rng.random() < self.loop_ratio:
+            # 退化的輸出：逐字重複同一行直到生成上限
+            line = [word + ' ' for word in rng.sample(self.VOCABULARY, 18)] + ['\n']
+            while len(tokens) < max_new_tokens:
+                tokens.extend(line)
+        return tokens[:max_new_tokens]
+
+    def _allocate(self, batch_size):
+        """配置批次所需的記憶體，並更新模擬用量"""
+        size = self.memory_mb * batch_size * 1024 * 1024
+        buffer = bytearray(size)
+        # 逐頁寫入，讓記憶體實際被配置（而非只保留虛擬位址）
+        if size:
+            buffer[::4096] = b'\x01' * len(range(0, size, 4096))
+        with self._memory_lock:
+            self._allocated_mb += self.memory_mb * batch_size
+            self._peak_mb = max(self._peak_mb, self._allocated_mb)
+            self._window_peak_mb = max(self._window_peak_mb, self._allocated_mb)
+            self._reserved_mb = max(self._reserved_mb, self._allocated_mb)
+        return buffer
+
+    def _release(self, batch_size):
+        with self._memory_lock:
+            self._allocated_mb -= self.memory_mb * batch_size
+
+    def generate(self, batch_inputs, cancel_events=None, streamer=None,
+                 max_new_tokens=DEFAULT_MAX_NEW_TOKENS, timings=None, repetition=None):
+        cancel_events = cancel_events or [None] * len(batch_inputs)
+        budgets = max_new_tokens if isinstance(max_new_tokens, (list, tuple)) else [max_new_tokens] * len(batch_inputs)
+        planned = [self._tokens_for(item['digest'], budget) for item, budget in zip(batch_inputs, budgets)]
+        outputs = [[] for _ in batch_inputs]
+
+        buffer = self._allocate(len(batch_inputs))
+        vision_start = generate_start = time.perf_counter()
+        first_step_at = None
+        try:
+            if self.vision_ms > 0:
+                for item in batch_inputs:
+                    self._encode_vision(item)
+                generate_start = time.perf_counter()
+            time.sleep(self.prefill_ms / 1000)
+            first_step_at = time.perf_counter()
+            for step in range(max(len(tokens) for tokens in planned)):
+                active = [
+                    idx for idx, tokens in enumerate(planned)
+                    if step < len(tokens) and not (cancel_events[idx] is not None and cancel_events[idx].is_set())
+                    and not (repetition is not None and repetition.stopped_at[idx] is not None)
+                ]
+                # 全部完成或取消時立即結束
+                if not active:
+                    break
+                time.sleep(self.ms_per_token / 1000)
+                for idx in active:
+                    outputs[idx].append(planned[idx][step])
+                    if streamer is not None:
+                        streamer.put_text(planned[idx][step])
+                    if repetition is not None:
+                        repetition.update(idx, planned[idx][step])
+        finally:
+            del buffer
+            self._release(len(batch_inputs))
+            if streamer is not None:
+                streamer.end()
+
+        if timings is not None:
+            finished_at = time.perf_counter()
+            if self.vision_ms > 0:
+                timings['vision_encode'] = generate_start - vision_start
+            timings['prefill'] = first_step_at - generate_start
+            timings['token_generation'] = finished_at - first_step_at
+
+        return outputs
+
+    def decode(self, outputs):
+        return [''.join(tokens).strip() for tokens in outputs]
+
+    def count_tokens(self, outputs):
+        return [len(tokens) for tokens in outputs]
+
+    def create_streamer(self):
+        return StubTextStreamer()
+
+    def memory_info(self):
+        with self._memory_lock:
+            used = self.model_memory_mb + self._allocated_mb
+            peak = self.model_memory_mb + self._peak_mb
+        return {
+            'available': True,
+            'total_mb': float(self.total_memory_mb),
+            'used_mb': float(used),
+            'free_mb': float(self.total_memory_mb - used),
+            'usage_percent': round(used / self.total_memory_mb * 100, 2),
+            'peak_mb': float(peak),
+            'simulated': True
+        }
+
+    def reset_peak_memory(self):
+        with self._memory_lock:
+            self._window_peak_mb = self._allocated_mb
+            return float(self.model_memory_mb + self._allocated_mb)
+
+    def peak_memory(self):
+        with self._memory_lock:
+            return float(self.model_memory_mb + self._window_peak_mb)
+
+    def allocator_stats(self):
+        with self._memory_lock:
+            reserved = self.model_memory_mb + self._reserved_mb
+            return {
+                'allocated_mb': float(self.model_memory_mb + self._allocated_mb),
+                'reserved_mb': float(reserved),
+                'inactive_split_mb': 0.0,
+                'device_free_mb': float(self.total_memory_mb - reserved),
+                'device_total_mb': float(self.total_memory_mb)
+            }
+
+    def clear_cache(self):
+        with self._memory_lock:
+            self._reserved_mb = self._allocated_mb
+
+
+BACKENDS = {
+    'unsloth': UnslothBackend,
+    'transformers': TransformersBackend,
+    'stub': StubBackend
+}
+
+
+def create_backend(name, model_name, model_dir, device=None, **options):
+    """
+    依名稱建立推理後端
+
+    Args:
+        name: 後端名稱（"unsloth"、"transformers" 或 "stub"）
+        model_name: 模型名稱
+        model_dir: 模型本地目錄
+        device: 推理設備
+        **options: 後端專屬參數（例如 stub 的延遲與記憶體設定）
+
+    Returns:
+        InferenceBackend: 尚未載入模型的後端
+    """
+    backend_class = BACKENDS.get(str(name).lower())
+    if backend_class is None:
+        raise ValueError(f"不支援的推理後端: {name}（可用: {', '.join(BACKENDS)}）")
+    return backend_class(model_name, model_dir, device=device, **options)
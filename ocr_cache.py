@@ -0,0 +1,231 @@
+"""
+OCR 結果快取
+以圖片內容雜湊加上提示詞與圖片處理參數作為鍵值，
+前端為有容量上限的記憶體 LRU，後端為有大小上限的磁碟快取
+"""
+
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+
+def build_cache_key(image_bytes, prompt, base_size, image_size, crop_mode, test_compress, model_name=''):
+    """
+    建立 OCR 結果的快取鍵值
+
+    Args:
+        image_bytes: 圖片原始位元組
+        prompt: 實際使用的提示詞
+        base_size: 圖片預處理基準尺寸
+        image_size: 模型輸入圖片尺寸
+        crop_mode: 是否啟用裁切模式
+        test_compress: 是否測試壓縮
+        model_name: 模型名稱（不同模型的結果不共用）
+
+    Returns:
+        str: SHA-256 十六進位字串
+    """
+    settings = json.dumps({
+        'prompt': prompt,
+        'base_size': base_size,
+        'image_size': image_size,
+        'crop_mode': crop_mode,
+        'test_compress': test_compress,
+        'model_name': model_name
+    }, sort_keys=True, ensure_ascii=False)
+
+    digest = hashlib.sha256()
+    digest.update(hashlib.sha256(image_bytes).digest())
+    digest.update(settings.encode('utf-8'))
+    return digest.hexdigest()
+
+
+class OCRResultCache:
+    """
+    兩層式 OCR 結果快取
+
+    - 記憶體層：以 OrderedDict 實作的 LRU，超過 memory_max_items 時淘汰最久未使用的項目
+    - 磁碟層：每個結果一個 JSON 檔案，總大小超過 disk_max_mb 時淘汰最久未使用的檔案
+    """
+
+    def __init__(self, memory_max_items=256, disk_dir=None, disk_max_mb=512):
+        """
+        初始化 OCR 結果快取
+
+        Args:
+            memory_max_items: 記憶體層最多保留的結果數
+            disk_dir: 磁碟層目錄，None 表示停用磁碟層
+            disk_max_mb: 磁碟層大小上限（MB）
+        """
+        self.memory_max_items = max(0, int(memory_max_items))
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = int(disk_max_mb * 1024 * 1024)
+
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        self._disk_index = OrderedDict()  # key -> 檔案大小，依存取順序排列
+        self._disk_bytes = 0
+
+        self._stats = {
+            'memory_hits': 0,
+            'disk_hits': 0,
+            'misses': 0,
+            'memory_evictions': 0,
+            'disk_evictions': 0,
+            'writes': 0
+        }
+
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+            self._load_disk_index()
+
+    def _disk_path(self, key):
+        """取得鍵值對應的磁碟檔案路徑"""
+        return os.path.join(self.disk_dir, key[:2], f"{key}.json")
+
+    def _load_disk_index(self):
+        """啟動時掃描磁碟快取，依最後存取時間重建 LRU 索引"""
+        entries = []
+        for root, _, filenames in os.walk(self.disk_dir):
+            for filename in filenames:
+                if not filename.endswith('.json'):
+                    continue
+                filepath = os.path.join(root, filename)
+                try:
+                    stat = os.stat(filepath)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, filename[:-len('.json')], stat.st_size))
+
+        for _, key, size in sorted(entries):
+            self._disk_index[key] = size
+            self._disk_bytes += size
+
+        print(f"OCR 磁碟快取: {len(self._disk_index)} 筆，共 {self._disk_bytes / (1024 ** 2):.2f} MB")
+
+    def get(self, key):
+        """
+        查詢快取
+
+        Args:
+            key: build_cache_key 產生的鍵值
+
+        Returns:
+            dict: 快取的 OCR 結果，未命中時返回 None
+        """
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self._stats['memory_hits'] += 1
+                return dict(self._memory[key])
+
+            in_disk = key in self._disk_index
+
+        if in_disk:
+            filepath = self._disk_path(key)
+            try:
+                with open(filepath, 'r', encoding='utf-8') as f:
+                    result = json.load(f)
+                # 更新修改時間，重啟後仍能依存取順序淘汰
+                os.utime(filepath, None)
+            except (OSError, ValueError) as e:
+                print(f"讀取磁碟快取失敗，將忽略該項目: {e}")
+                with self._lock:
+                    self._drop_disk_entry(key)
+                    self._stats['misses'] += 1
+                return None
+
+            with self._lock:
+                if key in self._disk_index:
+                    self._disk_index.move_to_end(key)
+                self._stats['disk_hits'] += 1
+                self._put_memory(key, result)
+            return dict(result)
+
+        with self._lock:
+            self._stats['misses'] += 1
+        return None
+
+    def put(self, key, result):
+        """
+        寫入快取
+
+        Args:
+            key: build_cache_key 產生的鍵值
+            result: 可序列化為 JSON 的 OCR 結果
+        """
+        with self._lock:
+            self._put_memory(key, result)
+            self._stats['writes'] += 1
+
+        if not self.disk_dir:
+            return
+
+        filepath = self._disk_path(key)
+        try:
+            os.makedirs(os.path.dirname(filepath), exist_ok=True)
+            temp_path = f"{filepath}.{threading.get_ident()}.tmp"
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(result, f, ensure_ascii=False)
+            os.replace(temp_path, filepath)
+            size = os.path.getsize(filepath)
+        except OSError as e:
+            print(f"寫入磁碟快取失敗: {e}")
+            return
+
+        with self._lock:
+            if key in self._disk_index:
+                self._disk_bytes -= self._disk_index.pop(key)
+            self._disk_index[key] = size
+            self._disk_bytes += size
+            self._evict_disk()
+
+    def _put_memory(self, key, result):
+        """寫入記憶體層並淘汰超出容量的項目（呼叫端需持有鎖）"""
+        if self.memory_max_items <= 0:
+            return
+        self._memory[key] = dict(result)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_max_items:
+            self._memory.popitem(last=False)
+            self._stats['memory_evictions'] += 1
+
+    def _evict_disk(self):
+        """淘汰最久未使用的磁碟項目直到低於大小上限（呼叫端需持有鎖）"""
+        while self._disk_bytes > self.disk_max_bytes and self._disk_index:
+            key = next(iter(self._disk_index))
+            self._drop_disk_entry(key)
+            self._stats['disk_evictions'] += 1
+
+    def _drop_disk_entry(self, key):
+        """刪除磁碟項目（呼叫端需持有鎖）"""
+        size = self._disk_index.pop(key, 0)
+        self._disk_bytes -= size
+        try:
+            os.remove(self._disk_path(key))
+        except OSError:
+            pass
+
+    def get_stats(self):
+        """
+        取得快取統計資訊
+
+        Returns:
+            dict: 命中、未命中與淘汰次數
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            hits = stats['memory_hits'] + stats['disk_hits']
+            lookups = hits + stats['misses']
+            stats.update({
+                'enabled': True,
+                'hit_ratio': round(hits / lookups, 4) if lookups else 0,
+                'memory_items': len(self._memory),
+                'memory_max_items': self.memory_max_items,
+                'disk_items': len(self._disk_index),
+                'disk_mb': round(self._disk_bytes / (1024 ** 2), 2),
+                'disk_max_mb': round(self.disk_max_bytes / (1024 ** 2), 2)
+            })
+        return stats
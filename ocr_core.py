@@ -0,0 +1,1661 @@
+"""
+DeepSeek-OCR 服務核心
+封裝 OCR 辨識流程（快取、排程、超時、前後處理），模型推理交給可切換的推理後端
+"""
+
+from PIL import Image, ImageDraw
+import hashlib
+import multiprocessing
+import os
+import time
+import threading
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError, wait, FIRST_COMPLETED
+from batch_scheduler import MicroBatchScheduler
+from ocr_backends import create_backend
+from ocr_inference import load_image, read_image_bytes, iter_streamer, count_image_tokens, DEFAULT_MAX_NEW_TOKENS
+from ocr_cache import OCRResultCache, build_cache_key
+from metrics import REGISTRY, family
+from stage_timings import RollingStageStats, format_timings
+from preprocess_pool import PreprocessPool
+from image_analysis import (
+    PRESETS, PRECHECK_MIN_EDGE_DENSITY, PRECHECK_MIN_CONTRAST, PRECHECK_MIN_SHARPNESS,
+    select_resolution, estimate_text_density, estimate_token_budget, assess_image_quality, check_readability
+)
+from vision_cache import VisionFeatureCache
+from memory_admission import MemoryAdmission, host_memory_info, is_out_of_memory
+from memory_manager import MemoryManager
+from repetition import truncate_repetition, RepetitionDetector
+
+
+class TimeoutError(Exception):
+    """超時錯誤例外類別"""
+    pass
+
+
+# 圖片無法辨識（推理前的可讀性預檢，或推理後發現輸出只是重複提示詞）時返回給使用者的訊息
+UNREADABLE_IMAGE_ERROR = 'OCR 辨識失敗：照片可能模糊或光線不足，請重新拍攝更清晰的照片'
+
+
+# ==================== 服務指標 ====================
+# 熱路徑只寫入各執行緒自己的分片，不需要鎖；快取與記憶體指標在 /metrics 抓取時才計算
+
+# 各處理階段耗時（階段名稱見 stage_timings.STAGES）
+STAGE_SECONDS = REGISTRY.histogram(
+    'ocr_stage_duration_seconds', 'OCR 各處理階段耗時（秒）', ('stage',)
+)
+INFERENCE_QUEUED = REGISTRY.gauge(
+    'ocr_inference_queued', '等待推理的圖片數（微批次排程器或推理執行器佇列中）'
+)
+INFERENCE_IN_FLIGHT = REGISTRY.gauge(
+    'ocr_inference_in_flight', '正在生成中的圖片數'
+)
+BATCH_SIZE = REGISTRY.histogram(
+    'ocr_inference_batch_size', '每次 generate 呼叫處理的圖片數', buckets=(1, 2, 4, 8, 16, 32)
+)
+GENERATED_TOKENS = REGISTRY.counter(
+    'ocr_generated_tokens_total', '模型生成的 token 數', ('backend',)
+)
+# 失敗原因：timeout / file_not_found / image_decode / unreadable_image（可讀性預檢）/ gpu_memory（推理時記憶體不足）/
+#           prompt_echo / empty_result / inference
+ERRORS = REGISTRY.counter(
+    'ocr_errors_total', 'OCR 失敗次數（依原因分類）', ('cause',)
+)
+# 自動解析度模式下各預設組合的使用次數（預設組合見 image_analysis.PRESETS）
+RESOLUTION_PRESETS = REGISTRY.counter(
+    'ocr_resolution_preset_total', '自動解析度模式選擇的預設組合次數', ('preset',)
+)
+# 輸出因重複迴圈被截斷的次數（unit: line / ngram）
+REPETITION_TRUNCATIONS = REGISTRY.counter(
+    'ocr_repetition_truncations_total', 'OCR 輸出在重複迴圈處被截斷的次數', ('unit',)
+)
+# 生成中確認重複迴圈而提前停止的圖片數，與相對於生成到上限（或超時）估計省下的 token 數與秒數
+REPETITION_STOPS = REGISTRY.counter(
+    'ocr_repetition_stops_total', '生成中確認重複迴圈而提前停止的圖片數'
+)
+REPETITION_SAVED_TOKENS = REGISTRY.counter(
+    'ocr_repetition_saved_tokens_total', '重複迴圈提前停止省下的生成 token 數（估計）'
+)
+REPETITION_SAVED_SECONDS = REGISTRY.counter(
+    'ocr_repetition_saved_seconds_total', '重複迴圈提前停止省下的生成秒數（估計）'
+)
+# 生成到輸出 token 預算而停止（輸出可能不完整）的圖片數（source: estimated / request / default）
+TOKEN_BUDGET_EXHAUSTED = REGISTRY.counter(
+    'ocr_token_budget_exhausted_total', '生成到輸出 token 預算而停止的圖片數', ('source',)
+)
+# 可讀性預檢在推理前拒絕的圖片數（reason: blank / blurry）
+PRECHECK_REJECTIONS = REGISTRY.counter(
+    'ocr_precheck_rejections_total', '可讀性預檢在推理前拒絕的圖片數', ('reason',)
+)
+
+
+class DeepSeekOCRService:
+    """
+    DeepSeek-OCR 服務類別
+    
+    提供單張和批次圖片的 OCR 辨識功能；推理後端（unsloth / transformers / stub）由 backend 參數決定
+    """
+    
+    def __init__(self, model_name="unsloth/DeepSeek-OCR", model_dir="./deepseek_ocr",
+                 ocr_timeout=300, base_size=2048, image_size=1024,
+                 crop_mode=True, test_compress=False, save_results=False,
+                 batch_max_size=1, batch_max_wait_ms=20, max_concurrent_inferences=1,
+                 device=None,
+                 cache_enabled=False, cache_memory_items=256, cache_dir=None, cache_disk_max_mb=512,
+                 backend='unsloth', backend_options=None, timing_window=1000,
+                 preprocess_workers=0, prefetch_depth=8,
+                 resolution_mode='fixed', adaptive_max_preset='high_quality', vision_cache_mb=0,
+                 prompt_cache_size=64, hot_prompts=None,
+                 memory_admission=True, memory_budget_mb=0, memory_budget_fraction=0.9, memory_budget_share=1.0,
+                 memory_release_policy='idle', memory_idle_seconds=30, memory_pressure_threshold=0.9,
+                 repetition_stop=True, repetition_ngram_size=30, repetition_window_size=90,
+                 max_new_tokens=DEFAULT_MAX_NEW_TOKENS, token_budget=True,
+                 precheck=True, precheck_min_edge_density=PRECHECK_MIN_EDGE_DENSITY,
+                 precheck_min_contrast=PRECHECK_MIN_CONTRAST, precheck_min_sharpness=PRECHECK_MIN_SHARPNESS):
+        """
+        初始化 DeepSeek-OCR 服務
+        
+        Args:
+            model_name: 模型名稱，預設為 "unsloth/DeepSeek-OCR"
+            model_dir: 模型本地目錄
+            ocr_timeout: OCR 處理超時秒數，預設為 300 秒（5 分鐘）
+            base_size: 圖片預處理基準尺寸，預設 2048（適合 1920x1080）
+            image_size: 模型輸入圖片尺寸，預設 1024（平衡準確度與速度）
+            crop_mode: 是否啟用裁切模式，預設 True
+            test_compress: 是否測試壓縮，預設 False
+            save_results: 是否保存結果，預設 False
+            batch_max_size: 微批次最大請求數，預設 1（停用微批次）
+            batch_max_wait_ms: 微批次收集請求的最長等待毫秒數，預設 20
+            max_concurrent_inferences: 未啟用微批次時，同時進行中的推理數上限，預設 1
+            device: 推理設備（例如 "cuda:1" 或 "cpu"），預設由推理後端決定；Unsloth 只支援 CUDA
+            cache_enabled: 是否啟用 OCR 結果快取，預設 False
+            cache_memory_items: 記憶體快取最多保留的結果數，預設 256
+            cache_dir: 磁碟快取目錄，None 表示只使用記憶體快取
+            cache_disk_max_mb: 磁碟快取大小上限（MB），預設 512
+            backend: 推理後端名稱（"unsloth"、"transformers" 或 "stub"），預設 "unsloth"
+            backend_options: 傳給推理後端的額外參數（例如 stub 的延遲與記憶體設定）
+            timing_window: 各階段耗時滾動統計保留的請求數，預設 1000
+            preprocess_workers: CPU 前處理子行程數，預設 0（在推理執行緒中前處理）
+            prefetch_depth: 前處理預取佇列上限，預設 8（至少為微批次大小與並發推理上限中較大者）
+            resolution_mode: "fixed" 使用 base_size/image_size/crop_mode，
+                             "adaptive" 依每張圖片的尺寸與文字密度選擇，預設 "fixed"
+            adaptive_max_preset: 自動解析度模式允許的最高預設組合，預設 "high_quality"
+            vision_cache_mb: 視覺編碼結果快取大小上限（MB，存放在主記憶體），預設 0（停用）
+            prompt_cache_size: 提示詞 tokenize 結果快取保留的非常用提示詞數，預設 64；0 表示停用整個快取
+            hot_prompts: 啟動時預先 tokenize 並常駐的常用提示詞（預設提示詞一律包含）
+            memory_admission: 是否依每個請求的預估峰值記憶體排隊推理，預設 True
+            memory_budget_mb: 推理可使用的記憶體預算（MB，不含模型權重），預設 0（依設備記憶體自動計算）
+            memory_budget_fraction: 自動計算預算時可使用的設備記憶體比例（CPU 推理時為可用主記憶體比例），預設 0.9
+            memory_budget_share: CPU 推理時自動計算的預算乘上的比例（多個 CPU 副本共用主記憶體時由副本池指定），預設 1.0
+            memory_release_policy: 設備快取記憶體的釋放策略（always / pressure / idle / never，見 memory_manager），預設 "idle"
+            memory_idle_seconds: idle 策略下推理閒置多少秒後釋放快取記憶體，預設 30
+            memory_pressure_threshold: 設備記憶體使用率（包含其他行程）超過此比例時釋放快取記憶體，預設 0.9
+            repetition_stop: 是否在生成中確認重複迴圈後提前停止該圖片的生成，預設 True
+            repetition_ngram_size: 重複迴圈偵測比較的最短長度（token 數），預設 30
+            repetition_window_size: 重複迴圈偵測的滑動視窗大小（token 數），預設 90
+            max_new_tokens: 每張圖片最多生成的 token 數（請求指定的 max_tokens 也不能超過），預設 8192
+            token_budget: 是否依每張圖片的解析度、裁切區塊數與文字密度估計輸出 token 預算，預設 True；
+                          停用時每張圖片都可以生成到 max_new_tokens
+            precheck: 是否在推理前以縮圖檢查圖片是否空白或模糊，無法辨識時直接返回錯誤而不使用 GPU，預設 True
+            precheck_min_edge_density: 可讀性預檢的強邊緣像素比例下限，預設 0.0005
+            precheck_min_contrast: 沒有強邊緣時區分空白與模糊的灰階標準差，預設 8.0
+            precheck_min_sharpness: 可讀性預檢的 Laplacian 變異數下限，預設 5.0
+        """
+        self.model_name = model_name
+        self.model_dir = model_dir
+        self.default_prompt = "<image>\nFree OCR."
+        self.ocr_timeout = ocr_timeout
+        
+        # OCR 圖片處理參數
+        self.base_size = base_size
+        self.image_size = image_size
+        self.crop_mode = crop_mode
+        self.test_compress = test_compress
+        self.save_results = save_results
+        if resolution_mode not in ('fixed', 'adaptive'):
+            raise ValueError(f"不支援的解析度模式: {resolution_mode}（可用: fixed, adaptive）")
+        if adaptive_max_preset not in PRESETS:
+            raise ValueError(f"不支援的解析度預設組合: {adaptive_max_preset}（可用: {', '.join(PRESETS)}）")
+        self.resolution_mode = resolution_mode
+        self.adaptive_max_preset = adaptive_max_preset
+        if repetition_stop and repetition_window_size <= repetition_ngram_size:
+            raise ValueError(f"repetition_window_size ({repetition_window_size}) 必須大於 "
+                             f"repetition_ngram_size ({repetition_ngram_size})")
+        self.repetition_stop = repetition_stop
+        self.repetition_ngram_size = repetition_ngram_size
+        self.repetition_window_size = repetition_window_size
+        self._repetition_lock = threading.Lock()
+        self._repetition_stats = {'stops': 0, 'saved_tokens': 0, 'saved_seconds': 0.0}
+        self.max_new_tokens = max(1, int(max_new_tokens))
+        self.token_budget = token_budget
+        self.precheck_thresholds = dict(
+            min_edge_density=precheck_min_edge_density,
+            min_contrast=precheck_min_contrast,
+            min_sharpness=precheck_min_sharpness
+        ) if precheck else None
+        self.batch_scheduler = None
+        self.result_cache = None
+        self.vision_cache = None
+        self.preprocess_pool = None
+        self.memory_admission = None
+        self.memory_manager = None
+        # 實際使用過的輸入尺寸 (base_size, image_size, crop_mode)，保存後供下次啟動暖機
+        self._used_shapes = set()
+        
+        # 推理後端：只負責模型載入、前處理、生成與解碼
+        self.backend = create_backend(backend, model_name, model_dir, device=device, **(backend_options or {}))
+        self.backend_name = self.backend.name
+        self.device = self.backend.device
+        # 不同後端的輸出可能略有差異，快取鍵值需區分後端
+        self.model_id = f"{self.backend_name}:{model_name}"
+        
+        # 常駐推理執行器：所有請求共用，worker 數即同時進行中的推理數上限
+        # （各請求的輸入與輸出互不共用，可安全並行）
+        self.max_concurrent_inferences = max(1, int(max_concurrent_inferences))
+        self.inference_executor = ThreadPoolExecutor(
+            max_workers=self.max_concurrent_inferences,
+            thread_name_prefix='ocr-inference'
+        )
+        self._timeout_lock = threading.Lock()
+        self.timed_out_inferences = 0
+        self.stage_stats = RollingStageStats(timing_window)
+        
+        # 串流批次請求使用的常駐執行器：讓多張圖片同時排入推理，才能湊成微批次
+        self.batch_window = max(int(batch_max_size), self.max_concurrent_inferences)
+        
+        # 前處理子行程無法在副本池的子行程（daemon）中再建立子行程
+        if preprocess_workers > 0 and multiprocessing.current_process().daemon:
+            print("警告: 副本子行程中無法啟用前處理行程池，改在推理執行緒中前處理")
+            preprocess_workers = 0
+        if preprocess_workers > 0:
+            # 預取佇列至少要能容納一個完整批次；批次請求多保留預取深度的空間，
+            # 讓後續圖片在推理進行中先完成前處理
+            prefetch_depth = max(int(prefetch_depth), self.batch_window)
+            self.batch_window += prefetch_depth
+        
+        self.batch_request_executor = ThreadPoolExecutor(
+            max_workers=self.batch_window,
+            thread_name_prefix='ocr-batch-request'
+        )
+        
+        if cache_enabled:
+            self.result_cache = OCRResultCache(
+                memory_max_items=cache_memory_items,
+                disk_dir=cache_dir,
+                disk_max_mb=cache_disk_max_mb
+            )
+            print(f"OCR 結果快取已啟用: memory_items={cache_memory_items}, dir={cache_dir}, disk_max_mb={cache_disk_max_mb}")
+        
+        print(f"OCR 處理超時設定: {ocr_timeout} 秒")
+        if resolution_mode == 'adaptive':
+            print(f"OCR 圖片處理參數: 依圖片自動選擇（最高 {adaptive_max_preset}）")
+        else:
+            print(f"OCR 圖片處理參數: base_size={base_size}, image_size={image_size}, crop_mode={crop_mode}")
+        
+        print(f"正在載入模型: {model_name}（推理後端: {self.backend_name}，設備: {self.device}）")
+        self.backend.load()
+        self.model = self.backend.model
+        self.tokenizer = self.backend.tokenizer
+        print(f"模型載入完成: {model_name}")
+        
+        # 啟用記憶體准入控制（模型載入後才計算預算，扣除權重佔用的記憶體）
+        if memory_admission:
+            budget_mb = memory_budget_mb
+            if budget_mb <= 0:
+                budget_mb = self._default_memory_budget(memory_budget_fraction, memory_budget_share)
+            if budget_mb is not None and budget_mb > 0:
+                self.memory_admission = MemoryAdmission(budget_mb)
+                print(f"記憶體准入控制已啟用: budget_mb={budget_mb:.0f}")
+            else:
+                print("警告: 無法取得設備或主記憶體資訊，記憶體准入控制已停用")
+        
+        # 背景記憶體管理：依策略釋放快取記憶體，不在請求路徑上清理（只在設備提供配置器狀態時啟用）
+        if self.backend.allocator_stats() is not None:
+            self.memory_manager = MemoryManager(
+                self.backend,
+                policy=memory_release_policy,
+                pressure_threshold=memory_pressure_threshold,
+                idle_seconds=memory_idle_seconds
+            )
+            self.memory_manager.start()
+            print(f"記憶體管理已啟用: policy={memory_release_policy}, idle_seconds={memory_idle_seconds}, "
+                  f"pressure_threshold={memory_pressure_threshold}")
+        
+        # 啟用視覺編碼結果快取（同一張圖片換提示詞時跳過視覺編碼器）
+        if vision_cache_mb > 0:
+            vision_cache = VisionFeatureCache(vision_cache_mb)
+            if self.backend.enable_vision_cache(vision_cache):
+                self.vision_cache = vision_cache
+                print(f"視覺編碼結果快取已啟用: max_mb={vision_cache_mb}")
+            else:
+                print(f"警告: 推理後端 {self.backend_name} 不支援視覺編碼結果快取，已停用")
+        
+        # 啟用提示詞 tokenize 結果快取（預設提示詞與常用提示詞在啟動時先 tokenize）
+        prompt_cache = None
+        if prompt_cache_size > 0:
+            prompts = [self.default_prompt] + [self._resolve_prompt(prompt) for prompt in (hot_prompts or [])]
+            prompts = list(dict.fromkeys(prompts))
+            if self.backend.enable_prompt_cache(prompts, prompt_cache_size):
+                prompt_cache = (prompts, prompt_cache_size)
+                print(f"提示詞 tokenize 結果快取已啟用: hot_prompts={len(prompts)}, max_items={prompt_cache_size}")
+        
+        # 啟用 CPU 前處理行程池（模型下載完成後才啟動，子行程只讀取本地 tokenizer）
+        if preprocess_workers > 0:
+            self.preprocess_pool = PreprocessPool(
+                self.backend_name, model_name, model_dir,
+                device=self.device,
+                backend_options=backend_options,
+                num_workers=preprocess_workers,
+                prefetch_depth=prefetch_depth,
+                prompt_cache=prompt_cache
+            )
+        
+        # 啟用微批次排程（batch_max_size > 1 時）
+        if batch_max_size > 1:
+            self.batch_scheduler = MicroBatchScheduler(
+                self._run_batch,
+                max_batch_size=batch_max_size,
+                max_wait_ms=batch_max_wait_ms
+            )
+            print(f"微批次排程已啟用: max_batch_size={batch_max_size}, max_wait_ms={batch_max_wait_ms}")
+        
+        # 快取命中率與設備記憶體在抓取 /metrics 時才讀取
+        REGISTRY.register_collector(self._collect_metrics)
+    
+    def _default_memory_budget(self, fraction, host_share=1.0):
+        """
+        依目前的記憶體狀態計算推理可使用的記憶體預算（模型載入後呼叫）
+        
+        Args:
+            fraction: 可使用的記憶體比例
+            host_share: 使用主記憶體時分到的比例（多個 CPU 副本共用主記憶體）
+        
+        Returns:
+            float: 預算（MB），無法取得記憶體資訊時為 None
+        """
+        memory = self.backend.memory_info()
+        if memory['available']:
+            # 設備記憶體：總量的 fraction 扣除模型權重與其他已使用的部分
+            return memory['total_mb'] * fraction - memory['used_mb']
+        # CPU 推理：模型權重已載入，可用主記憶體即為推理可使用的部分
+        memory = host_memory_info()
+        if memory['available']:
+            return memory['free_mb'] * fraction * host_share
+        return None
+    
+    def _resolve_shape(self, resolution):
+        """
+        決定請求使用的輸入尺寸（自動解析度模式的選擇結果，或服務的固定設定）
+        
+        Args:
+            resolution: 追蹤資訊中的 'resolution'，None 表示固定設定
+        
+        Returns:
+            tuple: (base_size, image_size, crop_mode)
+        """
+        resolution = resolution or {}
+        return (
+            resolution.get('base_size', self.base_size),
+            resolution.get('image_size', self.image_size),
+            resolution.get('crop_mode', self.crop_mode)
+        )
+    
+    def _reject_unreadable(self, context, image_path):
+        """
+        可讀性預檢判定圖片無法辨識時，記錄指標並讓出預取佇列的位置（不送入推理）
+        
+        Args:
+            context: _decode 返回的請求資訊
+            image_path: 回應中顯示的圖片名稱
+        
+        Returns:
+            dict: 錯誤內容（與推理後發現提示詞重複時相同的錯誤訊息），可讀時為 None
+        """
+        reason = context.get('unreadable')
+        if reason is None:
+            return None
+        if 'prefetched' in context:
+            context['prefetched'].release()
+        PRECHECK_REJECTIONS.inc(reason=reason)
+        ERRORS.inc(cause='unreadable_image')
+        print(f"❌ 可讀性預檢: {image_path} 判定為{'空白' if reason == 'blank' else '模糊'}（{context['quality']}），不執行推理")
+        return {
+            'error': UNREADABLE_IMAGE_ERROR,
+            'image_path': image_path,
+            'debug_info': dict(context['quality'], precheck=reason)
+        }
+    
+    def _plan_tokens(self, size, context, max_tokens=None):
+        """
+        決定請求的輸出 token 預算並寫入請求資訊的 'max_new_tokens'
+        
+        請求指定 max_tokens 時使用指定值（不超過 max_new_tokens）；否則依解析度與裁切區塊數
+        （視覺 token 數）及文字密度估計（見 image_analysis.estimate_token_budget）。
+        推理後的生成結果寫入請求資訊的 'generation'
+        
+        Args:
+            size: 圖片尺寸 (寬, 高)
+            context: 請求資訊（'resolution' 決定輸入尺寸，'text_density' 為文字密度）
+            max_tokens: 請求指定的輸出 token 上限，None 表示自動估計
+        
+        Returns:
+            int: 輸出 token 預算
+        """
+        if max_tokens is not None:
+            budget = min(max(1, int(max_tokens)), self.max_new_tokens)
+            context['budget_source'] = 'request'
+        elif self.token_budget and context.get('text_density') is not None:
+            base_size, image_size, crop_mode = self._resolve_shape(context.get('resolution'))
+            image_tokens, _ = count_image_tokens(size[0], size[1], base_size, image_size, crop_mode)
+            budget = estimate_token_budget(image_tokens, context['text_density'], self.max_new_tokens)
+            context['budget_source'] = 'estimated'
+        else:
+            budget = self.max_new_tokens
+            context['budget_source'] = 'default'
+        context['max_new_tokens'] = budget
+        context['generation'] = {}
+        return budget
+    
+    def _generation_fields(self, context):
+        """
+        將推理後的輸出 token 預算資訊轉為回應欄位，生成到預算上限時記錄警告與指標
+        
+        Args:
+            context: _plan_tokens 處理過的請求資訊
+        
+        Returns:
+            dict: {'max_tokens': 輸出 token 預算, 'generated_tokens': 生成 token 數, 'budget_exhausted': 是否生成到上限,
+                   'repetition_stopped': 是否確認重複迴圈而提前停止}，沒有推理資訊時為空 dict
+        """
+        generation = context.get('generation')
+        if not generation:
+            return {}
+        if generation['budget_exhausted']:
+            TOKEN_BUDGET_EXHAUSTED.inc(source=context['budget_source'])
+            print(f"⚠️ 警告：生成到輸出 token 預算 {generation['max_tokens']} 而停止，結果可能不完整"
+                  f"（可用 max_tokens 參數提高上限，最多 {self.max_new_tokens}）")
+        return dict(generation)
+    
+    def _estimate_footprint(self, size, context):
+        """
+        估計請求的峰值記憶體並寫入請求資訊的 'footprint'（記憶體准入控制停用時不估計）
+        
+        Args:
+            size: 圖片尺寸 (寬, 高)
+            context: 請求資訊（'resolution' 決定輸入尺寸）
+        
+        Returns:
+            float: 目前預測的峰值記憶體（MB），停用時為 None
+        """
+        if self.memory_admission is None:
+            return None
+        base_size, image_size, crop_mode = self._resolve_shape(context.get('resolution'))
+        footprint = self.memory_admission.model.estimate(
+            size[0], size[1], base_size, image_size, crop_mode,
+            max_new_tokens=context.get('max_new_tokens', self.max_new_tokens)
+        )
+        context['footprint'] = footprint
+        return self.memory_admission.model.predict([footprint])
+    
+    def _run_batch(self, batch, streamer=None):
+        """
+        以一次 generate 呼叫處理一批 OCR 請求（由微批次排程器呼叫）
+        
+        Args:
+            batch: (已解碼的 RGB 圖片或模型輸入, 提示詞, 取消旗標, 追蹤資訊) 的列表；
+                   追蹤資訊為 {'submitted_at': 提交時間, 'timings': 階段耗時 dict}，
+                   由前處理行程池產生模型輸入時另含 'prefetched'（PrefetchedInput），
+                   自動解析度模式下另含 'resolution'（該圖片使用的 base_size、image_size 與 crop_mode），
+                   啟用視覺編碼結果快取時另含 'image_key'（圖片內容雜湊），
+                   啟用記憶體准入控制時另含 'footprint'（預估峰值記憶體），
+                   另含 'max_new_tokens'（輸出 token 預算）時生成結果寫入 'generation'；
+                   各階段耗時（秒）會寫入該請求的 timings
+            streamer: 逐段接收生成文字的 streamer（僅單張圖片時使用）
+        
+        Returns:
+            list: 與 batch 順序一致的 OCR 文字
+        """
+        started_at = time.perf_counter()
+        for _, _, _, trace in batch:
+            trace['timings']['queue'] = started_at - trace['submitted_at']
+        INFERENCE_QUEUED.dec(len(batch))
+        INFERENCE_IN_FLIGHT.inc(len(batch))
+        BATCH_SIZE.observe(len(batch))
+        
+        try:
+            batch_inputs = []
+            for source, prompt, _, trace in batch:
+                shape = self._resolve_shape(trace.get('resolution'))
+                self._used_shapes.add(shape)
+                prefetched = trace.get('prefetched')
+                if prefetched is not None:
+                    # 已由前處理行程池產生模型輸入，開始推理後讓出預取佇列的位置
+                    prefetched.release()
+                    batch_inputs.append(source)
+                    continue
+                base_size, image_size, crop_mode = shape
+                stage_start = time.perf_counter()
+                batch_inputs.append(self.backend.preprocess(
+                    source,
+                    prompt,
+                    base_size=base_size,
+                    image_size=image_size,
+                    crop_mode=crop_mode,
+                    image_key=trace.get('image_key')
+                ))
+                trace['timings']['preprocess'] = time.perf_counter() - stage_start
+            
+            # 預估峰值超過記憶體預算的批次切成多次 generate 依序執行
+            if self.memory_admission is None:
+                groups = [list(range(len(batch)))]
+            else:
+                groups = self.memory_admission.plan([trace['footprint'] for _, _, _, trace in batch])
+            
+            texts = [None] * len(batch)
+            for group in groups:
+                group_texts = self._generate([batch[i] for i in group], [batch_inputs[i] for i in group], streamer)
+                for index, text in zip(group, group_texts):
+                    texts[index] = text
+            return texts
+        finally:
+            INFERENCE_IN_FLIGHT.dec(len(batch))
+    
+    def _generate(self, batch, batch_inputs, streamer=None):
+        """
+        等待記憶體預算後以一次 generate 呼叫處理已前處理的請求並解碼
+        
+        單獨推理的批次會量測實際的峰值記憶體，修正之後請求的預估
+        
+        Args:
+            batch: _run_batch 的請求列表（或切分後的子批次）
+            batch_inputs: 與 batch 順序一致的模型輸入
+            streamer: 逐段接收生成文字的 streamer（僅單張圖片時使用）
+        
+        Returns:
+            list: 與 batch 順序一致的 OCR 文字
+        """
+        # 生成與解碼是整個批次共用的階段，批次中每個請求都記錄相同的耗時
+        batch_timings = {}
+        cancel_events = [cancel_event for _, _, cancel_event, _ in batch]
+        reservation = None
+        if self.memory_admission is not None:
+            stage_start = time.perf_counter()
+            reservation = self.memory_admission.acquire(
+                [trace['footprint'] for _, _, _, trace in batch], cancel_events
+            )
+            batch_timings['memory_wait'] = time.perf_counter() - stage_start
+            if reservation.solo:
+                reservation.baseline_mb = self.backend.reset_peak_memory()
+        
+        budgets = [trace.get('max_new_tokens', self.max_new_tokens) for _, _, _, trace in batch]
+        repetition = None
+        if self.repetition_stop:
+            repetition = RepetitionDetector(
+                len(batch), self.repetition_ngram_size, self.repetition_window_size,
+                is_content=self.backend.is_content_token
+            )
+        
+        out_of_memory = False
+        try:
+            with self.memory_manager.track() if self.memory_manager is not None else nullcontext():
+                outputs = self.backend.generate(
+                    batch_inputs, cancel_events=cancel_events, streamer=streamer, timings=batch_timings,
+                    max_new_tokens=budgets, repetition=repetition
+                )
+        except Exception as e:
+            out_of_memory = is_out_of_memory(e)
+            if out_of_memory:
+                # 釋放失敗前配置的快取區塊，之後的批次以放大後的預估准入
+                self._release_memory('oom')
+            raise
+        finally:
+            if reservation is not None:
+                peak_mb = None
+                if reservation.baseline_mb is not None and not out_of_memory:
+                    peak_mb = self.backend.peak_memory() - reservation.baseline_mb
+                self.memory_admission.release(reservation, peak_mb, out_of_memory)
+        token_counts = self.backend.count_tokens(outputs)
+        GENERATED_TOKENS.inc(sum(token_counts), backend=self.backend_name)
+        stopped_at = repetition.stopped_at if repetition is not None else [None] * len(batch)
+        for (_, _, cancel_event, trace), budget, count, stop in zip(batch, budgets, token_counts, stopped_at):
+            if 'generation' in trace:
+                trace['generation'].update(
+                    max_tokens=budget,
+                    generated_tokens=count,
+                    budget_exhausted=count >= budget and stop is None and not cancel_event.is_set(),
+                    repetition_stopped=stop is not None
+                )
+        if repetition is not None:
+            self._record_repetition_stops(batch, repetition, budgets, token_counts, batch_timings.get('token_generation'))
+        
+        stage_start = time.perf_counter()
+        texts = self.backend.decode(outputs)
+        batch_timings['detokenize'] = time.perf_counter() - stage_start
+        
+        for _, _, _, trace in batch:
+            trace['timings'].update(batch_timings)
+        return texts
+    
+    def _record_repetition_stops(self, batch, repetition, budgets, token_counts, generation_seconds):
+        """
+        記錄生成中確認重複迴圈而提前停止的圖片，估計省下的 token 數與秒數
+        
+        迴圈不會自行結束，沒有提前停止時會生成到輸出 token 預算，或在請求超時時才被取消；
+        省下的秒數以這次 generate 每個生成步驟的平均耗時估計
+        
+        Args:
+            batch: _generate 的請求列表
+            repetition: 這次 generate 使用的 RepetitionDetector
+            budgets: 與 batch 順序一致的輸出 token 預算
+            token_counts: 與 batch 順序一致的生成 token 數
+            generation_seconds: 這次 generate 的 token_generation 耗時（秒），沒有時不估計秒數
+        """
+        steps = max(token_counts) if token_counts else 0
+        seconds_per_token = generation_seconds / steps if generation_seconds and steps else 0.0
+        now = time.perf_counter()
+        for (_, _, _, trace), budget, stopped_at in zip(batch, budgets, repetition.stopped_at):
+            if stopped_at is None:
+                continue
+            saved_tokens = max(0, budget - stopped_at)
+            remaining = max(0.0, self.ocr_timeout - (now - trace['submitted_at']))
+            saved_seconds = min(saved_tokens * seconds_per_token, remaining)
+            REPETITION_STOPS.inc()
+            REPETITION_SAVED_TOKENS.inc(saved_tokens)
+            REPETITION_SAVED_SECONDS.inc(saved_seconds)
+            with self._repetition_lock:
+                self._repetition_stats['stops'] += 1
+                self._repetition_stats['saved_tokens'] += saved_tokens
+                self._repetition_stats['saved_seconds'] += saved_seconds
+            print(f"偵測到重複迴圈，已在第 {stopped_at} 個 token 停止生成"
+                  f"（估計省下 {saved_tokens} 個 token、{saved_seconds:.1f} 秒）")
+    
+    def get_repetition_stats(self):
+        """
+        取得生成中重複迴圈偵測的統計
+        
+        Returns:
+            dict: 是否啟用、偵測參數、提前停止的圖片數與估計省下的 token 數與秒數
+        """
+        with self._repetition_lock:
+            stats = dict(self._repetition_stats)
+        stats['saved_seconds'] = round(stats['saved_seconds'], 2)
+        return dict(
+            enabled=self.repetition_stop,
+            ngram_size=self.repetition_ngram_size,
+            window_size=self.repetition_window_size,
+            **stats
+        )
+    
+    def _enqueue(self, item):
+        """
+        記錄排隊中的圖片數並將推理工作交給微批次排程器或常駐推理執行器
+        
+        Args:
+            item: (已解碼的 RGB 圖片或模型輸入, 提示詞, 取消旗標, 追蹤資訊)
+        
+        Returns:
+            Future: 推理結果（OCR 文字）
+        """
+        INFERENCE_QUEUED.inc()
+        if self.batch_scheduler is not None:
+            return self.batch_scheduler.submit(item)
+        return self.inference_executor.submit(lambda: self._run_batch([item])[0])
+    
+    def _cancel(self, future, cancel_event):
+        """
+        停止尚在排隊或生成中的工作
+        
+        Args:
+            future: _enqueue 返回的 Future
+            cancel_event: 該工作的取消旗標
+        """
+        # 尚未開始的工作會直接從佇列移除，不會再經過 _run_batch，需在此扣除排隊數
+        if future.cancel():
+            INFERENCE_QUEUED.dec()
+        cancel_event.set()
+    
+    def _submit_inference(self, image, prompt, timings=None, context=None):
+        """
+        將推理交給常駐執行器（或微批次排程器）並等待結果
+        
+        超時或呼叫端放棄等待時：尚未開始的工作直接從佇列移除，
+        已在生成中的工作會由 stopping criteria 在下一個 token 停止，立即釋放 GPU
+        
+        Args:
+            image: 已解碼的 RGB 圖片，或前處理行程池產生的模型輸入
+            prompt: 提示詞
+            timings: 記錄推理各階段耗時（秒）的 dict（可選）
+            context: _decode 返回的請求資訊（'prefetched'、'resolution'、'image_key'、'footprint'），併入追蹤資訊
+        
+        Returns:
+            str: OCR 辨識結果文字
+        """
+        cancel_event = threading.Event()
+        context = context or {}
+        trace = dict(context, submitted_at=time.perf_counter(), timings=timings if timings is not None else {})
+        future = self._enqueue((image, prompt, cancel_event, trace))
+        
+        try:
+            return future.result(timeout=self.ocr_timeout)
+        except FuturesTimeoutError:
+            with self._timeout_lock:
+                self.timed_out_inferences += 1
+            ERRORS.inc(cause='timeout')
+            print(f"推理超時 ({self.ocr_timeout} 秒)，已通知停止生成")
+            raise
+        except Exception as e:
+            ERRORS.inc(cause='gpu_memory' if is_out_of_memory(e) else 'inference')
+            raise
+        finally:
+            # 正常完成時兩者皆無作用；超時或例外時停止尚在排隊或生成中的工作
+            self._cancel(future, cancel_event)
+            if 'prefetched' in context:
+                context['prefetched'].release()
+    
+    def warm_up(self, shapes=None):
+        """
+        以合成圖片執行暖機推理（不經過結果快取，也不寫入各階段耗時統計）
+        
+        第一次推理會載入 CUDA kernel、觸發編譯並配置記憶體，應在開放請求之前完成，
+        避免由第一個使用者請求承擔這些延遲；每種輸入尺寸各暖機一次
+        
+        Args:
+            shapes: {'base_size', 'image_size', 'crop_mode'} 列表（例如上次執行時保存的尺寸），
+                    None 或空列表表示只使用目前的圖片處理參數
+        
+        Returns:
+            float: 暖機耗時（秒）
+        """
+        image = Image.new('RGB', (640, 640), 'white')
+        draw = ImageDraw.Draw(image)
+        for row in range(8):
+            draw.text((40, 40 + row * 64), "DeepSeek-OCR warm-up 0123456789", fill='black')
+        
+        start_time = time.perf_counter()
+        for shape in shapes or [None]:
+            context = {'resolution': dict(shape)} if shape else {}
+            self._estimate_footprint(image.size, context)
+            self._submit_inference(image, self.default_prompt, context=context)
+        elapsed = time.perf_counter() - start_time
+        print(f"暖機推理完成: {len(shapes or [None])} 種輸入尺寸，{elapsed:.2f} 秒")
+        return elapsed
+    
+    def get_warmup_shapes(self):
+        """
+        取得實際使用過的輸入尺寸（保存後供下次啟動暖機）
+        
+        Returns:
+            list: {'base_size', 'image_size', 'crop_mode'} 列表
+        """
+        return [
+            {'base_size': base_size, 'image_size': image_size, 'crop_mode': crop_mode}
+            for base_size, image_size, crop_mode in sorted(self._used_shapes)
+        ]
+    
+    def shutdown(self):
+        """停止微批次排程器與常駐推理執行器"""
+        REGISTRY.unregister_collector(self._collect_metrics)
+        if self.memory_manager is not None:
+            self.memory_manager.shutdown()
+        if self.batch_scheduler is not None:
+            self.batch_scheduler.shutdown()
+        if self.preprocess_pool is not None:
+            self.preprocess_pool.shutdown()
+        self.batch_request_executor.shutdown(wait=False, cancel_futures=True)
+        self.inference_executor.shutdown(wait=False, cancel_futures=True)
+    
+    def get_batch_stats(self):
+        """
+        取得微批次排程統計（批次大小分佈）
+        
+        Returns:
+            dict: 批次統計資訊
+        """
+        if self.batch_scheduler is None:
+            stats = {'enabled': False, 'max_concurrent_inferences': self.max_concurrent_inferences}
+        else:
+            stats = self.batch_scheduler.get_stats()
+        stats['timed_out_inferences'] = self.timed_out_inferences
+        stats['backend'] = self.backend_name
+        stats['preprocess'] = self.preprocess_pool.get_stats() if self.preprocess_pool is not None else {'enabled': False}
+        return stats
+    
+    def get_cache_stats(self):
+        """
+        取得 OCR 結果快取統計（命中/未命中/淘汰次數）
+        
+        Returns:
+            dict: 快取統計資訊
+        """
+        if self.result_cache is None:
+            return {'enabled': False}
+        return self.result_cache.get_stats()
+    
+    def get_vision_cache_stats(self):
+        """
+        取得視覺編碼結果快取統計（命中率與省下的視覺編碼時間）
+        
+        Returns:
+            dict: 快取統計資訊
+        """
+        if self.vision_cache is None:
+            return {'enabled': False}
+        return self.vision_cache.get_stats()
+    
+    def get_memory_stats(self):
+        """
+        取得記憶體准入控制統計（預算、排隊狀況與由實際峰值學習的修正係數）
+        
+        Returns:
+            dict: 准入控制統計資訊
+        """
+        if self.memory_admission is None:
+            return {'enabled': False}
+        return self.memory_admission.get_stats()
+    
+    def get_allocator_stats(self):
+        """
+        取得背景記憶體管理統計（配置器狀態、釋放次數與相對於每次清理省下的時間）
+        
+        Returns:
+            dict: 記憶體管理統計資訊
+        """
+        if self.memory_manager is None:
+            return {'enabled': False}
+        return self.memory_manager.get_stats()
+    
+    def get_stage_stats(self):
+        """
+        取得最近請求的各階段耗時統計（找出最值得優化的階段）
+        
+        Returns:
+            dict: 各階段的平均、p50、p95、最大值與佔總耗時的比例
+        """
+        return self.stage_stats.get_stats()
+    
+    def _record_timings(self, timings):
+        """
+        將一個請求的階段耗時寫入 /metrics 直方圖與滾動統計
+        
+        Args:
+            timings: 階段名稱 → 秒
+        """
+        for stage, seconds in timings.items():
+            if stage != 'total':
+                STAGE_SECONDS.observe(seconds, stage=stage)
+        self.stage_stats.record(timings)
+    
+    def _collect_metrics(self):
+        """
+        將快取統計、前處理佇列與設備記憶體轉為指標（抓取 /metrics 時呼叫）
+        
+        Returns:
+            list: family 列表
+        """
+        families = []
+        
+        if self.result_cache is not None:
+            stats = self.result_cache.get_stats()
+            families.append(family('ocr_cache_hits_total', 'counter', 'OCR 結果快取命中次數', [
+                ('ocr_cache_hits_total', {'tier': 'memory'}, stats['memory_hits']),
+                ('ocr_cache_hits_total', {'tier': 'disk'}, stats['disk_hits'])
+            ]))
+            families.append(family('ocr_cache_misses_total', 'counter', 'OCR 結果快取未命中次數', [
+                ('ocr_cache_misses_total', {}, stats['misses'])
+            ]))
+            families.append(family('ocr_cache_evictions_total', 'counter', 'OCR 結果快取淘汰次數', [
+                ('ocr_cache_evictions_total', {'tier': 'memory'}, stats['memory_evictions']),
+                ('ocr_cache_evictions_total', {'tier': 'disk'}, stats['disk_evictions'])
+            ]))
+            families.append(family('ocr_cache_hit_ratio', 'gauge', 'OCR 結果快取命中率', [
+                ('ocr_cache_hit_ratio', {}, stats['hit_ratio'])
+            ]))
+        
+        if self.vision_cache is not None:
+            stats = self.vision_cache.get_stats()
+            families.append(family('ocr_vision_cache_hits_total', 'counter', '視覺編碼結果快取命中次數（每個視圖一次）', [
+                ('ocr_vision_cache_hits_total', {}, stats['hits'])
+            ]))
+            families.append(family('ocr_vision_cache_misses_total', 'counter', '視覺編碼結果快取未命中次數', [
+                ('ocr_vision_cache_misses_total', {}, stats['misses'])
+            ]))
+            families.append(family('ocr_vision_cache_evictions_total', 'counter', '視覺編碼結果快取淘汰次數', [
+                ('ocr_vision_cache_evictions_total', {}, stats['evictions'])
+            ]))
+            families.append(family('ocr_vision_cache_bytes', 'gauge', '視覺編碼結果快取目前大小（bytes）', [
+                ('ocr_vision_cache_bytes', {}, stats['bytes'])
+            ]))
+            families.append(family('ocr_vision_cache_saved_seconds_total', 'counter', '視覺編碼結果快取命中省下的編碼時間（秒）', [
+                ('ocr_vision_cache_saved_seconds_total', {}, stats['saved_seconds'])
+            ]))
+        
+        # 啟用前處理行程池時 tokenize 在子行程中進行，這裡只統計推理行程內的前處理
+        if self.backend.prompt_cache is not None:
+            stats = self.backend.prompt_cache.get_stats()
+            families.append(family('ocr_prompt_cache_lookups_total', 'counter', '提示詞 tokenize 結果快取查詢次數', [
+                ('ocr_prompt_cache_lookups_total', {'result': 'hit'}, stats['hits']),
+                ('ocr_prompt_cache_lookups_total', {'result': 'miss'}, stats['misses'])
+            ]))
+        
+        if self.preprocess_pool is not None:
+            stats = self.preprocess_pool.get_stats()
+            families.append(family('ocr_preprocess_prefetch', 'gauge', '前處理預取佇列中的圖片數（前處理中或等待推理）', [
+                ('ocr_preprocess_prefetch', {}, stats['in_prefetch'])
+            ]))
+        
+        if self.memory_admission is not None:
+            stats = self.memory_admission.get_stats()
+            families.append(family('ocr_memory_budget_bytes', 'gauge', '推理記憶體預算（bytes，不含模型權重）', [
+                ('ocr_memory_budget_bytes', {}, stats['budget_mb'] * 1024 ** 2)
+            ]))
+            families.append(family('ocr_memory_reserved_bytes', 'gauge', '推理中批次預留的記憶體（bytes，依預估峰值）', [
+                ('ocr_memory_reserved_bytes', {}, stats['reserved_mb'] * 1024 ** 2)
+            ]))
+            families.append(family('ocr_memory_admission_waiting', 'gauge', '等待記憶體預算的批次數', [
+                ('ocr_memory_admission_waiting', {}, stats['waiting_batches'])
+            ]))
+            families.append(family('ocr_memory_admissions_total', 'counter', '記憶體准入的批次數（依是否需要排隊分類）', [
+                ('ocr_memory_admissions_total', {'result': 'immediate'}, stats['admitted'] - stats['queued']),
+                ('ocr_memory_admissions_total', {'result': 'queued'}, stats['queued'])
+            ]))
+            families.append(family('ocr_memory_oversized_batches_total', 'counter', '預估峰值超過整個預算而單獨執行的批次數', [
+                ('ocr_memory_oversized_batches_total', {}, stats['oversized'])
+            ]))
+        
+        if self.memory_manager is not None:
+            stats = self.memory_manager.get_stats()
+            allocator = stats['allocator']
+            if allocator is not None:
+                families.append(family('ocr_allocator_memory_bytes', 'gauge', '記憶體配置器狀態（bytes，背景檢查時讀取）', [
+                    ('ocr_allocator_memory_bytes', {'kind': kind}, allocator[f"{kind}_mb"] * 1024 ** 2)
+                    for kind in ('allocated', 'reserved', 'cached', 'inactive_split')
+                ]))
+            families.append(family('ocr_memory_releases_total', 'counter', '快取記憶體釋放次數（依原因分類）', [
+                ('ocr_memory_releases_total', {'reason': reason}, count)
+                for reason, count in sorted(stats['releases'].items())
+            ]))
+            families.append(family('ocr_memory_release_seconds_total', 'counter', '釋放快取記憶體的累計耗時（秒）', [
+                ('ocr_memory_release_seconds_total', {}, stats['release_seconds'])
+            ]))
+            families.append(family('ocr_memory_release_saved_seconds_total', 'counter',
+                                   '相對於每個批次後都釋放快取記憶體估計省下的耗時（秒）', [
+                ('ocr_memory_release_saved_seconds_total', {}, stats['estimated_saved_seconds'])
+            ]))
+        
+        memory = self.backend.memory_info()
+        if memory['available']:
+            labels = {'device': str(self.device)}
+            samples = [
+                ('ocr_device_memory_bytes', dict(labels, kind='total'), memory['total_mb'] * 1024 ** 2),
+                ('ocr_device_memory_bytes', dict(labels, kind='used'), memory['used_mb'] * 1024 ** 2),
+                ('ocr_device_memory_bytes', dict(labels, kind='free'), memory['free_mb'] * 1024 ** 2)
+            ]
+            if 'peak_mb' in memory:
+                samples.append(('ocr_device_memory_bytes', dict(labels, kind='peak'), memory['peak_mb'] * 1024 ** 2))
+            families.append(family('ocr_device_memory_bytes', 'gauge', '推理設備記憶體（bytes）', samples))
+        
+        return families
+    
+    def export_metrics(self):
+        """
+        取得此行程的所有指標（副本池透過此方法收集各副本的指標）
+        
+        Returns:
+            list: family 列表
+        """
+        return REGISTRY.collect()
+    
+    def _cache_settings(self):
+        """
+        快取鍵值使用的圖片處理參數（自動解析度模式下設定由圖片內容決定，以模式與上限區分）
+        
+        Returns:
+            tuple: (base_size, image_size, crop_mode)
+        """
+        if self.resolution_mode == 'adaptive':
+            return 'adaptive', self.adaptive_max_preset, None
+        return self.base_size, self.image_size, self.crop_mode
+    
+    def _decode(self, image, image_bytes, prompt, timings):
+        """
+        解碼圖片；啟用前處理行程池時改在子行程中解碼並產生模型輸入
+        
+        啟用可讀性預檢時先在縮圖上檢查圖片是否空白或模糊（無法辨識時不選擇解析度、不產生模型輸入）；
+        自動解析度模式下同時依圖片尺寸與文字密度選擇解析度設定；
+        啟用視覺編碼結果快取時計算圖片內容雜湊
+        
+        Args:
+            image: 圖片來源
+            image_bytes: 已讀取的圖片內容（PIL 圖片時為 None）
+            prompt: 提示詞
+            timings: 階段名稱 → 秒
+        
+        Returns:
+            tuple: (送入推理的內容, 圖片尺寸, 請求資訊)；請求資訊可能包含
+                   'prefetched'（PrefetchedInput）、'resolution'（自動選擇的解析度設定）、'image_key'、
+                   'text_density'（估計輸出 token 預算使用的文字密度）、'quality'（可讀性指標）
+                   與 'unreadable'（無法辨識的原因 'blank' 或 'blurry'，可讀時為 None）
+        """
+        source = image if image_bytes is None else image_bytes
+        max_preset = self.adaptive_max_preset if self.resolution_mode == 'adaptive' else None
+        context = {}
+        if self.vision_cache is not None:
+            context['image_key'] = hashlib.sha256(
+                image_bytes if image_bytes is not None else read_image_bytes(image)
+            ).hexdigest()
+        
+        if self.preprocess_pool is None:
+            decode_start = time.perf_counter()
+            pil_image = load_image(source)
+            timings['image_decode'] = time.perf_counter() - decode_start
+            if self.precheck_thresholds is not None:
+                precheck_start = time.perf_counter()
+                context['quality'] = assess_image_quality(pil_image)
+                context['unreadable'] = check_readability(context['quality'], **self.precheck_thresholds)
+                timings['precheck'] = time.perf_counter() - precheck_start
+                if context['unreadable'] is not None:
+                    return pil_image, pil_image.size, context
+                if context['quality'] is not None:
+                    # 可讀性預檢的強邊緣比例即為文字密度，不需要再計算一次
+                    context['text_density'] = context['quality']['edge_density']
+            if max_preset is not None:
+                analysis_start = time.perf_counter()
+                context['resolution'] = select_resolution(pil_image, max_preset, density=context.get('text_density'))
+                context['text_density'] = context['resolution']['text_density']
+                timings['image_analysis'] = time.perf_counter() - analysis_start
+                RESOLUTION_PRESETS.inc(preset=context['resolution']['preset'])
+            elif self.token_budget and context.get('text_density') is None:
+                # 輸出 token 預算需要文字密度（自動解析度模式在選擇解析度時已計算）
+                analysis_start = time.perf_counter()
+                context['text_density'] = round(estimate_text_density(pil_image), 4)
+                timings['image_analysis'] = time.perf_counter() - analysis_start
+            return pil_image, pil_image.size, context
+        
+        wait_start = time.perf_counter()
+        prefetched = self.preprocess_pool.submit(
+            source, prompt, self.base_size, self.image_size, self.crop_mode,
+            timeout=self.ocr_timeout, adaptive_max_preset=max_preset, image_key=context.get('image_key'),
+            estimate_density=self.token_budget, precheck=self.precheck_thresholds
+        )
+        try:
+            inputs, size, worker_timings, analysis = prefetched.result(timeout=self.ocr_timeout)
+        except Exception:
+            prefetched.release()
+            raise
+        timings.update(worker_timings)
+        # 等待預取佇列空位與子行程的時間
+        timings['prefetch_wait'] = max(0.0, time.perf_counter() - wait_start - sum(worker_timings.values()))
+        context['prefetched'] = prefetched
+        context['text_density'] = analysis['text_density']
+        if self.precheck_thresholds is not None:
+            context['quality'] = analysis['quality']
+            context['unreadable'] = analysis['unreadable']
+        if analysis['resolution'] is not None:
+            context['resolution'] = analysis['resolution']
+            RESOLUTION_PRESETS.inc(preset=analysis['resolution']['preset'])
+        return inputs, size, context
+    
+    def _resolve_prompt(self, custom_prompt):
+        """
+        決定使用的提示詞（必須包含一個 <image> 標記）
+        
+        Args:
+            custom_prompt: 自訂提示詞，None 或空字串表示使用預設提示詞
+        
+        Returns:
+            str: 提示詞
+        """
+        if not custom_prompt:
+            return self.default_prompt
+        if '<image>' not in custom_prompt:
+            return f"<image>\n{custom_prompt}"
+        return custom_prompt
+    
+    def _remove_repetition(self, text):
+        """
+        在第一個重複迴圈（模型幻覺）處截斷 OCR 結果（見 repetition.truncate_repetition）
+        
+        Args:
+            text: OCR 輸出文字
+        
+        Returns:
+            str: 清理後的文字
+        """
+        cleaned_text, loop = truncate_repetition(text)
+        if loop is not None:
+            REPETITION_TRUNCATIONS.inc(unit=loop['unit'])
+            print(f"偵測到重複輸出（{loop['unit']}，週期 {loop['period']} 個 token），"
+                  f"已於第 {loop['offset']} 個字元截斷（原長度 {len(text)}）")
+        return cleaned_text
+    
+    def _postprocess(self, result):
+        """
+        整理推理輸出的文字（去除前後空白並移除重複內容）
+        
+        Args:
+            result: 推理返回的文字
+        
+        Returns:
+            str: 整理後的文字，沒有結果時為空字串
+        """
+        ocr_text = result.strip() if isinstance(result, str) else ""
+        if ocr_text:
+            ocr_text = self._remove_repetition(ocr_text)
+        return ocr_text
+    
+    def _cache_entry(self, ocr_text, prompt, resolution):
+        """
+        建立寫入 OCR 結果快取的內容（快取命中時也能回報當時選擇的解析度）
+        
+        Args:
+            ocr_text: OCR 文字
+            prompt: 提示詞
+            resolution: 自動解析度模式選擇的設定，None 表示固定設定
+        
+        Returns:
+            dict: 快取內容
+        """
+        entry = {'text': ocr_text, 'prompt': prompt}
+        if resolution is not None:
+            entry['resolution'] = resolution
+        return entry
+    
+    def perform_ocr(self, image, custom_prompt=None, image_name=None, include_timings=False, max_tokens=None):
+        """
+        對單張圖片執行 OCR 辨識
+        
+        Args:
+            image: 圖片來源，可以是檔案路徑、圖片位元組或 PIL 圖片
+            custom_prompt: 自訂提示詞，若為 None 則使用預設提示詞
+            image_name: 回應中顯示的圖片名稱，預設為檔案路徑
+            include_timings: 是否在結果中附上各階段耗時（'timings'，單位毫秒）
+            max_tokens: 輸出 token 上限（不超過 max_new_tokens），None 表示依圖片估計
+        
+        Returns:
+            dict: 包含辨識結果的字典
+                {
+                    'text': OCR 辨識的文字,
+                    'image_path': 圖片路徑,
+                    'prompt': 使用的提示詞,
+                    'resolution': 自動解析度模式選擇的設定（僅 resolution_mode="adaptive"）,
+                    'max_tokens': 這張圖片的輸出 token 上限,
+                    'generated_tokens': 生成的 token 數,
+                    'budget_exhausted': 是否生成到上限而停止（為 True 時結果可能不完整）,
+                    'repetition_stopped': 是否在生成中確認重複迴圈而提前停止
+                }
+                或錯誤時返回
+                {
+                    'error': 錯誤訊息,
+                    'image_path': 圖片路徑
+                }
+        """
+        timings = {}
+        request_start = time.perf_counter()
+        try:
+            result = self._perform_ocr(image, custom_prompt, image_name, timings, max_tokens)
+        finally:
+            # 超時或例外時也記錄已經過的階段
+            timings['total'] = time.perf_counter() - request_start
+            self._record_timings(timings)
+        
+        if include_timings:
+            result['timings'] = format_timings(timings)
+        return result
+    
+    def _perform_ocr(self, image, custom_prompt, image_name, timings, max_tokens=None):
+        """
+        perform_ocr 的實作，各階段耗時（秒）寫入 timings
+        
+        Args:
+            image: 圖片來源
+            custom_prompt: 自訂提示詞
+            image_name: 回應中顯示的圖片名稱
+            timings: 階段名稱 → 秒
+            max_tokens: 輸出 token 上限，None 表示依圖片估計
+        
+        Returns:
+            dict: 與 perform_ocr 相同
+        """
+        image_path = image_name or (image if isinstance(image, str) else 'memory')
+        
+        # 檢查圖片是否存在
+        if isinstance(image, str) and not os.path.exists(image):
+            error_msg = f"圖片檔案不存在: {image_path}"
+            print(f"錯誤: {error_msg}")
+            ERRORS.inc(cause='file_not_found')
+            return {
+                'error': error_msg,
+                'image_path': image_path
+            }
+        
+        # 使用自訂提示詞或預設提示詞
+        prompt = self._resolve_prompt(custom_prompt)
+        
+        # 讀取圖片內容（檔案路徑只讀取一次，之後一律從記憶體解碼）
+        image_bytes = None if isinstance(image, Image.Image) else read_image_bytes(image)
+        
+        # 查詢 OCR 結果快取（命中時直接返回，不使用 GPU）
+        cache_key = None
+        if self.result_cache is not None:
+            lookup_start = time.time()
+            cache_key = build_cache_key(
+                image_bytes if image_bytes is not None else read_image_bytes(image), prompt, *self._cache_settings(),
+                self.test_compress, self.model_id
+            )
+            cached_result = self.result_cache.get(cache_key)
+            timings['cache_lookup'] = time.time() - lookup_start
+            if cached_result is not None:
+                print(f"OCR 結果快取命中: {image_path}")
+                cached_result.update({
+                    'image_path': image_path,
+                    'processing_time': round(time.time() - lookup_start, 2),
+                    'cached': True
+                })
+                return cached_result
+        
+        # 解碼圖片（每個請求只解碼一次）
+        try:
+            pil_image, size, context = self._decode(image, image_bytes, prompt, timings)
+        except FuturesTimeoutError:
+            ERRORS.inc(cause='timeout')
+            raise
+        except Exception as e:
+            error_msg = f"無法載入圖片: {str(e)}"
+            print(f"錯誤: {error_msg}")
+            ERRORS.inc(cause='image_decode')
+            return {
+                'error': error_msg,
+                'image_path': image_path
+            }
+        
+        print(f"已載入圖片: {image_path}，尺寸: {size}")
+        rejected = self._reject_unreadable(context, image_path)
+        if rejected is not None:
+            return rejected
+        resolution = context.get('resolution')
+        if resolution is not None:
+            print(f"自動解析度: {resolution}")
+        
+        token_budget = self._plan_tokens(size, context, max_tokens)
+        print(f"輸出 token 上限: {token_budget}（{context['budget_source']}）")
+        
+        # 記錄 GPU 記憶體狀態並估計此請求的峰值記憶體（推理前由記憶體准入控制依預算排隊）
+        memory_check_start = time.perf_counter()
+        gpu_info = self.backend.memory_info()
+        footprint_mb = self._estimate_footprint(size, context)
+        timings['memory_check'] = time.perf_counter() - memory_check_start
+        print(f"GPU 記憶體狀態: {gpu_info}")
+        if footprint_mb is not None:
+            print(f"預估峰值記憶體: {footprint_mb:.0f} MB（{context['footprint']['key']}）")
+        
+        # 執行 OCR
+        print(f"正在執行 OCR 辨識...")
+        print(f"超時設定: {self.ocr_timeout} 秒")
+        
+        start_time = time.time()
+        
+        if self.batch_scheduler is not None:
+            # 微批次模式：與其他並發請求合併為一次 generate，直接取得解碼後的文字
+            print(f"提交至微批次排程器 (超時: {self.ocr_timeout} 秒)...")
+        else:
+            # 交給常駐推理執行器，generate 直接返回解碼後的文字
+            print(f"開始模型推理 (超時: {self.ocr_timeout} 秒)...")
+        
+        # 註：使用從 config.py 載入的參數來處理圖片
+        result = self._submit_inference(pil_image, prompt, timings=timings, context=context)
+        print(f"OCR 推理執行成功")
+        
+        # 計算處理時間
+        elapsed_time = time.time() - start_time
+        print(f"OCR 處理耗時: {elapsed_time:.2f} 秒")
+        
+        postprocess_start = time.perf_counter()
+        ocr_text = self._postprocess(result)
+        timings['postprocess'] = time.perf_counter() - postprocess_start
+        print(f"推理返回文字長度: {len(ocr_text)}")
+        generation = self._generation_fields(context)
+        
+        # 檢查 OCR 結果是否異常（可能是 Prompt 重複）
+        if ocr_text and len(ocr_text) < 50:
+            print(f"⚠️ 警告：OCR 結果異常短（{len(ocr_text)} 字元），可能是辨識失敗")
+            
+            # 檢查是否與 Prompt 高度重疊
+            prompt_words = set(prompt.split())
+            ocr_words = set(ocr_text.split())
+            if ocr_words:
+                overlap_ratio = len(prompt_words & ocr_words) / len(ocr_words)
+                print(f"Prompt 重疊率: {overlap_ratio:.2%}")
+                
+                if overlap_ratio > 0.7:  # 70% 以上重疊視為異常
+                    print(f"❌ OCR 結果疑似為 Prompt 重複，將返回錯誤")
+                    ERRORS.inc(cause='prompt_echo')
+                    return {
+                        'error': UNREADABLE_IMAGE_ERROR,
+                        'image_path': image_path,
+                        'processing_time': round(elapsed_time, 2),
+                        'gpu_info': gpu_info,
+                        'debug_info': {
+                            'ocr_text_length': len(ocr_text),
+                            'prompt_overlap_ratio': overlap_ratio
+                        }
+                    }
+        
+        if ocr_text:
+            print(f"OCR 辨識完成，文字長度: {len(ocr_text)}")
+            
+            # 記錄 OCR 後的 GPU 記憶體狀態
+            gpu_info_after = self.backend.memory_info()
+            print(f"OCR 後 GPU 記憶體狀態: {gpu_info_after}")
+            
+            # 寫入 OCR 結果快取（生成到上限或因重複迴圈提前停止的結果可能不完整，不寫入，之後可重新辨識）
+            if cache_key is not None and not generation.get('budget_exhausted') and not generation.get('repetition_stopped'):
+                self.result_cache.put(cache_key, self._cache_entry(ocr_text, prompt, resolution))
+            
+            result = {
+                'text': ocr_text,
+                'image_path': image_path,
+                'prompt': prompt,
+                'processing_time': round(elapsed_time, 2),
+                'gpu_info_before': gpu_info,
+                'gpu_info_after': gpu_info_after
+            }
+            if resolution is not None:
+                result['resolution'] = resolution
+            result.update(generation)
+            return result
+        else:
+            error_msg = "模型未返回任何結果"
+            print(f"錯誤: {error_msg}")
+            ERRORS.inc(cause='empty_result')
+            
+            return {
+                'error': error_msg,
+                'image_path': image_path,
+                'processing_time': round(elapsed_time, 2),
+                'gpu_info': gpu_info
+            }
+    
+    def _release_memory(self, reason):
+        """
+        釋放設備上未使用的快取記憶體（啟用記憶體管理時記錄在其統計中）
+        
+        Args:
+            reason: 釋放原因（見 MemoryManager.release）
+        """
+        if self.memory_manager is not None:
+            self.memory_manager.release(reason)
+        else:
+            self.backend.clear_cache()
+    
+    def clear_gpu_cache(self):
+        """
+        手動清理 GPU 快取記憶體
+        
+        推理過程中不會呼叫此方法，快取記憶體由背景記憶體管理依策略釋放
+        """
+        gpu_before = self.backend.memory_info()
+        if not gpu_before['available'] or gpu_before.get('simulated'):
+            return
+        
+        print("正在清理 GPU 快取記憶體...")
+        print(f"清理前 GPU 記憶體: {gpu_before}")
+        
+        self._release_memory('manual')
+        
+        gpu_after = self.backend.memory_info()
+        print(f"清理後 GPU 記憶體: {gpu_after}")
+        print(f"釋放記憶體: {gpu_before['used_mb'] - gpu_after['used_mb']:.2f} MB")
+    
+    def stream_ocr(self, image, custom_prompt=None, image_name=None, max_tokens=None):
+        """
+        對單張圖片執行 OCR 辨識，並在生成過程中逐段返回文字
+        
+        串流請求不經過微批次排程器，直接交給常駐推理執行器單獨生成；
+        呼叫端中途停止迭代（例如客戶端斷線）時會通知 generate 停止
+        
+        Args:
+            image: 圖片來源，可以是檔案路徑、圖片位元組或 PIL 圖片
+            custom_prompt: 自訂提示詞，若為 None 則使用預設提示詞
+            image_name: 回應中顯示的圖片名稱，預設為檔案路徑
+            max_tokens: 輸出 token 上限（不超過 max_new_tokens），None 表示依圖片估計
+        
+        Yields:
+            dict: 串流事件，'event' 欄位為
+                'token': 新生成的文字片段（'text'）
+                'done': 完整文字、各階段耗時（'timings'，單位毫秒）、自動選擇的解析度（'resolution'）
+                        與輸出 token 上限資訊（'max_tokens'、'generated_tokens'、'budget_exhausted'、'repetition_stopped'）
+                'error': 錯誤訊息（'error'）
+        """
+        timings = {}
+        request_start = time.perf_counter()
+        events = self._stream_ocr(image, custom_prompt, image_name, timings, max_tokens)
+        try:
+            for event in events:
+                if event['event'] == 'done':
+                    timings['total'] = time.perf_counter() - request_start
+                    event['timings'] = dict(event['timings'], **format_timings(timings))
+                yield event
+        finally:
+            # 呼叫端中途停止時立即關閉內部產生器，讓它通知 generate 停止
+            events.close()
+            timings.setdefault('total', time.perf_counter() - request_start)
+            self._record_timings(timings)
+    
+    def _stream_ocr(self, image, custom_prompt, image_name, timings, max_tokens=None):
+        """
+        stream_ocr 的實作，各階段耗時（秒）寫入 timings
+        
+        Args:
+            image: 圖片來源
+            custom_prompt: 自訂提示詞
+            image_name: 回應中顯示的圖片名稱
+            timings: 階段名稱 → 秒
+            max_tokens: 輸出 token 上限，None 表示依圖片估計
+        
+        Yields:
+            dict: 與 stream_ocr 相同的串流事件
+        """
+        request_start = time.time()
+        image_path = image_name or (image if isinstance(image, str) else 'memory')
+        print(f"開始串流 OCR 辨識: {image_path}")
+        
+        # 檢查圖片是否存在
+        if isinstance(image, str) and not os.path.exists(image):
+            ERRORS.inc(cause='file_not_found')
+            yield {'event': 'error', 'error': f"圖片檔案不存在: {image_path}", 'image_path': image_path}
+            return
+        
+        # 使用自訂提示詞或預設提示詞
+        prompt = self._resolve_prompt(custom_prompt)
+        
+        # 查詢 OCR 結果快取（命中時一次送出完整文字）
+        image_bytes = None if isinstance(image, Image.Image) else read_image_bytes(image)
+        cache_key = None
+        if self.result_cache is not None:
+            lookup_start = time.time()
+            cache_key = build_cache_key(
+                image_bytes if image_bytes is not None else read_image_bytes(image), prompt, *self._cache_settings(),
+                self.test_compress, self.model_id
+            )
+            cached_result = self.result_cache.get(cache_key)
+            timings['cache_lookup'] = time.time() - lookup_start
+            if cached_result is not None:
+                print(f"OCR 結果快取命中: {image_path}")
+                total_ms = round((time.time() - request_start) * 1000, 1)
+                yield {'event': 'token', 'text': cached_result['text']}
+                done = {
+                    'event': 'done',
+                    'text': cached_result['text'],
+                    'image_path': image_path,
+                    'prompt': prompt,
+                    'cached': True,
+                    'timings': {'time_to_first_token_ms': total_ms, 'total_ms': total_ms}
+                }
+                if 'resolution' in cached_result:
+                    done['resolution'] = cached_result['resolution']
+                yield done
+                return
+        
+        # 解碼圖片（每個請求只解碼一次）
+        try:
+            pil_image, size, context = self._decode(image, image_bytes, prompt, timings)
+        except FuturesTimeoutError:
+            ERRORS.inc(cause='timeout')
+            yield {'event': 'error', 'error': f"OCR 處理超時 (超過 {self.ocr_timeout} 秒)", 'image_path': image_path}
+            return
+        except Exception as e:
+            ERRORS.inc(cause='image_decode')
+            yield {'event': 'error', 'error': f"無法載入圖片: {str(e)}", 'image_path': image_path}
+            return
+        
+        rejected = self._reject_unreadable(context, image_path)
+        if rejected is not None:
+            yield dict({'event': 'error'}, **rejected)
+            return
+        
+        self._plan_tokens(size, context, max_tokens)
+        memory_check_start = time.perf_counter()
+        self._estimate_footprint(size, context)
+        timings['memory_check'] = time.perf_counter() - memory_check_start
+        
+        cancel_event = threading.Event()
+        streamer = self.backend.create_streamer()
+        generate_started = {}
+        resolution = context.get('resolution')
+        trace = dict(context, submitted_at=time.perf_counter(), timings=timings)
+        item = (pil_image, prompt, cancel_event, trace)
+        
+        def _generate():
+            generate_started['at'] = time.time()
+            return self._run_batch([item], streamer=streamer)[0]
+        
+        INFERENCE_QUEUED.inc()
+        future = self.inference_executor.submit(_generate)
+        first_token_at = None
+        
+        try:
+            for chunk in iter_streamer(streamer, future, self.ocr_timeout):
+                if first_token_at is None:
+                    first_token_at = time.time()
+                yield {'event': 'token', 'text': chunk}
+            
+            result = future.result(timeout=self.ocr_timeout)
+            postprocess_start = time.perf_counter()
+            ocr_text = self._postprocess(result)
+            timings['postprocess'] = time.perf_counter() - postprocess_start
+        except FuturesTimeoutError:
+            with self._timeout_lock:
+                self.timed_out_inferences += 1
+            ERRORS.inc(cause='timeout')
+            error_msg = f"OCR 處理超時 (超過 {self.ocr_timeout} 秒)，請嘗試使用更小的圖片或增加超時設定"
+            print(f"錯誤: {error_msg}")
+            yield {'event': 'error', 'error': error_msg, 'image_path': image_path}
+            return
+        except Exception as e:
+            ERRORS.inc(cause='gpu_memory' if is_out_of_memory(e) else 'inference')
+            error_msg = f"OCR 處理發生錯誤: {str(e)}"
+            print(f"錯誤: {error_msg}")
+            yield {'event': 'error', 'error': error_msg, 'image_path': image_path}
+            return
+        finally:
+            # 正常完成時無作用；超時、例外或客戶端斷線時停止生成
+            self._cancel(future, cancel_event)
+            if 'prefetched' in context:
+                context['prefetched'].release()
+        
+        finished_at = time.time()
+        started_at = generate_started.get('at', request_start)
+        summary = {
+            'queue_ms': round((started_at - request_start) * 1000, 1),
+            'time_to_first_token_ms': round(((first_token_at or finished_at) - request_start) * 1000, 1),
+            'inference_ms': round((finished_at - started_at) * 1000, 1),
+            'total_ms': round((finished_at - request_start) * 1000, 1)
+        }
+        print(f"串流 OCR 完成，文字長度: {len(ocr_text)}，耗時: {summary}")
+        generation = self._generation_fields(context)
+        
+        if (self.result_cache is not None and ocr_text and not generation.get('budget_exhausted')
+                and not generation.get('repetition_stopped')):
+            self.result_cache.put(cache_key, self._cache_entry(ocr_text, prompt, resolution))
+        
+        done = {
+            'event': 'done',
+            'text': ocr_text,
+            'image_path': image_path,
+            'prompt': prompt,
+            'processing_time': round(finished_at - request_start, 2),
+            'timings': summary
+        }
+        if resolution is not None:
+            done['resolution'] = resolution
+        done.update(generation)
+        yield done
+    
+    def iter_batch_ocr(self, images, custom_prompt=None, max_in_flight=None, include_timings=False, max_tokens=None):
+        """
+        逐張返回批次 OCR 結果（依完成順序），適合串流輸出
+        
+        圖片來源只在有空位時才從 images 取出，同時處理中的圖片數不超過 max_in_flight，
+        因此不論批次多大，記憶體中只會保留少數圖片與結果
+        
+        Args:
+            images: 可迭代的 (圖片來源, 圖片名稱) 序列
+            custom_prompt: 自訂提示詞
+            max_in_flight: 同時處理中的圖片數上限，預設為微批次大小與並發推理上限中較大者
+            include_timings: 是否在每張圖片的結果中附上各階段耗時
+            max_tokens: 每張圖片的輸出 token 上限，None 表示依各圖片估計
+        
+        Yields:
+            dict: 單張圖片的 OCR 結果（含 'index'，失敗時含 'error'）
+        """
+        window = max(1, int(max_in_flight or self.batch_window))
+        image_iter = enumerate(images)
+        exhausted = False
+        pending = {}
+        
+        try:
+            while pending or not exhausted:
+                # 補滿處理視窗
+                while not exhausted and len(pending) < window:
+                    try:
+                        index, (image, image_name) = next(image_iter)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    future = self.batch_request_executor.submit(
+                        self.perform_ocr, image, custom_prompt, image_name=image_name,
+                        include_timings=include_timings, max_tokens=max_tokens
+                    )
+                    pending[future] = (index, image_name)
+                
+                if not pending:
+                    break
+                
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    index, image_name = pending.pop(future)
+                    try:
+                        result = future.result()
+                    except FuturesTimeoutError:
+                        result = {
+                            'error': f"OCR 處理超時 (超過 {self.ocr_timeout} 秒)，請嘗試使用更小的圖片或增加超時設定",
+                            'image_path': image_name
+                        }
+                    except Exception as e:
+                        result = {'error': f"OCR 處理發生錯誤: {str(e)}", 'image_path': image_name}
+                    result['index'] = index
+                    yield result
+        finally:
+            # 呼叫端中途停止（例如客戶端斷線）時，取消尚未開始的圖片
+            for future in pending:
+                future.cancel()
+    
+    def perform_batch_ocr(self, images, custom_prompt=None, image_names=None, include_timings=False, max_tokens=None):
+        """
+        對多張圖片執行批次 OCR 辨識
+        
+        Args:
+            images: 圖片來源列表（檔案路徑、圖片位元組或 PIL 圖片）
+            custom_prompt: 自訂提示詞，若為 None 則使用預設提示詞
+            image_names: 回應中顯示的圖片名稱列表（可選）
+            include_timings: 是否在每張圖片的結果中附上各階段耗時
+            max_tokens: 每張圖片的輸出 token 上限，None 表示依各圖片估計
+        
+        Returns:
+            list: 包含多個辨識結果的列表，每個元素為 dict
+        """
+        total_images = len(images)
+        
+        print(f"開始批次處理 {total_images} 張圖片")
+        
+        pending = []
+        for idx, image in enumerate(images):
+            image_name = image_names[idx] if image_names else None
+            image_path = image_name or (image if isinstance(image, str) else 'memory')
+            
+            # 檢查圖片是否存在
+            if isinstance(image, str) and not os.path.exists(image):
+                error_msg = f"圖片檔案不存在: {image_path}"
+                print(f"警告: {error_msg}")
+                continue
+            pending.append((image, image_name))
+        
+        # 交給 iter_batch_ocr 同時處理多張圖片：後續圖片的解碼與前處理和目前的推理重疊，
+        # 超時或失敗的圖片記錄錯誤後繼續處理其他圖片
+        results = [None] * len(pending)
+        for done, single_result in enumerate(
+                self.iter_batch_ocr(pending, custom_prompt, include_timings=include_timings, max_tokens=max_tokens), 1):
+            results[single_result.pop('index')] = single_result
+            print(f"\n處理進度: {done}/{len(pending)}")
+            if 'text' in single_result:
+                print(f"✓ {single_result.get('image_path')} 處理成功")
+            else:
+                print(f"✗ {single_result.get('image_path')} 處理失敗: {single_result.get('error', '未知錯誤')}")
+        
+        success_count = sum(1 for r in results if 'text' in r)
+        failed_count = len(results) - success_count
+        
+        print(f"\n批次 OCR 辨識完成")
+        print(f"總計: {total_images} 張，成功: {success_count} 張，失敗: {failed_count} 張")
+        
+        return results
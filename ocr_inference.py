@@ -0,0 +1,810 @@
+"""
+DeepSeek-OCR 推理輔助模組
+將模型 infer 方法中的圖片前處理與生成流程拆解出來，
+讓服務層可以把多張圖片合併為一次批次 generate 呼叫
+"""
+
+import io
+import math
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import TimeoutError as FuturesTimeoutError
+
+import torch
+from PIL import Image, ImageOps
+from transformers import StoppingCriteria, StoppingCriteriaList, TextIteratorStreamer
+
+
+# 與 DeepSeek-OCR 模型 infer 方法相同的常數
+IMAGE_TOKEN = '<image>'
+IMAGE_TOKEN_ID = 128815
+BOS_ID = 0
+PATCH_SIZE = 16
+DOWNSAMPLE_RATIO = 4
+STOP_STR = '<｜end▁of▁sentence｜>'
+DEFAULT_MAX_NEW_TOKENS = 8192
+NO_REPEAT_NGRAM_SIZE = 20
+
+# 視覺編碼器的子模組名稱（SAM、CLIP 與投影層），只在預填時執行一次
+VISION_MODULE_NAMES = ('sam_model', 'vision_model', 'projector')
+
+# 正規化參數（mean=0.5, std=0.5），padding 顏色使用 mean * 255
+IMAGE_MEAN = (0.5, 0.5, 0.5)
+IMAGE_STD = (0.5, 0.5, 0.5)
+PAD_COLOR = tuple(int(x * 255) for x in IMAGE_MEAN)
+
+
+def read_image_bytes(image):
+    """
+    取得圖片的原始內容（用於快取鍵值與解碼）
+
+    Args:
+        image: 檔案路徑、圖片位元組或 PIL 圖片
+
+    Returns:
+        bytes: 檔案內容；PIL 圖片則為模式、尺寸與像素資料
+    """
+    if isinstance(image, (bytes, bytearray)):
+        return bytes(image)
+    if isinstance(image, Image.Image):
+        return f"{image.mode}:{image.size}:".encode('utf-8') + image.tobytes()
+    with open(image, 'rb') as f:
+        return f.read()
+
+
+def load_image(image):
+    """
+    解碼圖片並依 EXIF 方向轉正，轉為 RGB 模式
+
+    Args:
+        image: 檔案路徑、圖片位元組或 PIL 圖片
+
+    Returns:
+        PIL.Image.Image: RGB 圖片
+    """
+    if isinstance(image, (bytes, bytearray)):
+        image = Image.open(io.BytesIO(image))
+    elif not isinstance(image, Image.Image):
+        image = Image.open(image)
+    image = ImageOps.exif_transpose(image)
+    return image.convert('RGB')
+
+
+def find_closest_aspect_ratio(aspect_ratio, target_ratios, width, height, image_size):
+    """
+    找出最接近原圖長寬比的裁切網格（與模型內建實作一致）
+
+    Args:
+        aspect_ratio: 原圖長寬比
+        target_ratios: 候選的 (寬, 高) 區塊數組合
+        width: 原圖寬度
+        height: 原圖高度
+        image_size: 單一區塊尺寸
+
+    Returns:
+        tuple: (寬方向區塊數, 高方向區塊數)
+    """
+    best_ratio_diff = float('inf')
+    best_ratio = (1, 1)
+    area = width * height
+    for ratio in target_ratios:
+        target_aspect_ratio = ratio[0] / ratio[1]
+        ratio_diff = abs(aspect_ratio - target_aspect_ratio)
+        if ratio_diff < best_ratio_diff:
+            best_ratio_diff = ratio_diff
+            best_ratio = ratio
+        elif ratio_diff == best_ratio_diff:
+            if area > 0.5 * image_size * image_size * ratio[0] * ratio[1]:
+                best_ratio = ratio
+    return best_ratio
+
+
+def crop_grid(width, height, min_num=2, max_num=9, image_size=640):
+    """
+    計算 dynamic_preprocess 使用的裁切網格（不需要圖片內容，可用於估計記憶體用量）
+
+    Args:
+        width: 原圖寬度
+        height: 原圖高度
+        min_num: 最少區塊數
+        max_num: 最多區塊數
+        image_size: 單一區塊尺寸
+
+    Returns:
+        tuple: (寬方向區塊數, 高方向區塊數)
+    """
+    target_ratios = set(
+        (i, j) for n in range(min_num, max_num + 1)
+        for i in range(1, n + 1) for j in range(1, n + 1)
+        if min_num <= i * j <= max_num
+    )
+    target_ratios = sorted(target_ratios, key=lambda x: x[0] * x[1])
+    return find_closest_aspect_ratio(width / height, target_ratios, width, height, image_size)
+
+
+def count_image_tokens(width, height, base_size, image_size, crop_mode):
+    """
+    計算 prepare_inputs 為一張圖片產生的視覺 token 數（不需要圖片內容）
+
+    Args:
+        width: 原圖寬度
+        height: 原圖高度
+        base_size: 全域視圖尺寸
+        image_size: 局部裁切尺寸
+        crop_mode: 是否啟用裁切模式
+
+    Returns:
+        tuple: (視覺 token 數, (寬方向區塊數, 高方向區塊數))；沒有裁切時區塊數為 (1, 1)
+    """
+    columns, rows = 1, 1
+    if crop_mode and (width > 640 or height > 640):
+        columns, rows = crop_grid(width, height, image_size=image_size)
+
+    # 每列多一個換行 token，最後一個分隔 token
+    queries = math.ceil((image_size // PATCH_SIZE) / DOWNSAMPLE_RATIO)
+    if not crop_mode:
+        return (queries + 1) * queries + 1, (columns, rows)
+    queries_base = math.ceil((base_size // PATCH_SIZE) / DOWNSAMPLE_RATIO)
+    image_tokens = (queries_base + 1) * queries_base + 1
+    if columns * rows > 1:
+        image_tokens += (queries * columns + 1) * (queries * rows)
+    return image_tokens, (columns, rows)
+
+
+def dynamic_preprocess(image, min_num=2, max_num=9, image_size=640):
+    """
+    將圖片依長寬比切成多個區塊（crop_mode 使用）
+
+    Args:
+        image: PIL 圖片
+        min_num: 最少區塊數
+        max_num: 最多區塊數
+        image_size: 單一區塊尺寸
+
+    Returns:
+        tuple: (區塊圖片列表, (寬方向區塊數, 高方向區塊數))
+    """
+    target_aspect_ratio = crop_grid(image.size[0], image.size[1], min_num, max_num, image_size)
+
+    target_width = image_size * target_aspect_ratio[0]
+    target_height = image_size * target_aspect_ratio[1]
+    blocks = target_aspect_ratio[0] * target_aspect_ratio[1]
+    columns = target_width // image_size
+
+    resized_img = image.resize((target_width, target_height))
+    processed_images = []
+    for i in range(blocks):
+        box = (
+            (i % columns) * image_size,
+            (i // columns) * image_size,
+            ((i % columns) + 1) * image_size,
+            ((i // columns) + 1) * image_size
+        )
+        processed_images.append(resized_img.crop(box))
+
+    return processed_images, target_aspect_ratio
+
+
+def _image_to_tensor(image, dtype):
+    """將 PIL 圖片轉為正規化後的 CHW tensor"""
+    tensor = torch.frombuffer(bytearray(image.tobytes()), dtype=torch.uint8)
+    tensor = tensor.view(image.size[1], image.size[0], 3).permute(2, 0, 1).float() / 255.0
+    mean = torch.tensor(IMAGE_MEAN).view(3, 1, 1)
+    std = torch.tensor(IMAGE_STD).view(3, 1, 1)
+    return ((tensor - mean) / std).to(dtype)
+
+
+def _encode_text(tokenizer, text):
+    """編碼文字片段（不加入 BOS/EOS）"""
+    return tokenizer.encode(text, add_special_tokens=False)
+
+
+def tokenize_prompt(tokenizer, prompt):
+    """
+    將提示詞以 <image> 標記分為前後兩段並分別 tokenize
+
+    Args:
+        tokenizer: 模型的 tokenizer
+        prompt: 提示詞，需包含一個 <image> 標記
+
+    Returns:
+        tuple: (圖片前的 token ids, 圖片後的 token ids)
+    """
+    text_splits = prompt.strip().split(IMAGE_TOKEN)
+    if len(text_splits) != 2:
+        raise ValueError(f"提示詞必須包含一個 {IMAGE_TOKEN} 標記: {prompt!r}")
+    return tuple(_encode_text(tokenizer, text_splits[0])), tuple(_encode_text(tokenizer, text_splits[1]))
+
+
+class PromptTokenCache:
+    """
+    提示詞 tokenize 結果快取
+
+    常用提示詞（register 登錄）常駐不淘汰，其他提示詞以 LRU 保留最近使用的 max_items 個；
+    快取的是不可變的 tuple，可在多個執行緒間共用
+    """
+
+    def __init__(self, tokenizer, max_items=64):
+        """
+        Args:
+            tokenizer: 模型的 tokenizer
+            max_items: 非常駐提示詞最多保留的數量
+        """
+        self.tokenizer = tokenizer
+        self.max_items = max(0, int(max_items))
+        self._lock = threading.Lock()
+        self._hot = {}
+        self._recent = OrderedDict()
+        self._stats = {'hits': 0, 'misses': 0}
+
+    def register(self, prompts):
+        """
+        預先 tokenize 常用提示詞並常駐
+
+        Args:
+            prompts: 提示詞列表（需包含 <image> 標記）
+        """
+        for prompt in prompts:
+            tokens = tokenize_prompt(self.tokenizer, prompt)
+            with self._lock:
+                self._hot[prompt] = tokens
+                self._recent.pop(prompt, None)
+
+    def get(self, prompt):
+        """
+        取得提示詞的 tokenize 結果（未命中時 tokenize 並放入 LRU）
+
+        Args:
+            prompt: 提示詞
+
+        Returns:
+            tuple: 與 tokenize_prompt 相同
+        """
+        with self._lock:
+            tokens = self._hot.get(prompt)
+            if tokens is None:
+                tokens = self._recent.get(prompt)
+                if tokens is not None:
+                    self._recent.move_to_end(prompt)
+            self._stats['hits' if tokens is not None else 'misses'] += 1
+        if tokens is not None:
+            return tokens
+
+        tokens = tokenize_prompt(self.tokenizer, prompt)
+        if self.max_items > 0:
+            with self._lock:
+                self._recent[prompt] = tokens
+                while len(self._recent) > self.max_items:
+                    self._recent.popitem(last=False)
+        return tokens
+
+    def get_stats(self):
+        """
+        Returns:
+            dict: 命中/未命中次數與常駐、LRU 中的提示詞數
+        """
+        with self._lock:
+            return dict(self._stats, hot_prompts=len(self._hot), recent_prompts=len(self._recent))
+
+
+def prepare_inputs(tokenizer, image, prompt, base_size=1024, image_size=640,
+                   crop_mode=True, dtype=torch.bfloat16, prompt_tokens=None):
+    """
+    建立單張圖片的模型輸入（與模型 infer 方法的前處理一致）
+
+    Args:
+        tokenizer: 模型的 tokenizer
+        image: RGB PIL 圖片
+        prompt: 提示詞，需包含一個 <image> 標記
+        base_size: 全圖視角的基準尺寸
+        image_size: 裁切區塊尺寸
+        crop_mode: 是否啟用裁切模式
+        dtype: 圖片 tensor 的資料型別
+        prompt_tokens: 已 tokenize 的提示詞（tokenize_prompt 的結果），None 表示在此 tokenize
+
+    Returns:
+        dict: 模型輸入
+            {
+                'input_ids': LongTensor [seq_len],
+                'images_seq_mask': BoolTensor [seq_len],
+                'images_crop': Tensor [n, 3, image_size, image_size],
+                'images_ori': Tensor [1, 3, size, size],
+                'images_spatial_crop': [寬方向區塊數, 高方向區塊數]
+            }
+    """
+    prefix_ids, suffix_ids = prompt_tokens or tokenize_prompt(tokenizer, prompt)
+
+    tokenized_str = list(prefix_ids)
+    images_seq_mask = [False] * len(tokenized_str)
+    images_crop_list = []
+    width_crop_num, height_crop_num = 1, 1
+
+    if crop_mode:
+        if image.size[0] > 640 or image.size[1] > 640:
+            images_crop_raw, (width_crop_num, height_crop_num) = dynamic_preprocess(
+                image, image_size=image_size)
+            if width_crop_num > 1 or height_crop_num > 1:
+                images_crop_list = [_image_to_tensor(crop, dtype) for crop in images_crop_raw]
+
+        global_view = ImageOps.pad(image, (base_size, base_size), color=PAD_COLOR)
+        num_queries = math.ceil((image_size // PATCH_SIZE) / DOWNSAMPLE_RATIO)
+        num_queries_base = math.ceil((base_size // PATCH_SIZE) / DOWNSAMPLE_RATIO)
+
+        tokenized_image = ([IMAGE_TOKEN_ID] * num_queries_base + [IMAGE_TOKEN_ID]) * num_queries_base
+        tokenized_image += [IMAGE_TOKEN_ID]
+        if width_crop_num > 1 or height_crop_num > 1:
+            tokenized_image += ([IMAGE_TOKEN_ID] * (num_queries * width_crop_num) + [IMAGE_TOKEN_ID]) * (
+                num_queries * height_crop_num)
+    else:
+        if image_size <= 640:
+            image = image.resize((image_size, image_size))
+        global_view = ImageOps.pad(image, (image_size, image_size), color=PAD_COLOR)
+        num_queries = math.ceil((image_size // PATCH_SIZE) / DOWNSAMPLE_RATIO)
+
+        tokenized_image = ([IMAGE_TOKEN_ID] * num_queries + [IMAGE_TOKEN_ID]) * num_queries
+        tokenized_image += [IMAGE_TOKEN_ID]
+
+    tokenized_str += tokenized_image
+    images_seq_mask += [True] * len(tokenized_image)
+
+    tokenized_str += suffix_ids
+    images_seq_mask += [False] * len(suffix_ids)
+
+    tokenized_str = [BOS_ID] + tokenized_str
+    images_seq_mask = [False] + images_seq_mask
+
+    images_ori = _image_to_tensor(global_view, dtype).unsqueeze(0)
+    if images_crop_list:
+        images_crop = torch.stack(images_crop_list, dim=0)
+    else:
+        images_crop = torch.zeros((1, 3, base_size, base_size), dtype=dtype)
+
+    return {
+        'input_ids': torch.LongTensor(tokenized_str),
+        'images_seq_mask': torch.tensor(images_seq_mask, dtype=torch.bool),
+        'images_crop': images_crop,
+        'images_ori': images_ori,
+        'images_spatial_crop': [width_crop_num, height_crop_num],
+    }
+
+
+def collate_inputs(batch_inputs, pad_token_id, device):
+    """
+    將多筆模型輸入合併為一個批次（左側補齊，讓所有序列在同一位置開始生成）
+
+    Args:
+        batch_inputs: prepare_inputs 產生的輸入列表
+        pad_token_id: 補齊用的 token id
+        device: 目標設備
+
+    Returns:
+        dict: 可直接傳給 model.generate 的參數
+    """
+    max_len = max(item['input_ids'].shape[0] for item in batch_inputs)
+    batch_size = len(batch_inputs)
+
+    input_ids = torch.full((batch_size, max_len), pad_token_id, dtype=torch.long)
+    attention_mask = torch.zeros((batch_size, max_len), dtype=torch.long)
+    images_seq_mask = torch.zeros((batch_size, max_len), dtype=torch.bool)
+    images = []
+
+    for row, item in enumerate(batch_inputs):
+        length = item['input_ids'].shape[0]
+        input_ids[row, max_len - length:] = item['input_ids']
+        attention_mask[row, max_len - length:] = 1
+        images_seq_mask[row, max_len - length:] = item['images_seq_mask']
+        images_crop = item['images_crop'].to(device)
+        images_ori = item['images_ori'].to(device)
+        # 標記圖片 tensor，讓 CachedVisionEncoder 辨識同一張圖片與解析度（模型直接以這兩個 tensor 呼叫視覺編碼器）
+        if item.get('vision_key'):
+            images_crop.vision_key = f"{item['vision_key']}:local"
+            images_ori.vision_key = f"{item['vision_key']}:global"
+        images.append((images_crop, images_ori))
+
+    return {
+        'input_ids': input_ids.to(device),
+        'attention_mask': attention_mask.to(device),
+        'images': images,
+        'images_seq_mask': images_seq_mask.to(device),
+        'images_spatial_crop': torch.tensor(
+            [item['images_spatial_crop'] for item in batch_inputs], dtype=torch.long),
+    }
+
+
+def decode_outputs(tokenizer, output_ids, prompt_length):
+    """
+    將 generate 的輸出解碼為文字
+
+    Args:
+        tokenizer: 模型的 tokenizer
+        output_ids: generate 回傳的 token ids [batch, seq_len]
+        prompt_length: 補齊後的提示詞長度
+
+    Returns:
+        list: 每筆輸入對應的文字
+    """
+    eos_token_id = tokenizer.eos_token_id
+    texts = []
+    for row in output_ids:
+        generated = row[prompt_length:].tolist()
+        # 批次中較早結束的序列後面會被補上 pad/eos，截斷到第一個 eos
+        if eos_token_id is not None and eos_token_id in generated:
+            generated = generated[:generated.index(eos_token_id)]
+        text = tokenizer.decode(generated)
+        if text.endswith(STOP_STR):
+            text = text[:-len(STOP_STR)]
+        texts.append(text.strip())
+    return texts
+
+
+class CancelStoppingCriteria(StoppingCriteria):
+    """
+    每生成一個 token 檢查一次取消旗標
+
+    已超時或被放棄的請求會在下一個 token 停止生成；
+    批次中其他未取消的請求不受影響，全部取消時 generate 立即結束
+    """
+
+    def __init__(self, cancel_events):
+        """
+        Args:
+            cancel_events: 與批次順序一致的 threading.Event 列表（None 表示不可取消）
+        """
+        self.cancel_events = cancel_events
+
+    def __call__(self, input_ids, scores, **kwargs):
+        cancelled = [event is not None and event.is_set() for event in self.cancel_events]
+        return torch.tensor(cancelled, dtype=torch.bool, device=input_ids.device)
+
+
+class RepetitionStoppingCriteria(StoppingCriteria):
+    """
+    每生成一個 token 將新 token 交給 repetition.RepetitionDetector，確認重複迴圈的圖片立即停止生成
+
+    已結束（EOS）或取消的圖片之後只會補 padding，不再檢查
+    """
+
+    def __init__(self, detector, stop_token_ids):
+        """
+        Args:
+            detector: 與批次大小一致的 RepetitionDetector
+            stop_token_ids: 表示該圖片已結束的 token id（EOS 與 padding）
+        """
+        self.detector = detector
+        self.stop_token_ids = set(token_id for token_id in stop_token_ids if token_id is not None)
+
+    def __call__(self, input_ids, scores, **kwargs):
+        tokens = input_ids[:, -1].tolist()
+        finished = [token in self.stop_token_ids for token in tokens]
+        looping = self.detector.step(tokens, finished)
+        return torch.tensor(looping, dtype=torch.bool, device=input_ids.device)
+
+
+class TokenBudgetStoppingCriteria(StoppingCriteria):
+    """
+    批次中各圖片的輸出 token 預算不同時，生成數達到預算的圖片停止生成
+
+    generate 的 max_new_tokens 為批次中最大的預算，其他圖片由此條件提前停止
+    """
+
+    def __init__(self, budgets, prompt_length):
+        """
+        Args:
+            budgets: 與批次順序一致的輸出 token 預算
+            prompt_length: 補齊後的提示詞長度
+        """
+        self.budgets = budgets
+        self.prompt_length = prompt_length
+
+    def __call__(self, input_ids, scores, **kwargs):
+        generated = input_ids.shape[1] - self.prompt_length
+        return torch.tensor([generated >= budget for budget in self.budgets], dtype=torch.bool, device=input_ids.device)
+
+
+class FirstStepTimer(StoppingCriteria):
+    """
+    記錄第一個生成步驟完成的時間（即預填結束），不會停止生成
+
+    CUDA 上只在第一次呼叫時同步一次，之後的步驟不增加額外開銷
+    """
+
+    def __init__(self, use_cuda=False):
+        self.use_cuda = use_cuda
+        self.first_step_at = None
+
+    def __call__(self, input_ids, scores, **kwargs):
+        if self.first_step_at is None:
+            if self.use_cuda:
+                torch.cuda.synchronize(input_ids.device)
+            self.first_step_at = time.perf_counter()
+        return torch.zeros(input_ids.shape[0], dtype=torch.bool, device=input_ids.device)
+
+
+class VisionEncodeTimer:
+    """
+    以 forward hook 量測視覺編碼器（VISION_MODULE_NAMES）的耗時
+
+    只有在 track() 區塊內的 generate 才會記錄，其他呼叫的 hook 直接返回；
+    CUDA 上會在視覺編碼前後各同步一次，讓耗時不會被算到預填的其他部分
+    """
+
+    def __init__(self, model, use_cuda=False):
+        """
+        Args:
+            model: DeepSeek-OCR 模型
+            use_cuda: 模型是否在 CUDA 上
+        """
+        self.use_cuda = use_cuda
+        self._local = threading.local()
+        self.handles = []
+
+        # 只掛在最外層的視覺模組上（子模組名稱相同時不重複計時）
+        hooked = []
+        for name, module in model.named_modules():
+            if name.rsplit('.', 1)[-1] not in VISION_MODULE_NAMES:
+                continue
+            if any(name.startswith(prefix + '.') for prefix in hooked):
+                continue
+            hooked.append(name)
+            self.handles.append(module.register_forward_pre_hook(self._before))
+            self.handles.append(module.register_forward_hook(self._after))
+
+    def _before(self, module, args):
+        if getattr(self._local, 'timings', None) is None:
+            return
+        if self.use_cuda:
+            torch.cuda.synchronize()
+        self._local.started_at = time.perf_counter()
+
+    def _after(self, module, args, output):
+        timings = getattr(self._local, 'timings', None)
+        if timings is None:
+            return
+        if self.use_cuda:
+            torch.cuda.synchronize()
+        timings['vision_encode'] = timings.get('vision_encode', 0.0) + time.perf_counter() - self._local.started_at
+
+    def track(self, timings):
+        """
+        在 with 區塊內的 forward 將視覺編碼耗時累加到 timings['vision_encode']
+
+        Args:
+            timings: 記錄各階段耗時（秒）的 dict，None 表示不記錄
+        """
+        return _TrackTimings(self._local, timings)
+
+
+class CachedVisionEncoder:
+    """
+    以 VisionFeatureCache 快取視覺編碼器（SAM → CLIP → 投影層）的輸出
+
+    模型對每個視圖（局部裁切與全域視圖）依序呼叫 sam_model、vision_model、projector，
+    輸入的圖片 tensor 由 collate_inputs 標記 vision_key。替換這三個模組的 forward：
+    - 未命中：正常執行，並將投影層輸出複製到主記憶體寫入快取
+    - 命中：SAM 與 CLIP 只返回形狀正確的未初始化 tensor（不做任何計算），投影層直接返回快取的特徵
+    沒有標記的輸入（例如未提供圖片雜湊）一律照常執行
+    """
+
+    def __init__(self, model, cache, use_cuda=False):
+        """
+        Args:
+            model: DeepSeek-OCR 模型
+            cache: VisionFeatureCache
+            use_cuda: 模型是否在 CUDA 上
+        """
+        self.cache = cache
+        self.use_cuda = use_cuda
+        self._local = threading.local()
+
+        modules = {}
+        for name, module in model.named_modules():
+            short_name = name.rsplit('.', 1)[-1]
+            if short_name in VISION_MODULE_NAMES and short_name not in modules:
+                modules[short_name] = module
+        self.enabled = all(name in modules for name in VISION_MODULE_NAMES)
+        if not self.enabled:
+            return
+
+        self._wrap(modules['sam_model'], self._sam_forward)
+        self._wrap(modules['vision_model'], self._vision_forward)
+        self._wrap(modules['projector'], self._projector_forward)
+
+    @staticmethod
+    def _wrap(module, handler):
+        # 以實例屬性覆蓋 forward，nn.Module.__call__ 與 forward hook（VisionEncodeTimer）照常運作
+        original = module.forward
+        module.forward = lambda *args, **kwargs: handler(original, *args, **kwargs)
+
+    def _sam_forward(self, original, images, *args, **kwargs):
+        key = getattr(images, 'vision_key', None)
+        self._local.pending = None
+        if key is None:
+            return original(images, *args, **kwargs)
+
+        entry = self.cache.get(key)
+        if entry is not None:
+            self._local.pending = {'key': key, 'entry': entry}
+            return torch.empty(entry['sam_shape'], dtype=entry['sam_dtype'], device=images.device)
+
+        if self.use_cuda:
+            torch.cuda.synchronize(images.device)
+        started_at = time.perf_counter()
+        output = original(images, *args, **kwargs)
+        self._local.pending = {
+            'key': key, 'entry': None, 'started_at': started_at,
+            'sam_shape': tuple(output.shape), 'sam_dtype': output.dtype
+        }
+        return output
+
+    def _vision_forward(self, original, images, *args, **kwargs):
+        pending = getattr(self._local, 'pending', None)
+        if pending is None or pending['key'] != getattr(images, 'vision_key', None):
+            return original(images, *args, **kwargs)
+
+        entry = pending['entry']
+        if entry is not None:
+            return torch.empty(entry['vision_shape'], dtype=entry['vision_dtype'], device=images.device)
+
+        output = original(images, *args, **kwargs)
+        pending['vision_shape'] = tuple(output.shape)
+        pending['vision_dtype'] = output.dtype
+        return output
+
+    def _projector_forward(self, original, features, *args, **kwargs):
+        pending = getattr(self._local, 'pending', None)
+        self._local.pending = None
+        # 沒有對應的 SAM 呼叫，或未命中但 CLIP 沒有經過快取路徑時照常執行
+        if pending is None or (pending['entry'] is None and 'vision_shape' not in pending):
+            return original(features, *args, **kwargs)
+
+        entry = pending['entry']
+        if entry is not None:
+            return entry['features'].to(features.device, non_blocking=True)
+
+        output = original(features, *args, **kwargs)
+        if self.use_cuda:
+            torch.cuda.synchronize(output.device)
+        encode_seconds = time.perf_counter() - pending['started_at']
+        cpu_features = output.detach().to('cpu')
+        self.cache.put(pending['key'], {
+            'features': cpu_features,
+            'sam_shape': pending['sam_shape'],
+            'sam_dtype': pending['sam_dtype'],
+            'vision_shape': pending['vision_shape'],
+            'vision_dtype': pending['vision_dtype']
+        }, cpu_features.numel() * cpu_features.element_size(), encode_seconds)
+        return output
+
+
+class _TrackTimings:
+    """VisionEncodeTimer.track 使用的 context manager（以執行緒區分，並行的 generate 互不影響）"""
+
+    def __init__(self, local, timings):
+        self.local = local
+        self.timings = timings
+
+    def __enter__(self):
+        self.local.timings = self.timings
+        return self.timings
+
+    def __exit__(self, exc_type, exc, tb):
+        self.local.timings = None
+        return False
+
+
+class OCRTextStreamer(TextIteratorStreamer):
+    """逐段輸出生成文字的 streamer（不含提示詞，並移除結束標記）"""
+
+    def __init__(self, tokenizer, timeout=1.0):
+        """
+        Args:
+            tokenizer: 模型的 tokenizer
+            timeout: 每次等待新文字片段的秒數，逾時拋出 queue.Empty
+        """
+        super().__init__(tokenizer, skip_prompt=True, timeout=timeout, skip_special_tokens=False)
+
+    def on_finalized_text(self, text, stream_end=False):
+        super().on_finalized_text(text.replace(STOP_STR, ''), stream_end=stream_end)
+
+
+def iter_streamer(streamer, future, timeout):
+    """
+    逐段取出 streamer 的文字，直到生成結束或推理工作結束（包含發生例外）
+
+    Args:
+        streamer: OCRTextStreamer
+        future: 執行 generate 的 Future
+        timeout: 整體超時秒數
+
+    Yields:
+        str: 新生成的文字片段
+
+    Raises:
+        FuturesTimeoutError: 超過整體超時秒數
+    """
+    deadline = time.time() + timeout
+    while True:
+        try:
+            text = next(streamer)
+        except StopIteration:
+            return
+        except queue.Empty:
+            if future.done():
+                return
+            if time.time() > deadline:
+                raise FuturesTimeoutError()
+            continue
+        if text:
+            yield text
+
+
+def generate_ids(model, tokenizer, batch_inputs, device, max_new_tokens=DEFAULT_MAX_NEW_TOKENS,
+                 cancel_events=None, streamer=None, timings=None, repetition=None):
+    """
+    以一次 generate 呼叫處理整個批次，回傳尚未解碼的 token ids
+
+    Args:
+        model: DeepSeek-OCR 模型
+        tokenizer: 模型的 tokenizer
+        batch_inputs: prepare_inputs 產生的輸入列表
+        device: 模型所在設備
+        max_new_tokens: 最大生成 token 數，或與 batch_inputs 順序一致的每張圖片的輸出 token 預算
+        cancel_events: 與 batch_inputs 順序一致的取消旗標列表（可選）
+        streamer: 逐段接收生成文字的 streamer（僅支援單張圖片）
+        timings: 記錄各階段耗時（秒）的 dict（可選）：collate、prefill（不含 vision_encode）、token_generation
+        repetition: 與 batch_inputs 順序一致的 RepetitionDetector（可選），確認重複迴圈的圖片提前停止
+
+    Returns:
+        tuple: (generate 回傳的 token ids, 補齊後的提示詞長度)
+    """
+    pad_token_id = tokenizer.pad_token_id
+    if pad_token_id is None:
+        pad_token_id = tokenizer.eos_token_id
+
+    collate_start = time.perf_counter()
+    model_inputs = collate_inputs(batch_inputs, pad_token_id, device)
+    prompt_length = model_inputs['input_ids'].shape[1]
+    use_cuda = str(device).startswith('cuda')
+
+    stopping_criteria = StoppingCriteriaList()
+    if isinstance(max_new_tokens, (list, tuple)):
+        budgets = list(max_new_tokens)
+        max_new_tokens = max(budgets)
+        if min(budgets) < max_new_tokens:
+            stopping_criteria.append(TokenBudgetStoppingCriteria(budgets, prompt_length))
+    if cancel_events is not None:
+        stopping_criteria.append(CancelStoppingCriteria(cancel_events))
+    if repetition is not None:
+        stopping_criteria.append(RepetitionStoppingCriteria(repetition, (tokenizer.eos_token_id, pad_token_id)))
+    first_step = None
+    if timings is not None:
+        timings['collate'] = time.perf_counter() - collate_start
+        first_step = FirstStepTimer(use_cuda)
+        stopping_criteria.append(first_step)
+
+    generate_start = time.perf_counter()
+
+    with torch.autocast('cuda', dtype=torch.bfloat16, enabled=use_cuda):
+        with torch.no_grad():
+            output_ids = model.generate(
+                **model_inputs,
+                temperature=0.0,
+                eos_token_id=tokenizer.eos_token_id,
+                pad_token_id=pad_token_id,
+                max_new_tokens=max_new_tokens,
+                no_repeat_ngram_size=NO_REPEAT_NGRAM_SIZE,
+                stopping_criteria=stopping_criteria,
+                streamer=streamer,
+                use_cache=True
+            )
+
+    if timings is not None:
+        finished_at = time.perf_counter()
+        first_step_at = first_step.first_step_at or finished_at
+        prefill = first_step_at - generate_start - timings.get('vision_encode', 0.0)
+        timings['prefill'] = max(0.0, prefill)
+        timings['token_generation'] = finished_at - first_step_at
+
+    return output_ids, prompt_length
@@ -0,0 +1,240 @@
+"""
+CPU 前處理行程池
+在子行程中完成圖片解碼、縮放、裁切與 tokenize，產生可直接送入模型的輸入，
+讓 CPU 前處理與推理重疊進行；有上限的預取佇列避免前處理遠遠跑在推理前面而耗盡記憶體
+"""
+
+import multiprocessing
+import threading
+import time
+from concurrent.futures import TimeoutError as FuturesTimeoutError
+
+from replica_pool import start_without_main
+
+
+# 子行程中只載入前處理所需部分（tokenizer）的推理後端
+_worker_backend = None
+
+
+def _init_worker(backend_name, model_name, model_dir, device, backend_options, num_threads, prompt_cache):
+    """子行程初始化：建立推理後端並載入前處理所需的部分（不載入模型權重）"""
+    global _worker_backend
+
+    import torch
+    from ocr_backends import create_backend
+
+    # 每個子行程只使用少量執行緒，避免與推理行程搶用所有 CPU 核心
+    torch.set_num_threads(num_threads)
+    _worker_backend = create_backend(backend_name, model_name, model_dir, device=device, **backend_options)
+    _worker_backend.load_preprocessor()
+    if prompt_cache is not None:
+        hot_prompts, max_items = prompt_cache
+        _worker_backend.enable_prompt_cache(hot_prompts, max_items)
+
+
+def _ping():
+    return True
+
+
+def _prepare(image, prompt, base_size, image_size, crop_mode, adaptive_max_preset=None, image_key=None,
+             estimate_density=False, precheck=None):
+    """
+    在子行程中解碼圖片並產生模型輸入
+
+    Args:
+        adaptive_max_preset: 不為 None 時依圖片內容選擇解析度設定（不超過此預設組合）
+        image_key: 圖片內容雜湊（視覺編碼結果快取使用）
+        estimate_density: 是否估計文字密度（輸出 token 預算使用）
+        precheck: 可讀性預檢門檻（check_readability 的參數），None 表示不檢查
+
+    Returns:
+        tuple: (模型輸入, 圖片尺寸, {'image_decode': 秒, 'preprocess': 秒, ...}, 圖片分析結果)
+            圖片分析結果: {'resolution': 解析度設定或 None, 'text_density': 文字密度或 None,
+                           'quality': 可讀性指標或 None, 'unreadable': 無法辨識的原因或 None}；
+            無法辨識的圖片不產生模型輸入（為 None）
+    """
+    from ocr_inference import load_image
+    from image_analysis import select_resolution, estimate_text_density, assess_image_quality, check_readability
+
+    timings = {}
+    stage_start = time.perf_counter()
+    pil_image = load_image(image)
+    timings['image_decode'] = time.perf_counter() - stage_start
+
+    analysis = {'resolution': None, 'text_density': None, 'quality': None, 'unreadable': None}
+    if precheck is not None:
+        stage_start = time.perf_counter()
+        analysis['quality'] = assess_image_quality(pil_image)
+        analysis['unreadable'] = check_readability(analysis['quality'], **precheck)
+        timings['precheck'] = time.perf_counter() - stage_start
+        if analysis['unreadable'] is not None:
+            return None, pil_image.size, timings, analysis
+        if analysis['quality'] is not None:
+            analysis['text_density'] = analysis['quality']['edge_density']
+
+    if adaptive_max_preset is not None:
+        stage_start = time.perf_counter()
+        resolution = select_resolution(pil_image, adaptive_max_preset, density=analysis['text_density'])
+        base_size, image_size, crop_mode = resolution['base_size'], resolution['image_size'], resolution['crop_mode']
+        analysis['resolution'] = resolution
+        analysis['text_density'] = resolution['text_density']
+        timings['image_analysis'] = time.perf_counter() - stage_start
+    elif estimate_density and analysis['text_density'] is None:
+        stage_start = time.perf_counter()
+        analysis['text_density'] = round(estimate_text_density(pil_image), 4)
+        timings['image_analysis'] = time.perf_counter() - stage_start
+
+    stage_start = time.perf_counter()
+    inputs = _worker_backend.preprocess(
+        pil_image,
+        prompt,
+        base_size=base_size,
+        image_size=image_size,
+        crop_mode=crop_mode,
+        image_key=image_key
+    )
+    timings['preprocess'] = time.perf_counter() - stage_start
+    return inputs, pil_image.size, timings, analysis
+
+
+class PrefetchedInput:
+    """
+    預取佇列中的一筆前處理結果
+
+    在推理開始（或請求放棄）時呼叫 release()，讓出預取佇列的位置
+    """
+
+    def __init__(self, pool, async_result):
+        self._pool = pool
+        self._async_result = async_result
+        self._released = False
+
+    def result(self, timeout=None):
+        """
+        等待前處理完成
+
+        Args:
+            timeout: 最長等待秒數
+
+        Returns:
+            tuple: (模型輸入, 圖片尺寸, 子行程中各階段耗時, 圖片分析結果（見 _prepare）)
+
+        Raises:
+            FuturesTimeoutError: 超過等待時間
+        """
+        try:
+            return self._async_result.get(timeout)
+        except multiprocessing.TimeoutError:
+            raise FuturesTimeoutError()
+
+    def release(self):
+        """讓出預取佇列的位置（可重複呼叫）"""
+        with self._pool._lock:
+            if self._released:
+                return
+            self._released = True
+            self._pool._in_prefetch -= 1
+        self._pool._slots.release()
+
+
+class PreprocessPool:
+    """CPU 前處理行程池與有上限的預取佇列"""
+
+    def __init__(self, backend_name, model_name, model_dir, device=None, backend_options=None,
+                 num_workers=2, prefetch_depth=8, start_timeout=120, prompt_cache=None):
+        """
+        啟動前處理子行程（等待第一個子行程載入 tokenizer）
+
+        Args:
+            backend_name: 推理後端名稱（決定前處理方式）
+            model_name: 模型名稱
+            model_dir: 模型本地目錄（載入 tokenizer）
+            device: 推理設備（決定圖片 tensor 的 dtype）
+            backend_options: 推理後端的額外參數
+            num_workers: 前處理子行程數
+            prefetch_depth: 預取佇列上限（前處理中與已完成但尚未開始推理的圖片總數）
+            start_timeout: 等待子行程初始化的最長秒數
+            prompt_cache: (常用提示詞列表, 其他提示詞最多保留數)，None 表示不啟用提示詞 tokenize 結果快取
+        """
+        self.num_workers = max(1, int(num_workers))
+        self.prefetch_depth = max(1, int(prefetch_depth))
+        self._slots = threading.BoundedSemaphore(self.prefetch_depth)
+        self._lock = threading.Lock()
+        self._in_prefetch = 0
+        self._submitted = 0
+
+        context = multiprocessing.get_context('spawn')
+        initargs = (backend_name, model_name, model_dir, device, dict(backend_options or {}), 1, prompt_cache)
+        self._pool = start_without_main(
+            lambda: context.Pool(self.num_workers, initializer=_init_worker, initargs=initargs)
+        )
+
+        # 子行程初始化失敗時 Pool 會不斷重啟子行程，因此以一次簡單呼叫確認可用
+        try:
+            self._pool.apply_async(_ping).get(start_timeout)
+        except multiprocessing.TimeoutError:
+            self._pool.terminate()
+            raise RuntimeError(f"前處理子行程未在 {start_timeout} 秒內完成初始化")
+
+        print(f"前處理行程池已啟動: workers={self.num_workers}, prefetch_depth={self.prefetch_depth}")
+
+    def submit(self, image, prompt, base_size, image_size, crop_mode, timeout=None, adaptive_max_preset=None,
+               image_key=None, estimate_density=False, precheck=None):
+        """
+        送出前處理工作；預取佇列已滿時等待推理消化
+
+        Args:
+            image: 圖片來源（檔案路徑、圖片位元組或 PIL 圖片）
+            prompt: 提示詞
+            base_size: 圖片預處理基準尺寸
+            image_size: 模型輸入圖片尺寸
+            crop_mode: 是否啟用裁切模式
+            timeout: 等待預取佇列空位的最長秒數
+            adaptive_max_preset: 不為 None 時依圖片內容選擇解析度設定（不超過此預設組合）
+            image_key: 圖片內容雜湊（視覺編碼結果快取使用）
+            estimate_density: 是否估計文字密度（輸出 token 預算使用）
+            precheck: 可讀性預檢門檻，None 表示不檢查
+
+        Returns:
+            PrefetchedInput: 前處理結果
+
+        Raises:
+            FuturesTimeoutError: 等待空位超時
+        """
+        if not self._slots.acquire(timeout=timeout):
+            raise FuturesTimeoutError()
+        with self._lock:
+            self._in_prefetch += 1
+            self._submitted += 1
+
+        try:
+            async_result = self._pool.apply_async(
+                _prepare,
+                (image, prompt, base_size, image_size, crop_mode, adaptive_max_preset, image_key, estimate_density,
+                 precheck)
+            )
+        except Exception:
+            with self._lock:
+                self._in_prefetch -= 1
+            self._slots.release()
+            raise
+        return PrefetchedInput(self, async_result)
+
+    def get_stats(self):
+        """
+        取得前處理行程池統計
+
+        Returns:
+            dict: 子行程數、預取佇列上限與目前深度
+        """
+        with self._lock:
+            return {
+                'workers': self.num_workers,
+                'prefetch_depth': self.prefetch_depth,
+                'in_prefetch': self._in_prefetch,
+                'submitted': self._submitted
+            }
+
+    def shutdown(self):
+        """停止所有前處理子行程"""
+        self._pool.terminate()
@@ -0,0 +1,261 @@
+"""
+OCR 輸出的重複迴圈偵測
+模型退化時會不斷重複同一段詞組或同一行直到生成上限。
+
+- truncate_repetition（後處理）：以 token 的 n-gram 滾動雜湊記錄每個 n-gram 上一次出現的位置，
+  連續多個位置與上一次出現的距離相同時即為以該距離為週期的重複，整段文字只掃描一次（線性時間），在第一個迴圈處截斷。
+  同一個標點符號連續出現（表單底線、目錄點線、分隔線）視為一個 token，重複單位至少要有一個文字 token，
+  只由標點與 HTML 標籤組成的重複（空白儲存格、表格分隔列）是文件格式而不是迴圈
+- RepetitionDetector（生成中）：逐 token 檢查最近的滑動視窗是否逐字週期重複，確認迴圈後立即停止該圖片的生成。
+  與後處理相同，重複單位必須包含文字 token，表格標籤（<td>、</td> 等）的重複不算迴圈。
+  只有逐字重複才停止：表格等正常內容常有近似重複的列，誤判會讓該頁之後的內容全部遺失；
+  generate 的 no_repeat_ngram_size 讓模型無法逐字重複長片段，只改變編號的近似迴圈由輸出 token 預算限制
+"""
+
+import re
+from collections import deque
+
+
+# token：HTML 標籤、一個 CJK 字元、連續的英數字、單一標點符號；換行也是 token，讓整行重複可以被偵測
+TOKEN_PATTERN = re.compile(
+    r'\n+|<[^<>\n]{1,32}>|[぀-ヿ㐀-鿿가-힯豈-﫿]|[^\W_]+|[^\w\s]|_'
+)
+
+# 文字 token（英數字或 CJK 字元）；不符合的是標點、換行與 HTML 標籤
+CONTENT_PATTERN = re.compile(r'[^\W_]')
+
+# HTML 標籤（判斷生成中的 token 是否為文字時先去掉）
+TAG_PATTERN = re.compile(r'</?[A-Za-z][^<>]*>')
+
+# 單一標點符號 token（連續相同的只保留第一個）
+PUNCTUATION_PATTERN = re.compile(r'[^\w\s]|_')
+
+# 計算滾動雜湊的 n-gram 長度（token 數）
+NGRAM_SIZE = 8
+
+# 重複單位至少出現的次數
+MIN_REPEATS = 4
+
+# 重複的部分至少涵蓋的 token 數（避免把表格的空白儲存格、分隔線等短重複當成迴圈）
+MIN_SPAN = 48
+
+_MOD = (1 << 61) - 1
+_BASE = 1000003
+
+
+def find_loop(tokens, ngram_size=NGRAM_SIZE, min_repeats=MIN_REPEATS, min_span=MIN_SPAN):
+    """
+    找出第一個重複迴圈
+
+    n-gram 在位置 i 與 i - p 相同且連續成立時，從 i - p 開始的文字以 p 為週期重複；
+    週期部分涵蓋 max(min_repeats * p, min_span) 個 token，且重複單位包含文字 token 時視為迴圈
+    （雜湊相同時再比對 token 確認）。token 逐一讀取，找到迴圈後不再讀取之後的 token
+
+    Args:
+        tokens: token 的可迭代物件
+        ngram_size: 滾動雜湊的 n-gram 長度
+        min_repeats: 重複單位至少出現的次數
+        min_span: 重複的部分至少涵蓋的 token 數
+
+    Returns:
+        tuple: (第二次出現的起始 token 索引, 週期 token 數)，沒有迴圈時為 None
+    """
+    ids = {}
+    content_codes = set()
+    codes = []
+    power = pow(_BASE, ngram_size - 1, _MOD)
+    last_seen = {}
+    run_period = 0
+    run_start = 0
+    h = 0
+    for token in tokens:
+        code = ids.get(token)
+        if code is None:
+            code = ids[token] = len(ids) + 1
+            if CONTENT_PATTERN.match(token):
+                content_codes.add(code)
+        codes.append(code)
+        end = len(codes)
+        if end <= ngram_size:
+            h = (h * _BASE + code) % _MOD
+            if end < ngram_size:
+                continue
+        else:
+            h = ((h - codes[end - ngram_size - 1] * power) * _BASE + code) % _MOD
+
+        # 以 tokens[i : end] 這個 n-gram 與它上一次出現的距離作為候選週期
+        i = end - ngram_size
+        previous = last_seen.get(h)
+        last_seen[h] = i
+        period = i - previous if previous is not None else 0
+
+        if period and period == run_period:
+            # 週期部分為 tokens[run_start - period : end]
+            span = end - (run_start - period)
+            if span >= min_repeats * period and span >= min_span:
+                # 只由標點與標籤組成的重複單位是文件格式，繼續往後找
+                if (codes[run_start - period:end - period] == codes[run_start:end]
+                        and not content_codes.isdisjoint(codes[run_start:run_start + period])):
+                    return run_start, period
+                run_period = 0
+        else:
+            run_period = period
+            run_start = i
+    return None
+
+
+def is_content_text(text):
+    """
+    判斷生成的 token 文字是否包含文字內容（去掉 HTML 標籤後還有英數字或 CJK 字元）
+
+    Args:
+        text: token 解碼後的文字
+
+    Returns:
+        bool: 是否為文字 token
+    """
+    return CONTENT_PATTERN.search(TAG_PATTERN.sub('', text)) is not None
+
+
+def truncate_repetition(text, ngram_size=NGRAM_SIZE, min_repeats=MIN_REPEATS, min_span=MIN_SPAN):
+    """
+    在第一個重複迴圈處截斷文字（保留重複單位的第一次出現）
+
+    連續相同的標點符號 token 合併為一個後才搜尋，表單底線、目錄點線與分隔線不會被當成迴圈
+
+    Args:
+        text: OCR 輸出文字
+        ngram_size: 滾動雜湊的 n-gram 長度
+        min_repeats: 重複單位至少出現的次數
+        min_span: 重複的部分至少涵蓋的 token 數
+
+    Returns:
+        tuple: (截斷後的文字, 迴圈資訊 dict 或 None)
+            迴圈資訊: {'offset': 截斷位置（字元）, 'period': 重複單位的 token 數, 'unit': 'line' 或 'ngram'}
+    """
+    if not text:
+        return text, None
+    tokens = []
+    offsets = []
+
+    def _scan():
+        for match in TOKEN_PATTERN.finditer(text):
+            token = match.group()
+            if tokens and token == tokens[-1] and PUNCTUATION_PATTERN.fullmatch(token):
+                continue
+            tokens.append(token)
+            offsets.append(match.start())
+            yield token
+
+    loop = find_loop(_scan(), ngram_size=ngram_size, min_repeats=min_repeats, min_span=min_span)
+    if loop is None:
+        return text, None
+
+    start, period = loop
+    unit = 'line' if any(token.startswith('\n') for token in tokens[start:start + period]) else 'ngram'
+    offset = offsets[start]
+    return text[:offset].rstrip(), {'offset': offset, 'period': period, 'unit': unit}
+
+
+class RepetitionDetector:
+    """
+    生成中的重複迴圈偵測（一個批次一個實例，由推理後端在每個生成步驟餵入新 token）
+
+    對每個週期 p（1 到 window_size - ngram_size）記錄目前連續多少個 token 與 p 個 token 之前完全相同；
+    連續相同的長度達到 max(ngram_size, window_size - p)，即最近的視窗逐字以 p 為週期重複
+    （至少 ngram_size 個 token 的片段在視窗內完全重複出現），並且重複單位包含文字 token 時確認迴圈。
+    每個步驟的成本與視窗大小成正比，與已生成的長度無關
+    """
+
+    def __init__(self, batch_size, ngram_size=30, window_size=90, is_content=None):
+        """
+        Args:
+            batch_size: 批次中的圖片數
+            ngram_size: 比較的最短長度（token 數），對應 Config.OCR_NGRAM_SIZE
+            window_size: 滑動視窗大小（token 數），對應 Config.OCR_WINDOW_SIZE
+            is_content: 判斷 token 是否為文字 token 的函式（例如以 tokenizer 解碼 token id），
+                        預設將 token 視為文字並以 is_content_text 判斷
+        """
+        if window_size <= ngram_size:
+            raise ValueError(f"window_size ({window_size}) 必須大於 ngram_size ({ngram_size})")
+        self.ngram_size = ngram_size
+        self.window_size = window_size
+        self.max_period = window_size - ngram_size
+        self.generated = [0] * batch_size
+        # 確認迴圈時已生成的 token 數，未偵測到迴圈時為 None
+        self.stopped_at = [None] * batch_size
+        self._is_content = is_content or (lambda token: is_content_text(str(token)))
+        self._content_cache = {}
+        self._finished = [False] * batch_size
+        self._history = [deque(maxlen=window_size) for _ in range(batch_size)]
+        # 每個週期目前連續與 p 個 token 之前相同的長度
+        self._runs = [[0] * (self.max_period + 1) for _ in range(batch_size)]
+        # 最近一個文字 token 的位置（已生成的 token 數），用來判斷重複單位是否包含文字
+        self._last_content = [None] * batch_size
+        self._required = [max(ngram_size, window_size - period) for period in range(self.max_period + 1)]
+
+    def _content(self, token):
+        content = self._content_cache.get(token)
+        if content is None:
+            content = self._content_cache[token] = bool(self._is_content(token))
+        return content
+
+    def update(self, index, token):
+        """
+        餵入一張圖片新生成的 token
+
+        Args:
+            index: 圖片在批次中的位置
+            token: 新生成的 token（可比較相等的任意值，例如 token id 或文字）
+
+        Returns:
+            bool: 這張圖片是否已確認迴圈（確認後不再處理之後的 token）
+        """
+        if self.stopped_at[index] is not None:
+            return True
+        if self._finished[index]:
+            return False
+        self.generated[index] += 1
+        generated = self.generated[index]
+        if self._content(token):
+            self._last_content[index] = generated
+        history = self._history[index]
+        runs = self._runs[index]
+        last_content = self._last_content[index]
+        looping = False
+        for period in range(1, min(self.max_period, len(history)) + 1):
+            if history[-period] == token:
+                runs[period] += 1
+                # 重複單位（最近 period 個 token）必須包含文字 token
+                if (runs[period] >= self._required[period]
+                        and last_content is not None and generated - last_content < period):
+                    looping = True
+            else:
+                runs[period] = 0
+        history.append(token)
+        if looping:
+            self.stopped_at[index] = generated
+            return True
+        return False
+
+    def finish(self, index):
+        """標記一張圖片已結束生成（EOS 或取消），之後的 padding token 不再檢查"""
+        self._finished[index] = True
+
+    def step(self, tokens, finished=None):
+        """
+        餵入整個批次這一步生成的 token
+
+        Args:
+            tokens: 與批次順序一致的新 token
+            finished: 與批次順序一致的是否已結束（EOS 或取消後的 padding），可選
+
+        Returns:
+            list: 與批次順序一致的是否已確認迴圈
+        """
+        results = []
+        for index, token in enumerate(tokens):
+            if finished is not None and finished[index]:
+                self.finish(index)
+            results.append(self.update(index, token))
+        return results
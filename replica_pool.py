@@ -0,0 +1,736 @@
+"""
+多副本推理池
+每個設備（GPU 或 CPU 核心群組）啟動一個載入模型的子行程，
+路由器將請求分派給目前處理中請求數最少的健康副本，並持續追蹤各副本的健康狀態
+"""
+
+import importlib
+import importlib.machinery
+import inspect
+import itertools
+import multiprocessing
+import os
+import queue
+import sys
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FuturesTimeoutError, wait, FIRST_COMPLETED
+from metrics import add_labels, family
+
+
+def resolve_devices(spec, cpu_replicas=1):
+    """
+    解析設備設定
+
+    Args:
+        spec: 以逗號分隔的設備列表（例如 "cuda:0,cuda:1" 或 "cpu,cpu"），
+              "auto" 表示每張 GPU 一個副本（沒有 GPU 時使用 cpu_replicas 個 CPU 副本）
+        cpu_replicas: 沒有 GPU 時的 CPU 副本數
+
+    Returns:
+        list: 設備名稱列表
+    """
+    spec = (spec or '').strip()
+    if spec.lower() != 'auto':
+        return [device.strip() for device in spec.split(',') if device.strip()]
+
+    import torch
+    if torch.cuda.is_available():
+        return [f"cuda:{index}" for index in range(torch.cuda.device_count())]
+    return ['cpu'] * max(1, int(cpu_replicas))
+
+
+def start_without_main(start):
+    """
+    以 spawn 啟動子行程，但不讓子行程重新執行主模組
+
+    spawn 模式預設會在子行程中重新匯入主模組（app.py 在匯入時就會建立服務），
+    暫時將主模組標記為 "__main__" 可讓子行程略過這一步，只匯入目標函數所在的模組
+
+    Args:
+        start: 啟動子行程的函數（例如 process.start）
+
+    Returns:
+        start 的回傳值
+    """
+    main_module = sys.modules['__main__']
+    original_spec = getattr(main_module, '__spec__', None)
+    main_module.__spec__ = importlib.machinery.ModuleSpec('__main__', None)
+    try:
+        return start()
+    finally:
+        main_module.__spec__ = original_spec
+
+
+def _split_cpu_cores(devices):
+    """將可用的 CPU 核心平均分配給各 CPU 副本，避免彼此搶用同一批核心"""
+    if hasattr(os, 'sched_getaffinity'):
+        cores = sorted(os.sched_getaffinity(0))
+    else:
+        cores = list(range(os.cpu_count() or 1))
+
+    cpu_replica_ids = [idx for idx, device in enumerate(devices) if device.startswith('cpu')]
+    assignments = {}
+    if not cpu_replica_ids:
+        return assignments
+
+    per_replica = max(1, len(cores) // len(cpu_replica_ids))
+    for slot, replica_id in enumerate(cpu_replica_ids):
+        start = (slot * per_replica) % len(cores)
+        assignments[replica_id] = cores[start:start + per_replica] or cores
+    return assignments
+
+
+def _replica_main(replica_id, device, cpu_cores, service_module, service_kwargs, concurrency,
+                  request_queue, response_queue, warmup=False, warmup_shapes=None):
+    """
+    副本子行程的進入點：載入模型（並暖機）後持續處理請求
+
+    GPU 副本以 CUDA_VISIBLE_DEVICES 只看見指定的 GPU（在子行程中為 cuda:0），
+    CPU 副本則隱藏所有 GPU，並綁定分配到的 CPU 核心
+    """
+    if device.startswith('cuda'):
+        os.environ['CUDA_VISIBLE_DEVICES'] = device.split(':', 1)[1] if ':' in device else '0'
+        local_device = 'cuda:0'
+    else:
+        os.environ['CUDA_VISIBLE_DEVICES'] = ''
+        local_device = 'cpu'
+        if cpu_cores and hasattr(os, 'sched_setaffinity'):
+            os.sched_setaffinity(0, cpu_cores)
+
+    try:
+        if local_device == 'cpu' and cpu_cores:
+            import torch
+            torch.set_num_threads(len(cpu_cores))
+        module = importlib.import_module(service_module)
+        service = module.DeepSeekOCRService(device=local_device, **service_kwargs)
+        # 暖機完成才回報就緒，重新啟動的副本也不會讓第一個請求承擔暖機延遲
+        if warmup:
+            service.warm_up(warmup_shapes)
+    except Exception as e:
+        response_queue.put(('failed', None, f"{type(e).__name__}: {e}"))
+        return
+
+    response_queue.put(('ready', None, os.getpid()))
+
+    executor = ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix=f"replica-{replica_id}")
+    stream_cancels = {}
+    stream_lock = threading.Lock()
+
+    def _handle(request_id, method, args, kwargs):
+        try:
+            result = getattr(service, method)(*args, **kwargs)
+            if inspect.isgenerator(result):
+                cancel_event = threading.Event()
+                with stream_lock:
+                    stream_cancels[request_id] = cancel_event
+                try:
+                    for event in result:
+                        if cancel_event.is_set():
+                            # 關閉產生器會讓服務通知 generate 停止
+                            result.close()
+                            break
+                        response_queue.put(('event', request_id, event))
+                finally:
+                    with stream_lock:
+                        stream_cancels.pop(request_id, None)
+                response_queue.put(('end', request_id, None))
+            else:
+                response_queue.put(('ok', request_id, result))
+        except FuturesTimeoutError:
+            response_queue.put(('timeout', request_id, None))
+        except Exception as e:
+            response_queue.put(('error', request_id, f"{type(e).__name__}: {e}"))
+
+    while True:
+        message = request_queue.get()
+        if message is None:
+            break
+
+        kind = message[0]
+        if kind == 'ping':
+            # 直接在接收迴圈中回應，忙碌中的副本也能回報存活
+            response_queue.put(('pong', None, time.time()))
+        elif kind == 'stats':
+            # 統計查詢不經過執行器，不會排在推理請求後面，也不計入處理中請求數
+            _, request_id, method = message
+            try:
+                response_queue.put(('stats', request_id, (True, getattr(service, method)())))
+            except Exception as e:
+                response_queue.put(('stats', request_id, (False, f"{type(e).__name__}: {e}")))
+        elif kind == 'cancel':
+            with stream_lock:
+                cancel_event = stream_cancels.get(message[1])
+            if cancel_event is not None:
+                cancel_event.set()
+        elif kind == 'call':
+            _, request_id, method, args, kwargs = message
+            executor.submit(_handle, request_id, method, args, kwargs)
+
+    executor.shutdown(wait=False)
+    service.shutdown()
+
+
+class _Replica:
+    """父行程中代表一個副本的狀態（行程、佇列、處理中請求與統計）"""
+
+    def __init__(self, replica_id, device, cpu_cores):
+        self.replica_id = replica_id
+        self.device = device
+        self.cpu_cores = cpu_cores
+        self.process = None
+        self.request_queue = None
+        self.response_queue = None
+        self.listener = None
+        self.state = 'starting'
+        self.pid = None
+        self.in_flight = {}
+        self.completed = 0
+        self.failed = 0
+        self.restarts = 0
+        self.total_latency = 0.0
+        self.last_pong = 0.0
+        self.last_error = None
+        self.ready_event = threading.Event()
+
+    def get_stats(self):
+        """取得副本統計資訊（呼叫端需持有路由器的鎖）"""
+        finished = self.completed + self.failed
+        return {
+            'replica_id': self.replica_id,
+            'device': self.device,
+            'pid': self.pid,
+            'state': self.state,
+            'in_flight': len(self.in_flight),
+            'completed': self.completed,
+            'failed': self.failed,
+            'restarts': self.restarts,
+            'avg_latency_ms': round(self.total_latency / finished * 1000, 1) if finished else 0,
+            'last_heartbeat_age_s': round(time.time() - self.last_pong, 1) if self.last_pong else None,
+            'last_error': self.last_error
+        }
+
+
+class ReplicaPool:
+    """
+    模型副本池與路由器
+
+    提供與 DeepSeekOCRService 相同的 perform_ocr / stream_ocr / iter_batch_ocr / perform_batch_ocr 介面，
+    Flask 應用可以直接替換使用
+    """
+
+    def __init__(self, service_module, service_kwargs, devices, concurrency_per_replica=1,
+                 ocr_timeout=300, health_interval=5.0, start_timeout=900, auto_restart=True, warmup=False,
+                 warmup_shapes=None):
+        """
+        初始化並啟動所有副本（等待至少一個副本載入完成）
+
+        Args:
+            service_module: 提供 DeepSeekOCRService 的服務模組名稱（例如 "ocr_core"）
+            service_kwargs: 傳給 DeepSeekOCRService 的參數（不含 device）
+            devices: 設備列表，每個設備啟動一個副本
+            concurrency_per_replica: 每個副本同時處理的請求數
+            ocr_timeout: OCR 處理超時秒數
+            health_interval: 健康檢查間隔秒數
+            start_timeout: 等待副本載入模型的最長秒數
+            auto_restart: 副本行程意外結束時是否自動重啟
+            warmup: 副本載入模型後是否先執行暖機推理再回報就緒
+            warmup_shapes: 暖機使用的輸入尺寸列表（見 DeepSeekOCRService.warm_up）
+        """
+        if not devices:
+            raise ValueError("至少需要一個設備")
+
+        self.service_module = service_module
+        self.service_kwargs = dict(service_kwargs)
+        self.concurrency_per_replica = max(1, int(concurrency_per_replica))
+        self.ocr_timeout = ocr_timeout
+        self.health_interval = health_interval
+        self.auto_restart = auto_restart
+        self.warmup = warmup
+        self.warmup_shapes = warmup_shapes
+        self.batch_window = self.concurrency_per_replica * len(devices)
+
+        self._context = multiprocessing.get_context('spawn')
+        self._lock = threading.Lock()
+        self._request_ids = itertools.count()
+        self._streams = {}
+        self._stats_calls = {}
+        self._running = True
+
+        cpu_assignments = _split_cpu_cores(devices)
+        # CPU 副本共用主記憶體，自動計算的記憶體預算依 CPU 副本數平分
+        cpu_replicas = sum(1 for device in devices if device.startswith('cpu'))
+        self.cpu_memory_share = 1.0 / cpu_replicas if cpu_replicas else 1.0
+        self.replicas = [
+            _Replica(idx, device, cpu_assignments.get(idx)) for idx, device in enumerate(devices)
+        ]
+        for replica in self.replicas:
+            self._start_replica(replica)
+
+        # 串流批次請求使用的常駐執行器
+        self.batch_request_executor = ThreadPoolExecutor(
+            max_workers=self.batch_window,
+            thread_name_prefix='replica-batch-request'
+        )
+
+        deadline = time.time() + start_timeout
+        for replica in self.replicas:
+            replica.ready_event.wait(max(0, deadline - time.time()))
+
+        ready = [r for r in self.replicas if r.state == 'healthy']
+        print(f"副本池已啟動: {len(ready)}/{len(self.replicas)} 個副本可用 ({', '.join(devices)})")
+        if not ready:
+            self.shutdown()
+            raise RuntimeError("沒有任何副本成功載入模型")
+
+        self._monitor = threading.Thread(target=self._monitor_loop, name='replica-monitor', daemon=True)
+        self._monitor.start()
+
+    def _replica_kwargs(self, replica):
+        """傳給副本 DeepSeekOCRService 的參數（CPU 副本加上主記憶體預算比例）"""
+        if not replica.device.startswith('cpu') or self.cpu_memory_share >= 1.0:
+            return self.service_kwargs
+        return dict(self.service_kwargs, memory_budget_share=self.cpu_memory_share)
+
+    def _start_replica(self, replica):
+        """啟動（或重新啟動）副本子行程與對應的回應監聽執行緒"""
+        replica.request_queue = self._context.Queue()
+        replica.response_queue = self._context.Queue()
+        replica.state = 'starting'
+        replica.ready_event = threading.Event()
+        replica.process = self._context.Process(
+            target=_replica_main,
+            args=(
+                replica.replica_id, replica.device, replica.cpu_cores, self.service_module,
+                self._replica_kwargs(replica), self.concurrency_per_replica,
+                replica.request_queue, replica.response_queue, self.warmup, self.warmup_shapes
+            ),
+            name=f"ocr-replica-{replica.replica_id}",
+            daemon=True
+        )
+        start_without_main(replica.process.start)
+        print(f"已啟動副本 {replica.replica_id} ({replica.device})，PID: {replica.process.pid}")
+
+        replica.listener = threading.Thread(
+            target=self._listen,
+            args=(replica, replica.response_queue),
+            name=f"replica-listener-{replica.replica_id}",
+            daemon=True
+        )
+        replica.listener.start()
+
+    def _listen(self, replica, response_queue):
+        """接收副本回應並完成對應的 Future 或串流"""
+        while self._running:
+            try:
+                kind, request_id, payload = response_queue.get(timeout=1.0)
+            except queue.Empty:
+                if replica.response_queue is not response_queue:
+                    return  # 副本已重新啟動，由新的監聽執行緒接手
+                continue
+            except (EOFError, OSError):
+                return
+
+            if kind == 'ready':
+                with self._lock:
+                    replica.state = 'healthy'
+                    replica.pid = payload
+                    replica.last_pong = time.time()
+                replica.ready_event.set()
+                print(f"副本 {replica.replica_id} ({replica.device}) 模型載入完成")
+                continue
+            if kind == 'failed':
+                with self._lock:
+                    replica.state = 'failed'
+                    replica.last_error = payload
+                replica.ready_event.set()
+                print(f"副本 {replica.replica_id} ({replica.device}) 載入失敗: {payload}")
+                continue
+            if kind == 'pong':
+                with self._lock:
+                    replica.last_pong = time.time()
+                continue
+            if kind == 'event':
+                stream_queue = self._streams.get(request_id)
+                if stream_queue is not None:
+                    stream_queue.put(payload)
+                continue
+            if kind == 'stats':
+                future = self._stats_calls.pop(request_id, None)
+                if future is not None:
+                    ok, result = payload
+                    if ok:
+                        future.set_result(result)
+                    else:
+                        future.set_exception(RuntimeError(result))
+                continue
+
+            with self._lock:
+                entry = replica.in_flight.pop(request_id, None)
+                if entry is None:
+                    continue
+                future, started_at = entry
+                replica.total_latency += time.time() - started_at
+                if kind in ('ok', 'end'):
+                    replica.completed += 1
+                else:
+                    replica.failed += 1
+                    replica.last_error = payload or kind
+
+            stream_queue = self._streams.get(request_id)
+            if stream_queue is not None:
+                if kind != 'end':
+                    stream_queue.put({'event': 'error', 'error': f"副本 {replica.replica_id} 執行錯誤: {payload or kind}"})
+                stream_queue.put(None)
+
+            if kind == 'end':
+                future.set_result(None)
+            elif kind == 'ok':
+                future.set_result(payload)
+            elif kind == 'timeout':
+                future.set_exception(FuturesTimeoutError())
+            else:
+                future.set_exception(RuntimeError(f"副本 {replica.replica_id} 執行錯誤: {payload}"))
+
+    def _monitor_loop(self):
+        """定期送出心跳並檢查副本行程，失效時讓處理中的請求失敗並自動重啟"""
+        while self._running:
+            time.sleep(self.health_interval)
+            for replica in self.replicas:
+                if replica.state == 'failed' or replica.process is None:
+                    continue
+
+                if not replica.process.is_alive():
+                    self._handle_replica_exit(replica)
+                    continue
+
+                try:
+                    replica.request_queue.put(('ping',))
+                except (OSError, ValueError):
+                    continue
+
+                with self._lock:
+                    stale = replica.last_pong and time.time() - replica.last_pong > 3 * self.health_interval
+                    if replica.state == 'healthy' and stale:
+                        replica.state = 'unhealthy'
+                        print(f"副本 {replica.replica_id} 心跳逾時，暫停分派新請求")
+                    elif replica.state == 'unhealthy' and not stale:
+                        replica.state = 'healthy'
+                        print(f"副本 {replica.replica_id} 已恢復")
+
+    def _handle_replica_exit(self, replica):
+        """處理副本行程意外結束"""
+        exit_code = replica.process.exitcode
+        with self._lock:
+            orphaned = list(replica.in_flight.items())
+            replica.in_flight.clear()
+            replica.failed += len(orphaned)
+            replica.state = 'unhealthy'
+            replica.last_error = f"行程已結束 (exit code: {exit_code})"
+
+        print(f"副本 {replica.replica_id} ({replica.device}) 行程已結束 (exit code: {exit_code})")
+        for request_id, (future, _) in orphaned:
+            stream_queue = self._streams.get(request_id)
+            if stream_queue is not None:
+                stream_queue.put({'event': 'error', 'error': f"副本 {replica.replica_id} 已停止"})
+                stream_queue.put(None)
+            if not future.done():
+                future.set_exception(RuntimeError(f"副本 {replica.replica_id} 已停止"))
+
+        if self.auto_restart and self._running:
+            replica.restarts += 1
+            self._start_replica(replica)
+
+    def _pick_replica(self):
+        """選擇處理中請求數最少的健康副本（呼叫端需持有鎖）"""
+        healthy = [r for r in self.replicas if r.state == 'healthy']
+        if not healthy:
+            raise RuntimeError("目前沒有可用的副本")
+        return min(healthy, key=lambda r: (len(r.in_flight), r.completed + r.failed))
+
+    def submit(self, method, *args, **kwargs):
+        """
+        將服務方法呼叫分派給最空閒的副本
+
+        Args:
+            method: DeepSeekOCRService 的方法名稱
+            *args, **kwargs: 方法參數（必須可 pickle）
+
+        Returns:
+            tuple: (副本, request_id, Future)
+        """
+        future = Future()
+        request_id = next(self._request_ids)
+        with self._lock:
+            replica = self._pick_replica()
+            replica.in_flight[request_id] = (future, time.time())
+        replica.request_queue.put(('call', request_id, method, args, kwargs))
+        return replica, request_id, future
+
+    def perform_ocr(self, image, custom_prompt=None, image_name=None, include_timings=False, max_tokens=None):
+        """
+        對單張圖片執行 OCR 辨識（由最空閒的副本處理）
+
+        Args:
+            image: 圖片來源，可以是檔案路徑、圖片位元組或 PIL 圖片
+            custom_prompt: 自訂提示詞
+            image_name: 回應中顯示的圖片名稱
+            include_timings: 是否在結果中附上各階段耗時
+            max_tokens: 輸出 token 上限，None 表示依圖片估計
+
+        Returns:
+            dict: OCR 辨識結果（另含處理的副本 ID）
+        """
+        replica, _, future = self.submit(
+            'perform_ocr', image, custom_prompt, image_name=image_name, include_timings=include_timings,
+            max_tokens=max_tokens
+        )
+        # 副本內部已有推理超時，這裡多保留一些時間給行程間傳輸
+        result = future.result(timeout=self.ocr_timeout + 30)
+        if isinstance(result, dict):
+            result['replica_id'] = replica.replica_id
+        return result
+
+    def stream_ocr(self, image, custom_prompt=None, image_name=None, max_tokens=None):
+        """
+        串流執行 OCR 辨識，事件格式與 DeepSeekOCRService.stream_ocr 相同
+
+        Yields:
+            dict: 串流事件
+        """
+        stream_queue = queue.Queue()
+        future = Future()
+        request_id = next(self._request_ids)
+        self._streams[request_id] = stream_queue
+        with self._lock:
+            try:
+                replica = self._pick_replica()
+            except RuntimeError as e:
+                self._streams.pop(request_id, None)
+                yield {'event': 'error', 'error': str(e)}
+                return
+            replica.in_flight[request_id] = (future, time.time())
+        replica.request_queue.put((
+            'call', request_id, 'stream_ocr', (image, custom_prompt), {'image_name': image_name, 'max_tokens': max_tokens}
+        ))
+
+        finished = False
+        try:
+            while True:
+                try:
+                    event = stream_queue.get(timeout=self.ocr_timeout + 30)
+                except queue.Empty:
+                    yield {'event': 'error', 'error': f"OCR 處理超時 (超過 {self.ocr_timeout} 秒)"}
+                    return
+                if event is None:
+                    finished = True
+                    return
+                if event.get('event') == 'done':
+                    event['replica_id'] = replica.replica_id
+                yield event
+        finally:
+            self._streams.pop(request_id, None)
+            if not finished:
+                # 客戶端中途斷線或超時：通知副本停止生成
+                replica.request_queue.put(('cancel', request_id))
+
+    def iter_batch_ocr(self, images, custom_prompt=None, max_in_flight=None, include_timings=False, max_tokens=None):
+        """
+        逐張返回批次 OCR 結果（依完成順序），同時處理的圖片分散到各副本
+
+        Args:
+            images: 可迭代的 (圖片來源, 圖片名稱) 序列
+            custom_prompt: 自訂提示詞
+            max_in_flight: 同時處理中的圖片數上限，預設為所有副本的並發數總和
+            include_timings: 是否在每張圖片的結果中附上各階段耗時
+            max_tokens: 每張圖片的輸出 token 上限，None 表示依各圖片估計
+
+        Yields:
+            dict: 單張圖片的 OCR 結果（含 'index'，失敗時含 'error'）
+        """
+        window = max(1, int(max_in_flight or self.batch_window))
+        image_iter = enumerate(images)
+        exhausted = False
+        pending = {}
+
+        try:
+            while pending or not exhausted:
+                while not exhausted and len(pending) < window:
+                    try:
+                        index, (image, image_name) = next(image_iter)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    future = self.batch_request_executor.submit(
+                        self.perform_ocr, image, custom_prompt, image_name=image_name,
+                        include_timings=include_timings, max_tokens=max_tokens
+                    )
+                    pending[future] = (index, image_name)
+
+                if not pending:
+                    break
+
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    index, image_name = pending.pop(future)
+                    try:
+                        result = future.result()
+                    except FuturesTimeoutError:
+                        result = {
+                            'error': f"OCR 處理超時 (超過 {self.ocr_timeout} 秒)，請嘗試使用更小的圖片或增加超時設定",
+                            'image_path': image_name
+                        }
+                    except Exception as e:
+                        result = {'error': f"OCR 處理發生錯誤: {str(e)}", 'image_path': image_name}
+                    result['index'] = index
+                    yield result
+        finally:
+            for future in pending:
+                future.cancel()
+
+    def perform_batch_ocr(self, images, custom_prompt=None, image_names=None, include_timings=False, max_tokens=None):
+        """
+        對多張圖片執行批次 OCR 辨識（分散到各副本同時處理）
+
+        Args:
+            images: 圖片來源列表
+            custom_prompt: 自訂提示詞
+            image_names: 回應中顯示的圖片名稱列表（可選）
+            include_timings: 是否在每張圖片的結果中附上各階段耗時
+            max_tokens: 每張圖片的輸出 token 上限，None 表示依各圖片估計
+
+        Returns:
+            list: 與輸入順序一致的辨識結果列表
+        """
+        names = image_names or [None] * len(images)
+        results = sorted(
+            self.iter_batch_ocr(zip(images, names), custom_prompt, include_timings=include_timings, max_tokens=max_tokens),
+            key=lambda r: r['index']
+        )
+        for result in results:
+            result.pop('index', None)
+        return results
+
+    def _call_each(self, method, timeout=5.0):
+        """
+        對每個健康副本呼叫一次統計方法，回傳 {副本 ID: 結果}
+
+        統計查詢由副本的接收迴圈直接處理，不佔用推理執行器，也不影響路由的處理中請求數
+        """
+        futures = {}
+        for replica in self.replicas:
+            if replica.state != 'healthy':
+                continue
+            future = Future()
+            request_id = next(self._request_ids)
+            self._stats_calls[request_id] = future
+            replica.request_queue.put(('stats', request_id, method))
+            futures[replica.replica_id] = (request_id, future)
+
+        results = {}
+        for replica_id, (request_id, future) in futures.items():
+            try:
+                results[str(replica_id)] = future.result(timeout=timeout)
+            except Exception as e:
+                results[str(replica_id)] = {'error': str(e)}
+            finally:
+                self._stats_calls.pop(request_id, None)
+        return results
+
+    def get_batch_stats(self):
+        """取得各副本的微批次排程統計"""
+        return {'replicas': self._call_each('get_batch_stats')}
+
+    def get_cache_stats(self):
+        """取得各副本的 OCR 結果快取統計"""
+        return {'replicas': self._call_each('get_cache_stats')}
+
+    def get_vision_cache_stats(self):
+        """取得各副本的視覺編碼結果快取統計"""
+        return {'replicas': self._call_each('get_vision_cache_stats')}
+
+    def get_memory_stats(self):
+        """取得各副本的記憶體准入控制統計"""
+        return {'replicas': self._call_each('get_memory_stats')}
+
+    def get_allocator_stats(self):
+        """取得各副本的背景記憶體管理統計"""
+        return {'replicas': self._call_each('get_allocator_stats')}
+
+    def get_repetition_stats(self):
+        """取得各副本的生成中重複迴圈偵測統計"""
+        return {'replicas': self._call_each('get_repetition_stats')}
+
+    def get_stage_stats(self):
+        """取得各副本的階段耗時滾動統計"""
+        return {'replicas': self._call_each('get_stage_stats')}
+
+    def get_warmup_shapes(self):
+        """取得所有副本實際使用過的輸入尺寸（合併去重）"""
+        shapes = {}
+        for result in self._call_each('get_warmup_shapes').values():
+            if isinstance(result, list):
+                for shape in result:
+                    shapes[tuple(sorted(shape.items()))] = shape
+        return list(shapes.values())
+
+    def export_metrics(self):
+        """
+        收集各副本的指標（加上 replica 標籤）與副本池本身的狀態
+
+        Returns:
+            list: family 列表
+        """
+        families = []
+        for replica_id, result in self._call_each('export_metrics').items():
+            if isinstance(result, list):
+                families.extend(add_labels(result, replica=replica_id))
+
+        with self._lock:
+            replicas = [replica.get_stats() for replica in self.replicas]
+        families.append(family('ocr_replica_in_flight', 'gauge', '各副本處理中的請求數', [
+            ('ocr_replica_in_flight', {'replica': str(r['replica_id']), 'device': r['device']}, r['in_flight'])
+            for r in replicas
+        ]))
+        families.append(family('ocr_replica_healthy', 'gauge', '副本是否可接受請求（1 為健康）', [
+            ('ocr_replica_healthy', {'replica': str(r['replica_id']), 'device': r['device']}, int(r['state'] == 'healthy'))
+            for r in replicas
+        ]))
+        families.append(family('ocr_replica_restarts_total', 'counter', '副本行程重新啟動次數', [
+            ('ocr_replica_restarts_total', {'replica': str(r['replica_id']), 'device': r['device']}, r['restarts'])
+            for r in replicas
+        ]))
+        return families
+
+    def get_replica_stats(self):
+        """
+        取得副本池狀態
+
+        Returns:
+            dict: 各副本的設備、狀態、處理中請求數與延遲統計
+        """
+        with self._lock:
+            replicas = [replica.get_stats() for replica in self.replicas]
+        return {
+            'total': len(replicas),
+            'healthy': sum(1 for r in replicas if r['state'] == 'healthy'),
+            'replicas': replicas
+        }
+
+    def shutdown(self):
+        """停止所有副本"""
+        self._running = False
+        self.batch_request_executor.shutdown(wait=False, cancel_futures=True)
+        for replica in self.replicas:
+            if replica.process is None:
+                continue
+            try:
+                replica.request_queue.put(None)
+            except (OSError, ValueError):
+                pass
+        for replica in self.replicas:
+            if replica.process is None:
+                continue
+            replica.process.join(timeout=10)
+            if replica.process.is_alive():
+                replica.process.terminate()
@@ -0,0 +1,140 @@
+"""
+OCR 服務背景載入
+HTTP 伺服器先啟動並回應存活/就緒檢查，模型匯入、載入與暖機在背景執行緒中進行，
+並記錄每個啟動階段的耗時
+"""
+
+import threading
+import time
+import traceback
+from contextlib import contextmanager
+
+
+# 載入狀態（依啟動順序）
+# - pending: 尚未開始載入
+# - loading: 匯入推理套件並載入模型
+# - warming_up: 執行暖機推理
+# - ready: 可以處理 OCR 請求
+# - failed: 載入或暖機失敗（需要重啟行程）
+STATES = ('pending', 'loading', 'warming_up', 'ready', 'failed')
+
+
+class ServiceLoader:
+    """
+    在背景執行緒中建立 OCR 服務
+
+    build(loader) 負責匯入、建立服務與暖機，並以 loader.phase() 標記各階段；
+    返回的服務物件在 build 完成後才對外提供，避免請求使用尚未暖機的模型
+    """
+
+    def __init__(self, build, started_at=None):
+        """
+        Args:
+            build: 建立服務的函式，參數為此 loader，返回服務物件
+            started_at: 行程啟動時間（time.time()），預設為建立此物件的時間
+        """
+        self._build = build
+        self._lock = threading.Lock()
+        self._ready_event = threading.Event()
+        self._thread = None
+        self.state = 'pending'
+        self.service = None
+        self.error = None
+        self.phases = {}  # 階段名稱 → 秒（依完成順序）
+        self.details = {}  # 其他啟動資訊（例如編譯快取狀態），併入 get_status
+        self.started_at = started_at or time.time()
+        self.ready_at = None
+
+    def start(self):
+        """啟動背景載入執行緒（重複呼叫無作用）"""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name='ocr-service-loader', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        try:
+            service = self._build(self)
+        except Exception as e:
+            with self._lock:
+                self.state = 'failed'
+                self.error = f"{type(e).__name__}: {e}"
+            self._ready_event.set()
+            print(f"錯誤: OCR 服務載入失敗: {self.error}")
+            traceback.print_exc()
+            return
+
+        with self._lock:
+            self.service = service
+            self.state = 'ready'
+            self.ready_at = time.time()
+        self._ready_event.set()
+        print(f"OCR 服務已就緒（啟動耗時 {self.ready_at - self.started_at:.2f} 秒，"
+              f"各階段: {', '.join(f'{name}={seconds:.2f}s' for name, seconds in self.phases.items())}）")
+
+    @contextmanager
+    def phase(self, name, state='loading'):
+        """
+        標記並計時一個啟動階段
+
+        Args:
+            name: 階段名稱（例如 "import"、"model_load"、"warmup"）
+            state: 此階段對應的載入狀態
+        """
+        with self._lock:
+            self.state = state
+        print(f"啟動階段開始: {name}")
+        phase_start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - phase_start
+            with self._lock:
+                self.phases[name] = seconds
+            print(f"啟動階段完成: {name}（{seconds:.2f} 秒）")
+
+    def annotate(self, name, value):
+        """
+        記錄其他啟動資訊
+
+        Args:
+            name: 欄位名稱
+            value: 可轉為 JSON 的值
+        """
+        with self._lock:
+            self.details[name] = value
+
+    @property
+    def ready(self):
+        """服務是否可以處理請求"""
+        return self.state == 'ready'
+
+    def wait(self, timeout=None):
+        """
+        等待載入結束（成功或失敗）
+
+        Args:
+            timeout: 最長等待秒數，None 表示一直等待
+
+        Returns:
+            bool: 是否已就緒
+        """
+        self._ready_event.wait(timeout)
+        return self.ready
+
+    def get_status(self):
+        """
+        取得載入狀態與各階段耗時
+
+        Returns:
+            dict: state、各階段秒數、從行程啟動到就緒的秒數、錯誤訊息與 annotate 記錄的資訊
+        """
+        with self._lock:
+            now = self.ready_at or time.time()
+            return dict({
+                'state': self.state,
+                'phases': {name: round(seconds, 3) for name, seconds in self.phases.items()},
+                'elapsed_s': round(now - self.started_at, 3),
+                'error': self.error
+            }, **self.details)
@@ -0,0 +1,119 @@
+"""
+OCR 各處理階段耗時
+單一請求的耗時以 dict（階段名稱 → 秒）記錄，並彙整最近 N 個請求的滾動統計，
+用來判斷延遲主要來自哪一個階段
+"""
+
+from collections import deque
+
+
+# 依處理順序排列的階段名稱
+# - cache_lookup: 計算圖片雜湊並查詢結果快取
+# - prefetch_wait: 等待前處理預取佇列空位與前處理子行程（僅啟用前處理行程池時）
+# - image_decode: 解碼圖片
+# - precheck: 在縮圖上檢查圖片是否空白或模糊（可讀性預檢）
+# - image_analysis: 估計文字密度並選擇解析度（自動解析度模式），或只估計文字密度（輸出 token 預算）
+# - memory_check: 記錄設備記憶體並估計請求的峰值記憶體
+# - queue: 等待推理執行器或微批次排程器
+# - preprocess: 縮放、裁切與 tokenize（CPU）
+# - memory_wait: 等待記憶體准入控制的預算
+# - collate: 合併批次並傳輸到推理設備
+# - vision_encode: 視覺編碼器（SAM、CLIP 與投影層）
+# - prefill: 語言模型預填（不含視覺編碼）
+# - token_generation: 逐 token 生成
+# - detokenize: 將 token 解碼為文字
+# - postprocess: 移除重複內容與結果檢查
+STAGES = (
+    'cache_lookup', 'prefetch_wait', 'image_decode', 'precheck', 'image_analysis', 'memory_check', 'queue', 'preprocess',
+    'memory_wait', 'collate', 'vision_encode', 'prefill', 'token_generation', 'detokenize', 'postprocess'
+)
+
+
+def format_timings(timings):
+    """
+    將階段耗時轉為回應中的 timings 物件（毫秒，依處理順序排列，未經過的階段省略）
+
+    Args:
+        timings: 階段名稱 → 秒
+
+    Returns:
+        dict: 例如 {'queue_ms': 12.3, ..., 'total_ms': 812.4}
+    """
+    formatted = {}
+    for stage in STAGES + tuple(sorted(set(timings) - set(STAGES) - {'total'})) + ('total',):
+        if stage in timings:
+            formatted[f"{stage}_ms"] = round(timings[stage] * 1000, 1)
+    return formatted
+
+
+def _percentile(sorted_values, fraction):
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class RollingStageStats:
+    """
+    最近 window 個請求的各階段耗時統計
+
+    每個請求的耗時 dict 整筆放入有上限的 deque（append 在 GIL 下是原子操作，記錄時不需要鎖），
+    查詢統計時才複製並計算，所有階段的比例都以同一批請求為基準
+    """
+
+    def __init__(self, window=1000):
+        """
+        Args:
+            window: 保留的請求數
+        """
+        self.window = max(1, int(window))
+        self._requests = deque(maxlen=self.window)
+
+    def record(self, timings):
+        """
+        記錄一個請求的階段耗時
+
+        Args:
+            timings: 階段名稱 → 秒（應包含 'total'）
+        """
+        self._requests.append(dict(timings))
+
+    def get_stats(self):
+        """
+        取得各階段的滾動統計
+
+        Returns:
+            dict: 每個階段的次數、平均、p50、p95、最大值（毫秒）與佔總耗時的比例，
+                  以及佔比最高的階段（slowest_stage）
+        """
+        requests = self._requests.copy()
+        if not requests:
+            return {'window': self.window, 'requests': 0, 'stages': {}, 'slowest_stage': None}
+
+        samples = {}
+        for timings in requests:
+            for stage, seconds in timings.items():
+                samples.setdefault(stage, []).append(seconds)
+
+        total_seconds = sum(samples.get('total', [])) or None
+        stages = {}
+        for stage in STAGES + tuple(sorted(set(samples) - set(STAGES) - {'total'})) + ('total',):
+            values = samples.get(stage)
+            if not values:
+                continue
+            values.sort()
+            stages[stage] = {
+                'count': len(values),
+                'mean_ms': round(sum(values) / len(values) * 1000, 1),
+                'p50_ms': round(_percentile(values, 0.5) * 1000, 1),
+                'p95_ms': round(_percentile(values, 0.95) * 1000, 1),
+                'max_ms': round(values[-1] * 1000, 1),
+                'share': round(sum(values) / total_seconds, 4) if total_seconds else None
+            }
+
+        ranked = [stage for stage in stages if stage != 'total' and stages[stage]['share'] is not None]
+        slowest = max(ranked, key=lambda stage: stages[stage]['share']) if ranked else None
+        return {
+            'window': self.window,
+            'requests': len(requests),
+            'stages': stages,
+            'slowest_stage': slowest
+        }
@@ -38,22 +38,44 @@ mkdir -p uploads logs output
 # 設定預設的 OCR 參數（如未設定）
 export OCR_BASE_SIZE=${OCR_BASE_SIZE:-1024}
 export OCR_IMAGE_SIZE=${OCR_IMAGE_SIZE:-640}
+export OCR_BATCH_MAX_SIZE=${OCR_BATCH_MAX_SIZE:-1}
+export OCR_MAX_CONCURRENT=${OCR_MAX_CONCURRENT:-2}
+# 多副本推理：例如 "auto"、"cuda:0,cuda:1" 或 "cpu,cpu"（空字串表示單一行程）
+export OCR_DEVICES=${OCR_DEVICES:-}
+
+# 推理結果直接從 generate 取得（不攔截 stdout），可用多執行緒同時處理請求
+# 執行緒數預設為批次大小與並發推理上限兩者中較大者
+if [ "$OCR_BATCH_MAX_SIZE" -gt "$OCR_MAX_CONCURRENT" ]; then
+    DEFAULT_THREADS=$OCR_BATCH_MAX_SIZE
+else
+    DEFAULT_THREADS=$OCR_MAX_CONCURRENT
+fi
+# 多副本時，執行緒數乘上副本數，讓每個副本都有請求可處理
+if [ -n "$OCR_DEVICES" ] && [ "$OCR_DEVICES" != "auto" ]; then
+    REPLICA_COUNT=$(echo "$OCR_DEVICES" | tr ',' '\n' | grep -c .)
+    DEFAULT_THREADS=$((DEFAULT_THREADS * REPLICA_COUNT))
+fi
+GUNICORN_THREADS=${GUNICORN_THREADS:-$DEFAULT_THREADS}
 
 echo ""
 echo "OCR 參數設定:"
 echo "  - OCR_BASE_SIZE: $OCR_BASE_SIZE"
 echo "  - OCR_IMAGE_SIZE: $OCR_IMAGE_SIZE"
+echo "  - OCR_BATCH_MAX_SIZE: $OCR_BATCH_MAX_SIZE"
+echo "  - OCR_MAX_CONCURRENT: $OCR_MAX_CONCURRENT"
+echo "  - OCR_DEVICES: ${OCR_DEVICES:-(單一行程)}"
 
 # 使用 Gunicorn 啟動應用（使用標準版本）
 echo ""
 echo "====================================="
 echo "正在使用 Gunicorn 啟動伺服器..."
-echo "Workers: 1 (OCR 模型需要大量 GPU 記憶體)"
+echo "Workers: 1 (OCR 模型需要大量 GPU 記憶體；多設備時由副本池在子行程中載入模型)"
+echo "Threads: $GUNICORN_THREADS"
 echo "Port: 5000"
 echo "Timeout: 300 秒"
 echo "====================================="
 
-gunicorn -w 1 -b 0.0.0.0:5000 \
+gunicorn -w 1 --threads $GUNICORN_THREADS -b 0.0.0.0:5000 \
     --timeout 300 \
     --access-logfile logs/access.log \
     --error-logfile logs/error.log \
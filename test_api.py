@@ -1,9 +1,14 @@
 """
 DeepSeek-OCR API 測試腳本
+確認各端點能正常運作；吞吐量與延遲請使用 benchmark.py
 """
 
 import requests
 import os
+import io
+import random
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image, ImageDraw, ImageFont
 
 
 def test_health_check():
@@ -123,6 +128,68 @@ def test_batch_ocr(image_paths):
     print()
 
 
+def _make_number_image(number):
+    """產生只包含一組數字的測試圖片（PNG 位元組）"""
+    try:
+        font = ImageFont.load_default(size=96)
+    except TypeError:
+        # Pillow < 10.1 的預設字型無法調整大小
+        font = ImageFont.load_default()
+    
+    image = Image.new('RGB', (800, 240), 'white')
+    draw = ImageDraw.Draw(image)
+    draw.text((40, 60), str(number), fill='black', font=font)
+    
+    buffer = io.BytesIO()
+    image.save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def test_concurrent_ocr(num_requests=4):
+    """
+    測試並發 OCR：同時送出多張內容不同的圖片，確認每個回應只包含自己圖片中的數字
+    
+    Args:
+        num_requests: 同時送出的請求數
+    """
+    print("=" * 60)
+    print(f"測試並發 OCR（{num_requests} 個同時請求）...")
+    print("=" * 60)
+    
+    numbers = random.sample(range(100000, 1000000), num_requests)
+    
+    def _send(number):
+        files = {'file': (f"{number}.png", _make_number_image(number), 'image/png')}
+        response = requests.post("http://localhost:5000/ocr", files=files)
+        return number, response
+    
+    with ThreadPoolExecutor(max_workers=num_requests) as executor:
+        responses = list(executor.map(_send, numbers))
+    
+    crossed = 0
+    for number, response in responses:
+        if response.status_code != 200:
+            print(f"  {number}: 錯誤 {response.status_code} - {response.json()}")
+            continue
+        
+        text = response.json().get('text', '')
+        others = [str(n) for n in numbers if n != number and str(n) in text]
+        if others:
+            crossed += 1
+            print(f"  {number}: ✗ 結果中出現其他請求的數字 {others}: {text!r}")
+        elif str(number) in text:
+            print(f"  {number}: ✓ {text!r}")
+        else:
+            print(f"  {number}: ? 未辨識出數字（但沒有混入其他請求）: {text!r}")
+    
+    if crossed:
+        print(f"並發測試失敗: {crossed} 個回應混入其他請求的結果")
+    else:
+        print("並發測試通過: 沒有任何回應混入其他請求的結果")
+    
+    print()
+
+
 if __name__ == '__main__':
     # 測試健康檢查
     test_health_check()
@@ -141,4 +208,7 @@ if __name__ == '__main__':
     
     # 測試批次 OCR（如果有多張圖片）
     # test_batch_ocr(['image1.png', 'image2.png', 'image3.png'])
+    
+    # 測試並發請求的結果不會互相混雜
+    test_concurrent_ocr(num_requests=4)
 
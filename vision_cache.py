@@ -0,0 +1,114 @@
+"""
+視覺編碼結果快取
+同一張圖片以不同提示詞重新辨識時（例如先 Free OCR 再轉 Markdown），
+直接使用快取的視覺 token embedding，跳過 SAM、CLIP 與投影層，只重新執行語言模型
+"""
+
+import threading
+from collections import OrderedDict
+
+
+def build_vision_key(image_key, base_size, image_size, crop_mode):
+    """
+    建立視覺編碼結果的快取鍵值（視覺特徵只取決於圖片內容與解析度設定，與提示詞無關）
+
+    Args:
+        image_key: 圖片內容雜湊
+        base_size: 全域視圖尺寸
+        image_size: 局部裁切尺寸
+        crop_mode: 是否啟用裁切模式
+
+    Returns:
+        str: 鍵值
+    """
+    return f"{image_key}:{base_size}:{image_size}:{int(bool(crop_mode))}"
+
+
+class VisionFeatureCache:
+    """
+    以位元組數為上限的視覺編碼結果 LRU 快取
+
+    特徵存放在主記憶體（不佔用推理設備記憶體），命中時再傳回推理設備；
+    每個項目記錄當初的編碼耗時，用來統計命中時省下的視覺編碼時間
+    """
+
+    def __init__(self, max_mb=256):
+        """
+        Args:
+            max_mb: 快取大小上限（MB）
+        """
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (value, 位元組數, 編碼秒數)
+        self._bytes = 0
+        self._stats = {
+            'hits': 0,
+            'misses': 0,
+            'evictions': 0,
+            'saved_seconds': 0.0
+        }
+
+    def get(self, key):
+        """
+        查詢快取，命中時累計省下的編碼時間
+
+        Args:
+            key: build_vision_key 產生的鍵值（可加上視圖後綴）
+
+        Returns:
+            object: 快取的特徵，未命中時返回 None
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats['hits'] += 1
+            self._stats['saved_seconds'] += entry[2]
+            return entry[0]
+
+    def put(self, key, value, nbytes, encode_seconds):
+        """
+        寫入快取，超過大小上限時淘汰最久未使用的項目
+
+        Args:
+            key: 鍵值
+            value: 特徵（應已移到主記憶體）
+            nbytes: 特徵佔用的位元組數
+            encode_seconds: 編碼耗時（秒）
+        """
+        if nbytes > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._entries[key] = (value, nbytes, encode_seconds)
+            self._bytes += nbytes
+            while self._bytes > self.max_bytes and self._entries:
+                _, (_, evicted_bytes, _) = self._entries.popitem(last=False)
+                self._bytes -= evicted_bytes
+                self._stats['evictions'] += 1
+
+    def get_stats(self):
+        """
+        取得快取統計
+
+        Returns:
+            dict: 命中/未命中/淘汰次數、命中率、目前大小與省下的編碼秒數
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            entries = len(self._entries)
+            used_bytes = self._bytes
+        lookups = stats['hits'] + stats['misses']
+        stats.update({
+            'enabled': True,
+            'hit_ratio': round(stats['hits'] / lookups, 4) if lookups else 0.0,
+            'saved_seconds': round(stats['saved_seconds'], 3),
+            'entries': entries,
+            'bytes': used_bytes,
+            'max_bytes': self.max_bytes
+        })
+        return stats